@@ -1,15 +1,40 @@
-CREATE OR REPLACE FUNCTION init_schema(name text) 
+DROP FUNCTION IF EXISTS init_schema(text);
+DROP FUNCTION IF EXISTS init_schema(text, text);
+
+CREATE OR REPLACE FUNCTION init_schema(name text, partition_unit text DEFAULT NULL,
+                                       deferred boolean DEFAULT FALSE) 
    RETURNS void AS
 $BODY$
+    DECLARE
+      -- active_fire, threshold_burned and fire_events are range partitioned
+      -- on collection_date when partition_unit is 'week' or 'month'. The 
+      -- partitions themselves are made by viirs_ensure_partition.
+      partitioned boolean := partition_unit IS NOT NULL ;
+      part_clause text := '' ;
+      only_clause text := 'ONLY ' ;
+      -- When deferred, the tables are made without their keys and indexes, 
+      -- which viirs_build_indexes adds once they have been loaded, and 
+      -- (unless partitioned) UNLOGGED.
+      unlogged text := '' ;
     BEGIN
 
+    IF partitioned THEN
+      IF partition_unit NOT IN ('week', 'month') THEN
+        RAISE EXCEPTION 'Unknown partition unit: %', partition_unit ;
+      END IF ;
+      part_clause := ' PARTITION BY RANGE (collection_date)' ;
+      only_clause := '' ;
+    ELSIF deferred THEN
+      unlogged := 'UNLOGGED ' ;
+    END IF ;
+
     EXECUTE 'DROP SCHEMA IF EXISTS ' || quote_ident(name) || ' CASCADE' ;
     EXECUTE 'CREATE SCHEMA ' || quote_ident(name) ; 
     
     --
     -- Name: active_fire; Type: TABLE; Schema: public; Owner: postgres
     --
-    EXECUTE 'CREATE TABLE ' || quote_ident(name) || '.active_fire (' ||
+    EXECUTE 'CREATE ' || unlogged || 'TABLE ' || quote_ident(name) || '.active_fire (' ||
         'fid bigint NOT NULL, ' ||
         'latitude real, ' || 
         'longitude real, ' || 
@@ -19,7 +44,8 @@ $BODY$
         'pixel_size integer NOT NULL, ' ||
         'band_i_m character(1) NOT NULL, ' ||
         'masked boolean DEFAULT FALSE, ' || 
-        'geom_nlcd geometry)';
+        'geom_nlcd geometry, ' ||
+        'geom_albers geometry(Point,102008))' || part_clause;
     
     
     EXECUTE 'ALTER TABLE ' || quote_ident(name) || '.active_fire OWNER TO postgres';
@@ -50,7 +76,7 @@ $BODY$
     -- Name: fire_collections; Type: TABLE; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'CREATE TABLE ' || quote_ident(name) || '.fire_collections (' ||
+    EXECUTE 'CREATE ' || unlogged || 'TABLE ' || quote_ident(name) || '.fire_collections (' ||
         'fid bigint NOT NULL, ' ||
         'active boolean, ' ||
         'initial_fid bigint, ' ||
@@ -86,7 +112,7 @@ $BODY$
     -- Name: fire_events; Type: TABLE; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'CREATE TABLE ' || quote_ident(name) || '.fire_events (' ||
+    EXECUTE 'CREATE ' || unlogged || 'TABLE ' || quote_ident(name) || '.fire_events (' ||
         'fid bigint NOT NULL, ' || 
         'latitude real, ' || 
         'longitude real, ' || 
@@ -95,7 +121,8 @@ $BODY$
         'collection_id bigint, ' || 
         'collection_date timestamp without time zone, ' ||
         'pixel_size integer NOT NULL, ' ||
-        'band_i_m character(1) NOT NULL)';
+        'band_i_m character(1) NOT NULL, ' ||
+        'geom_nlcd geometry)' || part_clause;
     
     
     EXECUTE 'ALTER TABLE ' || quote_ident(name) || '.fire_events OWNER TO postgres';
@@ -126,7 +153,7 @@ $BODY$
     -- Name: threshold_burned; Type: TABLE; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'CREATE TABLE ' || quote_ident(name) || '.threshold_burned (' || 
+    EXECUTE 'CREATE ' || unlogged || 'TABLE ' || quote_ident(name) || '.threshold_burned (' || 
         'fid bigint NOT NULL, ' ||
         'latitude real, ' ||
         'longitude real, ' ||
@@ -136,7 +163,8 @@ $BODY$
         'pixel_size integer NOT NULL, ' ||
         'band_i_m character(1) NOT NULL, ' || 
         'masked boolean DEFAULT FALSE, ' ||
-        'geom_nlcd geometry)';
+        'geom_nlcd geometry, ' ||
+        'geom_albers geometry(Point,102008))' || part_clause;
     
     
     EXECUTE 'ALTER TABLE ' || quote_ident(name) || '.threshold_burned OWNER TO postgres';
@@ -167,7 +195,7 @@ $BODY$
     -- Name: fid; Type: DEFAULT; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || 
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) || 
       '.active_fire ALTER COLUMN fid SET DEFAULT ' ||
       'nextval(' || quote_literal(quote_ident(name) || '.active_fire_fid_seq') || '::regclass)';
     
@@ -185,7 +213,7 @@ $BODY$
     -- Name: fid; Type: DEFAULT; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) ||
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) ||
        '.fire_events ALTER COLUMN fid SET DEFAULT ' ||
        'nextval(' || quote_literal(quote_ident(name) || '.fire_events_fid_seq') || '::regclass)';
     
@@ -194,116 +222,28 @@ $BODY$
     -- Name: fid; Type: DEFAULT; Schema: public; Owner: postgres
     --
     
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || 
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) || 
       '.threshold_burned ALTER COLUMN fid SET DEFAULT ' ||
       'nextval(' || quote_literal(quote_ident(name) || '.threshold_burned_fid_seq') || '::regclass)';
     
     
-    --
-    -- Name: active_fire_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || '.active_fire ' || 
-        'ADD CONSTRAINT ' || quote_ident(name || '_active_fire_pkey') || ' PRIMARY KEY (fid)';
-    
-    
-    --
-    -- Name: fire_collections_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || '.fire_collections ' || 
-        'ADD CONSTRAINT ' || quote_ident(name || '_fire_collections_pkey') || ' PRIMARY KEY (fid)';
-    
-    
-    --
-    -- Name: fire_events_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || '.fire_events ' || 
-        'ADD CONSTRAINT ' || quote_ident(name || '_fire_events_pkey') || ' PRIMARY KEY (fid)';
-    
-    
-    --
-    -- Name: threshold_burned_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || '.threshold_burned ' || 
-        'ADD CONSTRAINT ' || quote_ident(name || '_threshold_burned_pkey') || ' PRIMARY KEY (fid)';
-    
-    
-    --
-    -- Name: idx_active_fire_geom; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_active_fire_geom') || ' ON ' || 
-       quote_ident(name) || '.active_fire USING gist (geom)';
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||name||'_active_fire_geom_nlcd') || 
-           ' ON ' || quote_ident(name) || '.active_fire USING GIST (geom_nlcd)' ;
-    
-    --
-    -- Name: idx_fire_events_geom; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_geom') || ' ON ' || 
-       quote_ident(name) || '.fire_events USING gist (geom)';
-    
-    
-    --
-    -- Name: idx_threshold_burned_geom; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_threshold_burned_geom') || ' ON ' || 
-       quote_ident(name) || '.threshold_burned USING gist (geom)';
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||name||'_threshold_burned_geom_nlcd') || 
-            ' ON ' || quote_ident(name) || '.threshold_burned USING GIST (geom_nlcd)' ;
-
-    --
-    -- Name: idx_fire_collections_last_update; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_collections_last_update') || ' ON ' || 
-       quote_ident(name) || '.fire_collections (last_update DESC NULLS LAST)';
-
-    --
-    -- Name: idx_fire_collections_fid; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_collections_fid') || ' ON ' || 
-       quote_ident(name) || '.fire_collections (fid)';
-
-    --
-    -- Name: idx_fire_events_collection_id; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_collection_id') || ' ON ' || 
-       quote_ident(name) || '.fire_events (collection_id)';
+    IF NOT deferred THEN
+      PERFORM viirs_build_indexes(name, FALSE, FALSE) ;
+    END IF ;
 
     --
-    -- Name: idx_fire_events_source; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_source') || ' ON ' || 
-       quote_ident(name) || '.fire_events (source)';
-
-    --
-    -- Name: idx_active_fire_collection_date; Type: INDEX; Schema: public; Owner: postgres
-    --
-    
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_active_fire_collection_date') || ' ON ' || 
-       quote_ident(name) || '.active_fire (collection_date)';
-
+    -- Name: active_events; Type: TABLE; Schema: public; Owner: postgres
     --
-    -- Name: idx_threshold_burned_collection_date; Type: INDEX; Schema: public; Owner: postgres
+    -- The fire events of the currently active collections, maintained by 
+    -- the confirmation functions so that they need not search fire_events.
     --
     
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_threshold_burned_collection_date') || ' ON ' || 
-       quote_ident(name) || '.threshold_burned (collection_date)';
+    PERFORM viirs_ensure_active_events(name) ;
               
     END
 $BODY$ 
   LANGUAGE plpgsql VOLATILE
   COST 100 ; 
-ALTER FUNCTION init_schema(text)
+ALTER FUNCTION init_schema(text, text, boolean)
   OWNER to postgres ;
 
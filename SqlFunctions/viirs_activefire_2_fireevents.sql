@@ -1,6 +1,7 @@
--- Function: viirs_activefire_2_fireevents(timestamp without time zone, interval, integer)
+-- Function: viirs_activefire_2_fireevents(varchar(200), timestamp without time zone, interval, integer, text, text, boolean)
 
--- DROP FUNCTION viirs_activefire_2_fireevents(timestamp without time zone, interval, integer);
+-- the version without af_only would make calls with six arguments ambiguous
+DROP FUNCTION IF EXISTS viirs_activefire_2_fireevents(varchar(200), timestamp without time zone, interval, integer, text, text);
 
 CREATE OR REPLACE FUNCTION viirs_activefire_2_fireevents(
     varchar(200),
@@ -8,7 +9,8 @@ CREATE OR REPLACE FUNCTION viirs_activefire_2_fireevents(
     interval,
     integer,
     text DEFAULT NULL,
-    text DEFAULT NULL
+    text DEFAULT NULL,
+    boolean DEFAULT FALSE
     )
   RETURNS void AS
 $BODY$
@@ -19,61 +21,106 @@ DECLARE
   distance integer := $4; 
   lm_schema text := $5 ; 
   lm_table  text:= $6 ;  
---   a_row active_fire%rowtype;
-  a_row RECORD;
-  ret RECORD;
-  dumrec RECORD;
-  dumint integer;
-  query_str text;
-  tempFID integer;
-  select_collection text ; 
-  append_point_to_collection text ; 
-  update_existing_collection text  ;
-  create_new_collection text ; 
-  insert_first_point text  ;
-  loop_query text ;
+  af_only boolean := $7 ; 
+  select_points text ; 
+  match_existing text ; 
+  find_clusters text ; 
+  join_cluster text ; 
+  create_new_collections text ; 
+  insert_events text ; 
+  update_collections text ; 
+  update_active text ; 
+  prune_active text ; 
+  added RECORD ; 
   
 BEGIN
-  -- selects currently active collections, to which the fire point should belong.
-  select_collection := 'SELECT * from (SELECT fe.fid as fe_fid, ' || 
-                       'fe.geom, fc.fid as fc_fid ' || 
-                   'FROM ' || quote_ident(schema) || '.fire_events fe, ' || 
-                              quote_ident(schema) || '.fire_collections fc ' || 
-                   'WHERE fe.collection_id = fc.fid ' ||
-                     'AND fc.last_update >= $1 - $2 ' || 
-                     'AND fc.last_update <= $1) as tf ' ||  
-    'WHERE ST_DWithin(ST_Transform($4, 102008), tf.geom, $3) LIMIT 1' ;
-    
-  append_point_to_collection := 'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
+  -- The date's active fire points are processed as a set. A point within
+  -- distance of an event in a currently active collection joins the
+  -- collection of the nearest such event. Points within distance of each
+  -- other are chained into clusters: unmatched points join the lowest
+  -- numbered collection matched by any point of their cluster, and a 
+  -- cluster with no matches at all becomes a new collection. This is the 
+  -- result the old point-by-point loop gave, except where a point could 
+  -- reach more than one collection; the loop then took whichever it found
+  -- first, which depended on the order of the rows.
+  --
+  -- The events of the active collections are looked up in active_events,
+  -- which holds a copy of each event (and its collection's last_update) 
+  -- for as long as the collection stays active. The search therefore does
+  -- not grow with fire_events over the season.
+  --
+  -- If af_only is set, points are only matched to ActiveFire events. The
+  -- collections then do not depend on the thresholded burned area, and 
+  -- runs differing only in their thresholds can share them (see 
+  -- viirs_copy_af_collections).
+
+  -- the unmasked active fire points from the specified collection.
+  select_points := 'CREATE TEMPORARY TABLE af_pts ON COMMIT DROP AS ' || 
+      'SELECT fid, latitude, longitude, collection_date, pixel_size, band_i_m, ' ||
+             'COALESCE(geom_albers, ST_Transform(geom, 102008)) as geom, geom_nlcd, ' ||
+             'NULL::bigint as fc_fid, NULL::bigint as cluster_fid ' ||
+      'FROM ' || quote_ident(schema)||'.active_fire ' ||
+      'WHERE collection_date = $1 AND NOT masked' ; 
+
+  -- matches points to currently active collections, nearest event first.
+  match_existing := 'UPDATE af_pts p SET fc_fid = m.fc_fid FROM ' || 
+      '(SELECT DISTINCT ON (a.fid) a.fid, fe.collection_id as fc_fid ' ||
+       'FROM af_pts a, ' || 
+            quote_ident(schema) || '.active_events ae ' || 
+       'WHERE ae.last_update >= $1 - $2 ' || 
+         'AND ae.last_update <= $1 ' ||
+         'AND ST_DWithin(a.geom, ae.geom, $3) ' ||
+         'AND (NOT $4 OR ae.source = ' || quote_literal('ActiveFire') || ') ' ||
+       'ORDER BY a.fid, ST_Distance(a.geom, ae.geom), ae.collection_id) m ' || 
+      'WHERE p.fid = m.fid' ; 
+
+  -- connected components of the points (DBSCAN with minpoints=1), each
+  -- identified by the lowest active_fire fid it contains.
+  find_clusters := 'UPDATE af_pts p SET cluster_fid = c.cluster_fid FROM ' ||
+      '(SELECT fid, min(fid) OVER (PARTITION BY cid) as cluster_fid FROM ' ||
+         '(SELECT fid, ST_ClusterDBSCAN(geom, eps := $1, minpoints := 1) ' || 
+                 'OVER () as cid FROM af_pts) d) c ' ||
+      'WHERE p.fid = c.fid' ; 
+
+  join_cluster := 'UPDATE af_pts p SET fc_fid = c.fc_fid FROM ' ||
+      '(SELECT cluster_fid, min(fc_fid) as fc_fid FROM af_pts ' || 
+       'WHERE fc_fid IS NOT NULL GROUP BY cluster_fid) c ' ||
+      'WHERE p.fc_fid IS NULL AND p.cluster_fid = c.cluster_fid' ; 
+
+  create_new_collections := 'WITH new_fc AS (' || 
+        'INSERT INTO ' || quote_ident(schema) || '.fire_collections '||
+        '(initial_date, last_update, active, initial_fid) ' || 
+        'SELECT $1, $1, TRUE, cluster_fid FROM af_pts ' || 
+        'WHERE fc_fid IS NULL GROUP BY cluster_fid ' ||
+        'RETURNING fid, initial_fid) ' || 
+      'UPDATE af_pts p SET fc_fid = n.fid FROM new_fc n ' ||
+      'WHERE p.fc_fid IS NULL AND p.cluster_fid = n.initial_fid' ; 
+
+  insert_events := 'WITH new_fe AS (' || 
+        'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
         '(latitude, longitude, geom, source, collection_id, ' ||
-        'collection_date, pixel_size, band_i_m) ' || 
-        'VALUES($1, $2, ' ||
-        'ST_Transform($3, 102008), ' ||
+        'collection_date, pixel_size, band_i_m, geom_nlcd) ' || 
+        'SELECT latitude, longitude, geom, ' || 
         quote_literal('ActiveFire') ||
-        ' , $4, $5, $6, $7)';
+        ', fc_fid, collection_date, pixel_size, band_i_m, geom_nlcd ' ||
+        'FROM af_pts ORDER BY fid ' || 
+        'RETURNING fid, collection_id, source, geom) ' ||
+      'INSERT INTO ' || quote_ident(schema) || '.active_events ' || 
+        '(event_fid, collection_id, last_update, source, geom) ' ||
+        'SELECT fid, collection_id, $1, source, geom FROM new_fe' ;
 
-  update_existing_collection := 'UPDATE ' || quote_ident(schema) || '.fire_collections ' ||
+  update_collections := 'UPDATE ' || quote_ident(schema) || '.fire_collections fc ' ||
       'SET last_update = $1 ' || 
-      'WHERE $2 = ' || quote_ident(schema) || '.fire_collections.fid';
-
-  create_new_collection := 'INSERT INTO ' || quote_ident(schema) || '.fire_collections '||
-     '(initial_date, last_update, active, initial_fid) ' || 
-     'VALUES($1, $1, TRUE, $2) ' ||
-     'RETURNING fid as collectionFid';
-     
-  insert_first_point := 'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
-      '(latitude, longitude, geom, source, collection_id, ' || 
-      'collection_date, pixel_size, band_i_m) ' || 
-      'VALUES($1, $2, ' ||
-      'ST_Transform($3, 102008), ' ||
-      quote_literal('ActiveFire') || 
-      ', $4, $5, $6, $7)';    
+      'WHERE fc.fid IN (SELECT DISTINCT fc_fid FROM af_pts)';
 
+  update_active := 'UPDATE ' || quote_ident(schema) || '.active_events ae ' ||
+      'SET last_update = $1 ' || 
+      'WHERE ae.collection_id IN (SELECT DISTINCT fc_fid FROM af_pts)';
 
-      
-  -- loops over all candidate active fire pixels from the specified collection.
-  loop_query := 'SELECT a.* FROM ' || quote_ident(schema)||'.active_fire a ' ||
-                'WHERE collection_date = $1 AND NOT masked' ; 
+  -- collections last updated before the window are no longer active. 
+  -- Dates are confirmed in order, so they never will be again.
+  prune_active := 'DELETE FROM ' || quote_ident(schema) || '.active_events ' ||
+      'WHERE last_update < $1 - $2' ; 
 
   -- masks active fire points in the current collection by the landmask
   IF lm_schema IS NOT NULL THEN
@@ -81,24 +128,28 @@ BEGIN
                              lm_table, 'geom', collection) ; 
   END IF ; 
   
-  FOR a_row IN EXECUTE loop_query USING collection 
-  LOOP
-  EXECUTE select_collection INTO dumrec USING collection, recent, distance, a_row.geom ;
-  IF dumrec IS NOT NULL THEN 
-    RAISE NOTICE 'found a match' ;
-    EXECUTE append_point_to_collection USING a_row.latitude, a_row.longitude, a_row.geom, dumrec.fc_fid,
-        a_row.collection_date, a_row.pixel_size, a_row.band_i_m ; 
-    EXECUTE update_existing_collection USING a_row.collection_date, dumrec.fc_fid ; 
-  ELSE
-    EXECUTE create_new_collection INTO tempFID USING a_row.collection_date, a_row.fid ; 
-    EXECUTE insert_first_point USING a_row.latitude, a_row.longitude, a_row.geom, tempFID,
-        a_row.collection_date, a_row.pixel_size, a_row.band_i_m ; 
-  END IF;
-  END LOOP;
+  -- schemas made before active_events was introduced
+  PERFORM viirs_ensure_active_events(schema) ;
+
+  -- the session may be reused, and may have called this already in the
+  -- current transaction.
+  DROP TABLE IF EXISTS pg_temp.af_pts ;
+  EXECUTE prune_active USING collection, recent ; 
+  EXECUTE select_points USING collection ; 
+  EXECUTE 'SELECT count(*) as c FROM af_pts' INTO added ; 
+  RAISE NOTICE 'adding % active fire points.', added.c ;
+
+  EXECUTE match_existing USING collection, recent, distance, af_only ; 
+  EXECUTE find_clusters USING distance ; 
+  EXECUTE join_cluster ; 
+  EXECUTE create_new_collections USING collection ; 
+  EXECUTE insert_events USING collection ; 
+  EXECUTE update_collections USING collection ; 
+  EXECUTE update_active USING collection ; 
 return;
 END
 $BODY$
   LANGUAGE plpgsql VOLATILE
   COST 100;
-ALTER FUNCTION viirs_activefire_2_fireevents(varchar(200), timestamp without time zone, interval, integer, text, text)
+ALTER FUNCTION viirs_activefire_2_fireevents(varchar(200), timestamp without time zone, interval, integer, text, text, boolean)
   OWNER TO postgres;
@@ -0,0 +1,155 @@
+-- Function: viirs_build_indexes(text, boolean, boolean)
+
+-- DROP FUNCTION viirs_build_indexes(text, boolean, boolean);
+
+CREATE OR REPLACE FUNCTION viirs_build_indexes(name text, set_logged boolean DEFAULT FALSE,
+                                               do_analyze boolean DEFAULT TRUE) 
+   RETURNS void AS
+$BODY$
+    DECLARE
+      -- the keys and indexes of the point and event tables of a schema made
+      -- by init_schema. init_schema builds them itself unless deferred, in
+      -- which case this is called once the tables have been loaded. The
+      -- UNLOGGED tables of a deferred schema are kept so unless set_logged.
+      partitioned boolean ;
+      only_clause text := 'ONLY ' ;
+      date_index text := '' ;
+      pkey text := 'fid' ;
+      tbl text ;
+    BEGIN
+
+    SELECT c.relkind = 'p' INTO partitioned FROM pg_class c 
+      WHERE c.oid = to_regclass(quote_ident(name) || '.active_fire') ;
+    IF partitioned IS NULL THEN
+      RAISE EXCEPTION 'No active_fire table in schema %', name ;
+    END IF ;
+    IF partitioned THEN
+      only_clause := '' ;
+      date_index := 'USING brin ' ;
+      -- the key of a partitioned table must include the partition column
+      pkey := 'fid, collection_date' ;
+    END IF ;
+
+    --
+    -- Name: active_fire_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) || '.active_fire ' || 
+        'ADD CONSTRAINT ' || quote_ident(name || '_active_fire_pkey') || ' PRIMARY KEY (' || pkey || ')';
+    
+    
+    --
+    -- Name: fire_collections_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'ALTER TABLE ONLY ' || quote_ident(name) || '.fire_collections ' || 
+        'ADD CONSTRAINT ' || quote_ident(name || '_fire_collections_pkey') || ' PRIMARY KEY (fid)';
+    
+    
+    --
+    -- Name: fire_events_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) || '.fire_events ' || 
+        'ADD CONSTRAINT ' || quote_ident(name || '_fire_events_pkey') || ' PRIMARY KEY (' || pkey || ')';
+    
+    
+    --
+    -- Name: threshold_burned_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'ALTER TABLE ' || only_clause || quote_ident(name) || '.threshold_burned ' || 
+        'ADD CONSTRAINT ' || quote_ident(name || '_threshold_burned_pkey') || ' PRIMARY KEY (' || pkey || ')';
+    
+    
+    --
+    -- Name: idx_active_fire_geom; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_active_fire_geom') || ' ON ' || 
+       quote_ident(name) || '.active_fire USING gist (geom)';
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||name||'_active_fire_geom_nlcd') || 
+           ' ON ' || quote_ident(name) || '.active_fire USING GIST (geom_nlcd)' ;
+    
+    --
+    -- Name: idx_fire_events_geom; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_geom') || ' ON ' || 
+       quote_ident(name) || '.fire_events USING gist (geom)';
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||name||'_fire_events_geom_nlcd') || 
+            ' ON ' || quote_ident(name) || '.fire_events USING GIST (geom_nlcd)' ;
+    
+    
+    --
+    -- Name: idx_threshold_burned_geom; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_threshold_burned_geom') || ' ON ' || 
+       quote_ident(name) || '.threshold_burned USING gist (geom)';
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||name||'_threshold_burned_geom_nlcd') || 
+            ' ON ' || quote_ident(name) || '.threshold_burned USING GIST (geom_nlcd)' ;
+
+    --
+    -- Name: idx_fire_collections_last_update; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_collections_last_update') || ' ON ' || 
+       quote_ident(name) || '.fire_collections (last_update DESC NULLS LAST)';
+
+    --
+    -- Name: idx_fire_collections_fid; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_collections_fid') || ' ON ' || 
+       quote_ident(name) || '.fire_collections (fid)';
+
+    --
+    -- Name: idx_fire_events_collection_id; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_collection_id') || ' ON ' || 
+       quote_ident(name) || '.fire_events (collection_id)';
+
+    --
+    -- Name: idx_fire_events_source; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_source') || ' ON ' || 
+       quote_ident(name) || '.fire_events (source)';
+
+    IF partitioned THEN
+      EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_fire_events_collection_date') || ' ON ' || 
+         quote_ident(name) || '.fire_events ' || date_index || '(collection_date)';
+    END IF ;
+
+    --
+    -- Name: idx_active_fire_collection_date; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_active_fire_collection_date') || ' ON ' || 
+       quote_ident(name) || '.active_fire ' || date_index || '(collection_date)';
+
+    --
+    -- Name: idx_threshold_burned_collection_date; Type: INDEX; Schema: public; Owner: postgres
+    --
+    
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || name || '_threshold_burned_collection_date') || ' ON ' || 
+       quote_ident(name) || '.threshold_burned ' || date_index || '(collection_date)';
+
+    FOREACH tbl IN ARRAY ARRAY['active_fire', 'fire_collections', 'fire_events', 'threshold_burned'] LOOP
+      IF set_logged AND (SELECT c.relpersistence = 'u' FROM pg_class c 
+                         WHERE c.oid = to_regclass(quote_ident(name) || '.' || tbl)) THEN
+        EXECUTE 'ALTER TABLE ' || quote_ident(name) || '.' || tbl || ' SET LOGGED' ;
+      END IF ;
+      IF do_analyze THEN
+        EXECUTE 'ANALYZE ' || quote_ident(name) || '.' || tbl ;
+      END IF ;
+    END LOOP ;
+    END
+$BODY$ 
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ; 
+ALTER FUNCTION viirs_build_indexes(text, boolean, boolean)
+  OWNER to postgres ;
@@ -19,3 +19,35 @@ $BODY$
   COST 100 ; 
 ALTER FUNCTION viirs_calc_fom(schema text)
   OWNER to postgres ;
+
+-- viirs_fom_counts splits the figure of merit into its parts: the pixels
+-- both in the fire events raster and the ground truth (intersection), the
+-- pixels of the fire events raster (detected) and those of the ground
+-- truth (truth), over the tiles of mask_sum. In mask_sum, 2 is both and 1 
+-- is either one alone.
+CREATE OR REPLACE FUNCTION viirs_fom_counts(schema text, 
+      OUT intersection bigint, OUT detected bigint, OUT truth bigint) 
+   AS
+$BODY$
+    DECLARE
+    totals record ;
+    BEGIN
+	EXECUTE 'WITH tile_totals AS (' || 
+	  'SELECT rid, ST_ValueCount(rast,1.) ones, ' ||
+		      'ST_ValueCount(rast, 2.) twos ' || 
+	  'FROM ' || quote_ident(schema) || '.mask_sum ) ' ||  
+	 'SELECT (SELECT SUM(ones) FROM tile_totals) all_ones, ' || 
+	        '(SELECT SUM(twos) FROM tile_totals) all_twos, ' || 
+	        '(SELECT SUM(ST_ValueCount(f.rast, 1.)) ' ||
+	         'FROM ' || quote_ident(schema) || '.fire_events_raster f ' ||
+	         'WHERE f.rid IN (SELECT rid FROM tile_totals)) event_ones' INTO totals ;
+
+	intersection := COALESCE(totals.all_twos, 0) ;
+	detected := COALESCE(totals.event_ones, 0) ;
+	truth := COALESCE(totals.all_ones, 0) + intersection - (detected - intersection) ;
+   END
+$BODY$ 
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ; 
+ALTER FUNCTION viirs_fom_counts(schema text)
+  OWNER to postgres ;
@@ -13,7 +13,15 @@ DECLARE
   collection timestamp without time zone := $2;
   recent interval := $3;
 BEGIN
-EXECUTE 'UPDATE ' || quote_ident(schema) || '.fire_collections SET active = FALSE where age($1, last_update) > $2'
+-- schemas made before active_events was introduced
+PERFORM viirs_ensure_active_events(schema) ;
+-- collections already marked inactive are left alone rather than rewritten
+EXECUTE 'UPDATE ' || quote_ident(schema) || '.fire_collections SET active = FALSE ' ||
+        'WHERE active AND age($1, last_update) > $2'
+   USING collection, recent ;
+-- same test as the confirmation functions' window
+EXECUTE 'DELETE FROM ' || quote_ident(schema) || '.active_events ' || 
+        'WHERE last_update < $1 - $2'
    USING collection, recent ;
 END
 $BODY$
@@ -24,7 +24,7 @@ BEGIN
      quote_ident(landcover_schema)||'.'||quote_ident(no_burn_table)||' nb ' || 
      'LIMIT 1' INTO dumint ; 
 
-  -- reproject and index the points
+  -- reproject the points, unless they were loaded in this projection
   PERFORM viirs_collection_nlcd_geom(schema, point_tbl, dumint, collection) ;
 
 
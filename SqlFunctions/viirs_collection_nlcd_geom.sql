@@ -6,7 +6,8 @@ $BODY$
     EXECUTE 'UPDATE ' || quote_ident(schema) || '.' ||
              quote_ident(tbl) || 
              ' SET geom_nlcd = ST_Transform(geom, $1) ' ||
-             'WHERE collection_date = $2' USING srid, coll ;
+             'WHERE collection_date = $2 ' || 
+             'AND (geom_nlcd IS NULL OR ST_SRID(geom_nlcd) <> $1)' USING srid, coll ;
     END
 $BODY$ 
   LANGUAGE plpgsql VOLATILE
@@ -0,0 +1,47 @@
+-- Function: viirs_copy_af_collections(varchar(200), varchar(200))
+
+-- DROP FUNCTION viirs_copy_af_collections(varchar(200), varchar(200));
+
+CREATE OR REPLACE FUNCTION viirs_copy_af_collections(
+    varchar(200),
+    varchar(200))
+  RETURNS void AS
+$BODY$
+DECLARE
+  src varchar(200) := $1 ;
+  dst varchar(200) := $2 ;
+  max_fid bigint ;
+BEGIN
+  -- Copies the fire collections and ActiveFire events of the src schema,
+  -- fids and all, into the (empty) tables of the dst schema. The 
+  -- collections must have been made with af_only set (see 
+  -- viirs_activefire_2_fireevents), so that they do not depend on the 
+  -- thresholded burned area of src.
+  EXECUTE 'INSERT INTO ' || quote_ident(dst) || '.fire_collections ' ||
+      '(fid, active, initial_fid, last_update, initial_date) ' ||
+      'SELECT fid, active, initial_fid, last_update, initial_date ' ||
+      'FROM ' || quote_ident(src) || '.fire_collections' ;
+
+  EXECUTE 'INSERT INTO ' || quote_ident(dst) || '.fire_events ' ||
+      '(fid, latitude, longitude, geom, source, collection_id, ' ||
+       'collection_date, pixel_size, band_i_m, geom_nlcd) ' ||
+      'SELECT fid, latitude, longitude, geom, source, collection_id, ' ||
+       'collection_date, pixel_size, band_i_m, geom_nlcd ' ||
+      'FROM ' || quote_ident(src) || '.fire_events ' ||
+      'WHERE source = ' || quote_literal('ActiveFire') ;
+
+  -- new rows must be numbered after the copied ones
+  EXECUTE 'SELECT max(fid) FROM ' || quote_ident(dst) || '.fire_collections' INTO max_fid ;
+  IF max_fid IS NOT NULL THEN
+    PERFORM setval(quote_ident(dst) || '.fire_collections_fid_seq', max_fid) ;
+  END IF ;
+  EXECUTE 'SELECT max(fid) FROM ' || quote_ident(dst) || '.fire_events' INTO max_fid ;
+  IF max_fid IS NOT NULL THEN
+    PERFORM setval(quote_ident(dst) || '.fire_events_fid_seq', max_fid) ;
+  END IF ;
+END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100;
+ALTER FUNCTION viirs_copy_af_collections(varchar(200), varchar(200))
+  OWNER TO postgres;
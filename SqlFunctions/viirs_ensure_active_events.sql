@@ -0,0 +1,49 @@
+-- Function: viirs_ensure_active_events(text)
+--
+-- Makes the active_events table of a schema, if it has none. active_events
+-- holds the fire events of the currently active collections; it is
+-- maintained by the confirmation functions so that they need not search
+-- fire_events. Schemas made by an older init_schema lack the table, so the
+-- confirmation functions call this first. The new table is filled with the
+-- events of the collections still flagged active, each with its
+-- collection's last_update; the confirmation functions prune whatever has
+-- since fallen out of the window.
+--
+CREATE OR REPLACE FUNCTION viirs_ensure_active_events(schema text)
+   RETURNS void AS
+$BODY$
+    BEGIN
+    IF to_regclass(quote_ident(schema) || '.active_events') IS NOT NULL THEN
+      RETURN ;
+    END IF ;
+
+    EXECUTE 'CREATE TABLE ' || quote_ident(schema) || '.active_events (' ||
+        'event_fid bigint NOT NULL, ' ||
+        'collection_id bigint NOT NULL, ' ||
+        'last_update timestamp without time zone, ' ||
+        'source character(10), ' ||
+        'geom geometry(Point,102008))' ;
+
+    EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.active_events OWNER TO postgres' ;
+
+    EXECUTE 'INSERT INTO ' || quote_ident(schema) || '.active_events ' ||
+        '(event_fid, collection_id, last_update, source, geom) ' ||
+        'SELECT fe.fid, fe.collection_id, fc.last_update, fe.source, fe.geom ' ||
+        'FROM ' || quote_ident(schema) || '.fire_events fe, ' ||
+             quote_ident(schema) || '.fire_collections fc ' ||
+        'WHERE fc.fid = fe.collection_id AND fc.active' ;
+
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || schema || '_active_events_geom') || ' ON ' ||
+       quote_ident(schema) || '.active_events USING gist (geom)' ;
+
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || schema || '_active_events_last_update') || ' ON ' ||
+       quote_ident(schema) || '.active_events (last_update)' ;
+
+    EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || schema || '_active_events_collection_id') || ' ON ' ||
+       quote_ident(schema) || '.active_events (collection_id)' ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_ensure_active_events(text)
+  OWNER to postgres ;
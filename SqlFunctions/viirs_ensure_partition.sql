@@ -0,0 +1,45 @@
+-- Function: viirs_ensure_partition(varchar(200), text, timestamp without time zone)
+
+-- DROP FUNCTION viirs_ensure_partition(varchar(200), text, timestamp without time zone);
+
+CREATE OR REPLACE FUNCTION viirs_ensure_partition(
+    varchar(200),
+    text,
+    timestamp without time zone)
+  RETURNS text AS
+$BODY$
+DECLARE
+  schema varchar(200) := $1 ;
+  unit text := $2 ;
+  collection timestamp without time zone := $3 ;
+  start timestamp without time zone ;
+  finish timestamp without time zone ;
+  suffix text ;
+  tbl text ;
+BEGIN
+  -- Makes the partitions of active_fire, threshold_burned and fire_events 
+  -- holding collection dates in the week (starting Monday) or month of 
+  -- collection, unless they exist. The schema must have been made by 
+  -- init_schema with the same unit. Returns the suffix of the partition 
+  -- names, e.g. active_fire_p20160104.
+  IF unit NOT IN ('week', 'month') THEN
+    RAISE EXCEPTION 'Unknown partition unit: %', unit ;
+  END IF ;
+  start := date_trunc(unit, collection) ;
+  finish := start + ('1 ' || unit)::interval ;
+  suffix := '_p' || to_char(start, 'YYYYMMDD') ;
+
+  FOREACH tbl IN ARRAY ARRAY['active_fire', 'threshold_burned', 'fire_events'] LOOP
+    IF to_regclass(quote_ident(schema) || '.' || quote_ident(tbl || suffix)) IS NULL THEN
+      EXECUTE 'CREATE TABLE ' || quote_ident(schema) || '.' || quote_ident(tbl || suffix) ||
+          ' PARTITION OF ' || quote_ident(schema) || '.' || quote_ident(tbl) ||
+          ' FOR VALUES FROM (' || quote_literal(start) || ') TO (' || quote_literal(finish) || ')' ;
+    END IF ;
+  END LOOP ;
+  RETURN suffix ;
+END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100;
+ALTER FUNCTION viirs_ensure_partition(varchar(200), text, timestamp without time zone)
+  OWNER TO postgres;
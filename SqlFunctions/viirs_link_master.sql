@@ -0,0 +1,104 @@
+-- Functions to let a run read its active_fire and threshold_burned points
+-- from the tables of a master schema, instead of holding its own copies.
+--
+-- viirs_link_master replaces the run's (empty) point tables with views of
+-- the master tables. The columns confirmation changes (masked, event_fid
+-- and confirmed_burn) are kept per run, in narrow side tables
+-- (active_fire_state and threshold_burned_state) holding a row only for
+-- the points whose values were changed by the run. Updates to the views
+-- are redirected into the side tables by viirs_point_state_update; the
+-- other columns of the master rows cannot be changed through the views,
+-- and points cannot be added or removed.
+--
+-- "schema"        : the run's schema, made by init_schema
+-- "master_schema" : the schema holding the shared point tables
+--
+-- A master schema made before the points carried their Albers coordinates
+-- has no geom_albers column. The views then show it as NULL, and the
+-- points are projected when needed.
+--
+CREATE OR REPLACE FUNCTION viirs_point_state_update()
+   RETURNS trigger AS
+$BODY$
+    BEGIN
+    IF TG_TABLE_NAME = 'active_fire' THEN
+      EXECUTE 'INSERT INTO ' || quote_ident(TG_TABLE_SCHEMA) || '.active_fire_state ' ||
+          '(fid, masked, event_fid) VALUES ($1, $2, $3) ' ||
+          'ON CONFLICT (fid) DO UPDATE SET masked = EXCLUDED.masked, ' ||
+                                          'event_fid = EXCLUDED.event_fid'
+          USING NEW.fid, NEW.masked, NEW.event_fid ;
+    ELSE
+      EXECUTE 'INSERT INTO ' || quote_ident(TG_TABLE_SCHEMA) || '.threshold_burned_state ' ||
+          '(fid, masked, confirmed_burn) VALUES ($1, $2, $3) ' ||
+          'ON CONFLICT (fid) DO UPDATE SET masked = EXCLUDED.masked, ' ||
+                                          'confirmed_burn = EXCLUDED.confirmed_burn'
+          USING NEW.fid, NEW.masked, NEW.confirmed_burn ;
+    END IF ;
+    RETURN NEW ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_point_state_update()
+  OWNER to postgres ;
+
+
+CREATE OR REPLACE FUNCTION viirs_link_master(schema text, master_schema text)
+   RETURNS void AS
+$BODY$
+    DECLARE
+      af_albers text := 'NULL::geometry(Point,102008)' ;
+      tb_albers text := 'NULL::geometry(Point,102008)' ;
+    BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = master_schema AND table_name = 'active_fire'
+                 AND column_name = 'geom_albers') THEN
+      af_albers := 'm.geom_albers' ;
+    END IF ;
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = master_schema AND table_name = 'threshold_burned'
+                 AND column_name = 'geom_albers') THEN
+      tb_albers := 'm.geom_albers' ;
+    END IF ;
+
+    EXECUTE 'DROP TABLE IF EXISTS ' || quote_ident(schema) || '.active_fire, ' ||
+        quote_ident(schema) || '.threshold_burned' ;
+
+    EXECUTE 'CREATE TABLE ' || quote_ident(schema) || '.active_fire_state (' ||
+        'fid bigint PRIMARY KEY, ' ||
+        'masked boolean, ' ||
+        'event_fid integer)' ;
+    EXECUTE 'CREATE TABLE ' || quote_ident(schema) || '.threshold_burned_state (' ||
+        'fid bigint PRIMARY KEY, ' ||
+        'masked boolean, ' ||
+        'confirmed_burn boolean)' ;
+
+    EXECUTE 'CREATE VIEW ' || quote_ident(schema) || '.active_fire AS ' ||
+        'SELECT m.fid, m.latitude, m.longitude, m.collection_date, m.geom, ' ||
+               'COALESCE(s.event_fid, m.event_fid) AS event_fid, ' ||
+               'm.pixel_size, m.band_i_m, ' ||
+               'COALESCE(s.masked, m.masked) AS masked, ' ||
+               'm.geom_nlcd, ' || af_albers || ' AS geom_albers ' ||
+        'FROM ' || quote_ident(master_schema) || '.active_fire m ' ||
+        'LEFT JOIN ' || quote_ident(schema) || '.active_fire_state s ON s.fid = m.fid' ;
+    EXECUTE 'CREATE VIEW ' || quote_ident(schema) || '.threshold_burned AS ' ||
+        'SELECT m.fid, m.latitude, m.longitude, m.collection_date, m.geom, ' ||
+               'COALESCE(s.confirmed_burn, m.confirmed_burn) AS confirmed_burn, ' ||
+               'm.pixel_size, m.band_i_m, ' ||
+               'COALESCE(s.masked, m.masked) AS masked, ' ||
+               'm.geom_nlcd, ' || tb_albers || ' AS geom_albers ' ||
+        'FROM ' || quote_ident(master_schema) || '.threshold_burned m ' ||
+        'LEFT JOIN ' || quote_ident(schema) || '.threshold_burned_state s ON s.fid = m.fid' ;
+
+    EXECUTE 'CREATE TRIGGER active_fire_state_update INSTEAD OF UPDATE ON ' ||
+        quote_ident(schema) || '.active_fire ' ||
+        'FOR EACH ROW EXECUTE PROCEDURE viirs_point_state_update()' ;
+    EXECUTE 'CREATE TRIGGER threshold_burned_state_update INSTEAD OF UPDATE ON ' ||
+        quote_ident(schema) || '.threshold_burned ' ||
+        'FOR EACH ROW EXECUTE PROCEDURE viirs_point_state_update()' ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_link_master(text, text)
+  OWNER to postgres ;
@@ -17,13 +17,20 @@ DECLARE
 
 BEGIN
 
-  -- delete and recreate masked column
-  EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' ||
-           quote_ident(point_tbl) || 
-          ' DROP COLUMN IF EXISTS masked ' ;
-  EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' ||
-           quote_ident(point_tbl) || 
-          ' ADD COLUMN masked boolean DEFAULT FALSE' ;
+  -- delete and recreate masked column, or just clear it for the views of
+  -- a run linked to master tables (see viirs_link_master)
+  IF (SELECT c.relkind FROM pg_class c WHERE c.oid = 
+        to_regclass(quote_ident(schema) || '.' || quote_ident(point_tbl))) = 'v' THEN
+    EXECUTE 'UPDATE ' || quote_ident(schema) || '.' || quote_ident(point_tbl) ||
+            ' SET masked = FALSE WHERE masked' ;
+  ELSE
+    EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' ||
+             quote_ident(point_tbl) || 
+            ' DROP COLUMN IF EXISTS masked ' ;
+    EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' ||
+             quote_ident(point_tbl) || 
+            ' ADD COLUMN masked boolean DEFAULT FALSE' ;
+  END IF ;
 
   -- determine resolution of "no-burn" mask
   EXECUTE 'SELECT scale_x/2 FROM raster_columns WHERE r_table_schema = ' || 
@@ -36,7 +43,7 @@ BEGIN
      quote_ident(landcover_schema)||'.'||quote_ident(no_burn_table)||' nb ' || 
      'LIMIT 1' INTO dumint ; 
         
-  -- reproject and index the points
+  -- reproject the points, unless they were loaded in this projection
   PERFORM viirs_nlcd_geom(schema, point_tbl, dumint) ;
 
   -- Populate the masked column
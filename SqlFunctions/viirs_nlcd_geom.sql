@@ -3,20 +3,24 @@ CREATE OR REPLACE FUNCTION viirs_nlcd_geom(schema text, tbl text, srid int)
 $BODY$
     BEGIN
 
-    EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' ||
-              quote_ident(tbl) || 
-              ' DROP COLUMN IF EXISTS geom_nlcd CASCADE' ;
-    EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' || 
-              quote_ident(tbl) || 
-              ' ADD COLUMN geom_nlcd geometry' ;
+    -- Tables made by init_schema already have the column, filled in when
+    -- the points are loaded. Only older tables need it added.
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns 
+                   WHERE table_schema = schema AND table_name = tbl 
+                     AND column_name = 'geom_nlcd') THEN 
+      EXECUTE 'ALTER TABLE ' || quote_ident(schema) || '.' || 
+                quote_ident(tbl) || 
+                ' ADD COLUMN geom_nlcd geometry' ;
+      EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||schema||'_'||tbl||'geom_nlcd') || 
+              ' ON ' || quote_ident(schema) || '.' || quote_ident(tbl) ||
+              ' USING GIST (geom_nlcd)' ;
+    END IF ;
               
+    -- only project the points which were not loaded in this projection
     EXECUTE 'UPDATE ' || quote_ident(schema) || '.' ||
              quote_ident(tbl) || 
-             ' SET geom_nlcd = ST_Transform(geom, $1)' USING srid ;
-
-    EXECUTE 'CREATE INDEX ' || quote_ident('idx_'||schema||'_'||tbl||'geom_nlcd') || 
-            ' ON ' || quote_ident(schema) || '.' || quote_ident(tbl) ||
-            ' USING GIST (geom_nlcd)' ;
+             ' SET geom_nlcd = ST_Transform(geom, $1) ' ||
+             'WHERE geom_nlcd IS NULL OR ST_SRID(geom_nlcd) <> $1' USING srid ;
     
     END
 $BODY$ 
@@ -0,0 +1,171 @@
+-- Functions to keep the results of many runs in one schema (the "store"),
+-- instead of one schema per run. The store's fire_collections, fire_events
+-- and threshold_burned tables carry a run_id column and are list
+-- partitioned by it, so each run is one partition of each table. The
+-- indexes are declared once, on the parent tables. The store's runs table
+-- lists the runs it holds.
+--
+-- A run is still confirmed in a working schema made by init_schema, and
+-- moved into the store with viirs_store_run once it is done, which also
+-- drops the working schema. viirs_run_workspace makes a bare schema
+-- looking onto one stored run, for the functions which evaluate a run by
+-- schema name (rasterizing, zone tables), and which write their own tables
+-- there. Needs PostgreSQL 11 or later.
+--
+-- The store does not keep active_fire. A stored run can be evaluated, but
+-- not reconfirmed (misc_utils/replay_confirmation.py refuses it) without
+-- loading its granules again.
+--
+-- "store"   : the schema holding the stored runs
+-- "schema"  : the working schema of a run
+-- run_id    : the run's number
+--
+CREATE OR REPLACE FUNCTION init_run_store(store text)
+   RETURNS void AS
+$BODY$
+    BEGIN
+    -- concurrent IF NOT EXISTS creations of the same objects can still
+    -- collide, so callers of the same store take turns
+    PERFORM pg_advisory_xact_lock(hashtext('init_run_store ' || store)) ;
+    -- unlike init_schema, this leaves an existing store alone
+    EXECUTE 'CREATE SCHEMA IF NOT EXISTS ' || quote_ident(store) ;
+
+    EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident(store) || '.runs (' ||
+        'run_id integer PRIMARY KEY, ' ||
+        'stored timestamp without time zone DEFAULT now())' ;
+
+    EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident(store) || '.fire_collections (' ||
+        'run_id integer NOT NULL, ' ||
+        'fid bigint NOT NULL, ' ||
+        'active boolean, ' ||
+        'initial_fid bigint, ' ||
+        'last_update timestamp without time zone, ' ||
+        'initial_date timestamp without time zone, ' ||
+        'PRIMARY KEY (run_id, fid)) PARTITION BY LIST (run_id)' ;
+
+    EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident(store) || '.fire_events (' ||
+        'run_id integer NOT NULL, ' ||
+        'fid bigint NOT NULL, ' ||
+        'latitude real, ' ||
+        'longitude real, ' ||
+        'geom geometry(Point,102008), ' ||
+        'source character(10), ' ||
+        'collection_id bigint, ' ||
+        'collection_date timestamp without time zone, ' ||
+        'pixel_size integer NOT NULL, ' ||
+        'band_i_m character(1) NOT NULL, ' ||
+        'geom_nlcd geometry, ' ||
+        'PRIMARY KEY (run_id, fid)) PARTITION BY LIST (run_id)' ;
+
+    EXECUTE 'CREATE TABLE IF NOT EXISTS ' || quote_ident(store) || '.threshold_burned (' ||
+        'run_id integer NOT NULL, ' ||
+        'fid bigint NOT NULL, ' ||
+        'latitude real, ' ||
+        'longitude real, ' ||
+        'collection_date timestamp without time zone, ' ||
+        'geom geometry(Point,4326), ' ||
+        'confirmed_burn boolean DEFAULT false, ' ||
+        'pixel_size integer NOT NULL, ' ||
+        'band_i_m character(1) NOT NULL, ' ||
+        'masked boolean DEFAULT FALSE, ' ||
+        'geom_nlcd geometry, ' ||
+        'geom_albers geometry(Point,102008), ' ||
+        'PRIMARY KEY (run_id, fid)) PARTITION BY LIST (run_id)' ;
+
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_fire_events_geom') ||
+        ' ON ' || quote_ident(store) || '.fire_events USING gist (geom)' ;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_fire_events_geom_nlcd') ||
+        ' ON ' || quote_ident(store) || '.fire_events USING gist (geom_nlcd)' ;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_fire_events_collection_id') ||
+        ' ON ' || quote_ident(store) || '.fire_events (collection_id)' ;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_fire_events_collection_date') ||
+        ' ON ' || quote_ident(store) || '.fire_events USING brin (collection_date)' ;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_threshold_burned_geom_nlcd') ||
+        ' ON ' || quote_ident(store) || '.threshold_burned USING gist (geom_nlcd)' ;
+    EXECUTE 'CREATE INDEX IF NOT EXISTS ' || quote_ident('idx_' || store || '_threshold_burned_collection_date') ||
+        ' ON ' || quote_ident(store) || '.threshold_burned USING brin (collection_date)' ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION init_run_store(text)
+  OWNER to postgres ;
+
+
+CREATE OR REPLACE FUNCTION viirs_drop_run(store text, run_id integer)
+   RETURNS void AS
+$BODY$
+    DECLARE
+      tbl text ;
+    BEGIN
+    FOREACH tbl IN ARRAY ARRAY['fire_collections', 'fire_events', 'threshold_burned'] LOOP
+      EXECUTE 'DROP TABLE IF EXISTS ' || quote_ident(store) || '.' ||
+          quote_ident(tbl || '_r' || run_id) ;
+    END LOOP ;
+    EXECUTE 'DELETE FROM ' || quote_ident(store) || '.runs WHERE run_id = $1' USING run_id ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_drop_run(text, integer)
+  OWNER to postgres ;
+
+
+CREATE OR REPLACE FUNCTION viirs_store_run(schema text, store text, run_id integer)
+   RETURNS void AS
+$BODY$
+    DECLARE
+      columns text ;
+      tbl text ;
+    BEGIN
+    -- replaces anything already stored under run_id
+    PERFORM viirs_drop_run(store, run_id) ;
+
+    FOREACH tbl IN ARRAY ARRAY['fire_collections', 'fire_events', 'threshold_burned'] LOOP
+      IF tbl = 'fire_collections' THEN
+        columns := 'fid, active, initial_fid, last_update, initial_date' ;
+      ELSIF tbl = 'fire_events' THEN
+        columns := 'fid, latitude, longitude, geom, source, collection_id, ' ||
+                   'collection_date, pixel_size, band_i_m, geom_nlcd' ;
+      ELSE
+        columns := 'fid, latitude, longitude, collection_date, geom, confirmed_burn, ' ||
+                   'pixel_size, band_i_m, masked, geom_nlcd, geom_albers' ;
+      END IF ;
+
+      EXECUTE 'CREATE TABLE ' || quote_ident(store) || '.' || quote_ident(tbl || '_r' || run_id) ||
+          ' PARTITION OF ' || quote_ident(store) || '.' || quote_ident(tbl) ||
+          ' FOR VALUES IN (' || run_id || ')' ;
+      EXECUTE 'INSERT INTO ' || quote_ident(store) || '.' || quote_ident(tbl) ||
+          ' (run_id, ' || columns || ') ' ||
+          'SELECT $1, ' || columns || ' FROM ' || quote_ident(schema) || '.' || quote_ident(tbl)
+          USING run_id ;
+    END LOOP ;
+
+    EXECUTE 'INSERT INTO ' || quote_ident(store) || '.runs (run_id) VALUES ($1)' USING run_id ;
+    EXECUTE 'DROP SCHEMA ' || quote_ident(schema) || ' CASCADE' ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_store_run(text, text, integer)
+  OWNER to postgres ;
+
+
+CREATE OR REPLACE FUNCTION viirs_run_workspace(schema text, store text, run_id integer)
+   RETURNS void AS
+$BODY$
+    BEGIN
+    -- fire_events is a simple view, so the functions which update it
+    -- (e.g. viirs_nlcd_geom) update the stored rows
+    EXECUTE 'DROP SCHEMA IF EXISTS ' || quote_ident(schema) || ' CASCADE' ;
+    EXECUTE 'CREATE SCHEMA ' || quote_ident(schema) ;
+    EXECUTE 'CREATE VIEW ' || quote_ident(schema) || '.fire_events AS ' ||
+        'SELECT fid, latitude, longitude, geom, source, collection_id, ' ||
+               'collection_date, pixel_size, band_i_m, geom_nlcd ' ||
+        'FROM ' || quote_ident(store) || '.' || quote_ident('fire_events_r' || run_id) ;
+    END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100 ;
+ALTER FUNCTION viirs_run_workspace(text, text, integer)
+  OWNER to postgres ;
@@ -28,7 +28,8 @@ BEGIN
         'FROM(' ||
             'SELECT a.* FROM ' || quote_ident(schema) || '.threshold_burned a ' ||
             'LEFT JOIN ' || quote_ident(schema) || '.active_fire b ' || 
-            'ON ST_DWithin(ST_Transform(a.geom, 102008), ST_Transform(b.geom, 102008), $1)' ||
+            'ON ST_DWithin(COALESCE(a.geom_albers, ST_Transform(a.geom, 102008)), ' ||
+                          'COALESCE(b.geom_albers, ST_Transform(b.geom, 102008)), $1)' ||
         'WHERE a.collection_date = $2 ' || 
             'AND b.collection_date >= $2 - $3 ' || 
             'AND b.collection_date <= $2) AS subquery ' || 
@@ -26,49 +26,62 @@ DECLARE
 BEGIN
 
   RAISE NOTICE 'Interval = %', recent ;
+
+  -- schemas made before active_events was introduced
+  PERFORM viirs_ensure_active_events(schema) ;
   
   -- This will return one row for each confirmed "threshold_burned" point in the 
   -- specified collection, paired with exactly one fire collection via exactly one 
   -- fire event with a source of "ActiveFire" meeting the spatiotemporal criteria. 
-  confirm_query := 'SELECT t_fid, fe_fid, fc.fid as fc_fid ' || 
-    'FROM ' || quote_ident(schema) || '.fire_collections fc, ' ||
-               quote_ident(schema) || '.fire_events fe, ' || 
-        '(SELECT t.fid as t_fid, MAX(fe.fid) AS fe_fid ' || 
-         'FROM ' || quote_ident(schema) || '.fire_events fe, ' || 
-             quote_ident(schema) || '.fire_collections fc, ' ||
+  -- The events of the active collections are taken from active_events 
+  -- (see viirs_activefire_2_fireevents), which also carries each 
+  -- collection's last_update.
+  confirm_query := 'SELECT t_fid, fe_fid, ae.collection_id as fc_fid ' || 
+    'FROM ' || quote_ident(schema) || '.active_events ae, ' ||
+        '(SELECT t.fid as t_fid, MAX(ae.event_fid) AS fe_fid ' || 
+         'FROM ' || quote_ident(schema) || '.active_events ae, ' || 
              quote_ident(schema) || '.threshold_burned t ' ||
          'WHERE ' ||
-             -- glue and seed criteria
-             'fe.collection_id = fc.fid AND ' || 
-             'fe.source = ' || quote_literal('ActiveFire') || ' AND ' || 
+             -- seed criteria
+             'ae.source = ' || quote_literal('ActiveFire') || ' AND ' || 
              't.collection_date = $1 AND ' || 
 
              -- temporal criterion
-             'fc.last_update >= $1 - $2 AND ' ||
-             'fc.last_update <= $1 AND ' || 
+             'ae.last_update >= $1 - $2 AND ' ||
+             'ae.last_update <= $1 AND ' || 
 
              -- spatial criterion
-             'ST_DWithin(ST_Transform(t.geom, 102008), fe.geom, $3) AND ' || 
+             'ST_DWithin(COALESCE(t.geom_albers, ST_Transform(t.geom, 102008)), ' ||
+                        'ae.geom, $3) AND ' || 
              
              -- mask out nonburnable
              '(NOT masked) ' ||
 
         'GROUP BY t.fid) confirmed ' ||
-     'WHERE fe.fid = fe_fid AND ' ||
-        'fe.collection_id = fc.fid' ;
+     'WHERE ae.event_fid = fe_fid' ;
 
 
 
     
-  insert_confirmed := 'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
+  -- the new events are also added to active_events, as the active fire
+  -- step matches events of any source
+  insert_confirmed := 'WITH new_fe AS (' ||
+      'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
       '(latitude, longitude, geom, source, collection_id, ' ||
-       'collection_date, pixel_size, band_i_m) ' ||
-      'SELECT latitude, longitude, ST_Transform(geom, 102008), ' || 
+       'collection_date, pixel_size, band_i_m, geom_nlcd) ' ||
+      'SELECT latitude, longitude, ' ||
+        'COALESCE(geom_albers, ST_Transform(geom, 102008)), ' || 
         quote_literal('Threshold') || ', ' || 
-        'fc_fid, collection_date, pixel_size, band_i_m ' ||
+        'fc_fid, collection_date, pixel_size, band_i_m, geom_nlcd ' ||
       'FROM confirmed_pts cp, ' || 
             quote_ident(schema) || '.threshold_burned t ' ||
-      'WHERE t.fid = cp.t_fid'  ;
+      'WHERE t.fid = cp.t_fid ' || 
+      'RETURNING fid, collection_id, source, geom) ' || 
+    'INSERT INTO ' || quote_ident(schema) || '.active_events ' || 
+      '(event_fid, collection_id, last_update, source, geom) ' || 
+      'SELECT fe.fid, fe.collection_id, fc.last_update, fe.source, fe.geom ' ||
+      'FROM new_fe fe, ' || quote_ident(schema) || '.fire_collections fc ' || 
+      'WHERE fc.fid = fe.collection_id' ;
 
   confirm_point := 'UPDATE ' || quote_ident(schema) || '.threshold_burned t ' || 
       'SET confirmed_burn = TRUE ' || 
@@ -81,7 +94,10 @@ BEGIN
                lm_table, 'geom', collection) ; 
   END IF ;
 
-  EXECUTE 'CREATE TEMPORARY TABLE confirmed_pts AS ' || confirm_query
+  -- the session may be reused, and may have called this already in the
+  -- current transaction.
+  DROP TABLE IF EXISTS pg_temp.confirmed_pts ;
+  EXECUTE 'CREATE TEMPORARY TABLE confirmed_pts ON COMMIT DROP AS ' || confirm_query
       USING collection, recent, distance ; 
       
   EXECUTE 'SELECT count(*) as c FROM confirmed_pts' INTO added ; 
@@ -0,0 +1,75 @@
+-- Function: viirs_threshold_2_fireevents_season(varchar(200), interval, integer)
+
+-- DROP FUNCTION viirs_threshold_2_fireevents_season(varchar(200), interval, integer);
+
+CREATE OR REPLACE FUNCTION viirs_threshold_2_fireevents_season(
+    varchar(200),
+    interval,
+    integer)
+  RETURNS void AS
+$BODY$
+DECLARE
+  schema varchar(200) := $1;
+  recent interval := $2;
+  distance integer := $3;
+  added record ;
+  confirm_query text ;
+  insert_confirmed text ;
+  confirm_point text ;
+BEGIN
+  -- Confirms the threshold points of every date at once, against 
+  -- collections which were all made beforehand with af_only set (see 
+  -- viirs_activefire_2_fireevents and viirs_copy_af_collections). Those 
+  -- collections are only ever updated by active fire points, so a
+  -- collection was active on date c exactly when it has an ActiveFire 
+  -- event dated between c - recent and c. Otherwise this is the test 
+  -- viirs_threshold_2_fireevents makes one date at a time: a point is 
+  -- confirmed into the collection of the latest ActiveFire event within 
+  -- distance, among the events of collections active on its date. Points 
+  -- must already be masked.
+  confirm_query := 'SELECT t.fid as t_fid, t.collection_date, MAX(fe.fid) as fe_fid ' ||
+      'FROM ' || quote_ident(schema) || '.threshold_burned t, ' ||
+                 quote_ident(schema) || '.fire_events fe ' ||
+      'WHERE fe.source = ' || quote_literal('ActiveFire') || ' ' ||
+        'AND fe.collection_date <= t.collection_date ' ||
+        'AND ST_DWithin(COALESCE(t.geom_albers, ST_Transform(t.geom, 102008)), fe.geom, $2) ' ||
+        'AND NOT t.masked ' ||
+        'AND EXISTS (SELECT 1 FROM ' || quote_ident(schema) || '.fire_events lu ' ||
+                    'WHERE lu.collection_id = fe.collection_id ' ||
+                      'AND lu.source = ' || quote_literal('ActiveFire') || ' ' ||
+                      'AND lu.collection_date >= t.collection_date - $1 ' ||
+                      'AND lu.collection_date <= t.collection_date) ' ||
+      'GROUP BY t.fid, t.collection_date' ;
+
+  insert_confirmed := 'INSERT INTO ' || quote_ident(schema) || '.fire_events ' ||
+      '(latitude, longitude, geom, source, collection_id, ' ||
+       'collection_date, pixel_size, band_i_m, geom_nlcd) ' ||
+      'SELECT t.latitude, t.longitude, ' ||
+        'COALESCE(t.geom_albers, ST_Transform(t.geom, 102008)), ' ||
+        quote_literal('Threshold') || ', ' ||
+        'fe.collection_id, t.collection_date, t.pixel_size, t.band_i_m, t.geom_nlcd ' ||
+      'FROM season_pts cp, ' ||
+            quote_ident(schema) || '.threshold_burned t, ' ||
+            quote_ident(schema) || '.fire_events fe ' ||
+      'WHERE t.fid = cp.t_fid AND fe.fid = cp.fe_fid ' ||
+      'ORDER BY cp.collection_date, cp.t_fid' ;
+
+  confirm_point := 'UPDATE ' || quote_ident(schema) || '.threshold_burned t ' ||
+      'SET confirmed_burn = TRUE ' ||
+      'FROM season_pts cp ' ||
+      'WHERE t.fid = cp.t_fid' ;
+
+  DROP TABLE IF EXISTS pg_temp.season_pts ;
+  EXECUTE 'CREATE TEMPORARY TABLE season_pts ON COMMIT DROP AS ' || confirm_query
+      USING recent, distance ;
+
+  EXECUTE 'SELECT count(*) as c FROM season_pts' INTO added ;
+  RAISE NOTICE 'adding % points.', added.c ;
+  EXECUTE insert_confirmed ;
+  EXECUTE confirm_point ;
+END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100;
+ALTER FUNCTION viirs_threshold_2_fireevents_season(varchar(200), interval, integer)
+  OWNER TO postgres;
@@ -0,0 +1,74 @@
+-- Function: viirs_threshold_proximity(varchar(200), integer, interval)
+
+-- DROP FUNCTION viirs_threshold_proximity(varchar(200), integer, interval);
+
+CREATE OR REPLACE FUNCTION viirs_threshold_proximity(
+    varchar(200),
+    integer,
+    interval)
+  RETURNS void AS
+$BODY$
+DECLARE
+  schema varchar(200) := $1;
+  max_distance integer := $2;
+  max_gap interval := $3;
+  pairs text ;
+  frontier text ;
+BEGIN
+  -- viirs_threshold_2_fireevents confirms a threshold point t on date c
+  -- when some ActiveFire event lies within SpatialProximity of it, and that
+  -- event's collection was last updated no more than TemporalProximity
+  -- before c. Collections are only updated by active fire points, so the
+  -- last update as of c is the latest date of an ActiveFire event of the
+  -- collection on or before c.
+  --
+  -- Given the fire events of a confirmed run, this tabulates for each
+  -- unmasked threshold point the (distance, gap) pairs of the eligible
+  -- events, out to max_distance and max_gap. Only the pairs which are not
+  -- beaten on both counts by another pair of the same point are kept, so
+  -- the point is confirmed at (D, T) exactly when one of its rows has
+  -- distance <= D and gap <= T.
+  --
+  -- The gap is at most max_gap exactly when the event's collection has an
+  -- ActiveFire event in [t - max_gap, t], so the events are first
+  -- restricted to those collections (as viirs_threshold_2_fireevents_season
+  -- does), and the last update is only looked for in that window.
+  pairs := 'SELECT t.fid, t.collection_date, ' ||
+         'ST_Distance(COALESCE(t.geom_albers, ST_Transform(t.geom, 102008)), fe.geom) as distance, ' ||
+         't.collection_date - ' ||
+           '(SELECT max(lu.collection_date) FROM ' || quote_ident(schema) || '.fire_events lu ' ||
+            'WHERE lu.collection_id = fe.collection_id ' ||
+              'AND lu.source = ' || quote_literal('ActiveFire') || ' ' ||
+              'AND lu.collection_date >= t.collection_date - $2 ' ||
+              'AND lu.collection_date <= t.collection_date) as gap ' ||
+      'FROM ' || quote_ident(schema) || '.threshold_burned t, ' ||
+           quote_ident(schema) || '.fire_events fe ' ||
+      'WHERE fe.source = ' || quote_literal('ActiveFire') || ' ' ||
+        'AND fe.collection_date <= t.collection_date ' ||
+        'AND ST_DWithin(COALESCE(t.geom_albers, ST_Transform(t.geom, 102008)), fe.geom, $1) ' ||
+        'AND NOT t.masked ' ||
+        'AND EXISTS (SELECT 1 FROM ' || quote_ident(schema) || '.fire_events lu ' ||
+                    'WHERE lu.collection_id = fe.collection_id ' ||
+                      'AND lu.source = ' || quote_literal('ActiveFire') || ' ' ||
+                      'AND lu.collection_date >= t.collection_date - $2 ' ||
+                      'AND lu.collection_date <= t.collection_date)' ;
+
+  -- the pareto frontier of each point, walking from the smallest gap up
+  frontier := 'SELECT fid, collection_date, distance, gap FROM ' ||
+      '(SELECT fid, collection_date, distance, gap, ' ||
+              'min(distance) OVER (PARTITION BY fid ORDER BY gap, distance ' ||
+                  'ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) as best ' ||
+       'FROM (' || pairs || ') p) f ' ||
+      'WHERE best IS NULL OR distance < best' ;
+
+  EXECUTE 'DROP TABLE IF EXISTS ' || quote_ident(schema) || '.threshold_proximity' ;
+  EXECUTE 'CREATE TABLE ' || quote_ident(schema) || '.threshold_proximity AS ' || frontier
+      USING max_distance, max_gap ;
+  EXECUTE 'CREATE INDEX ' || quote_ident('idx_' || schema || '_threshold_proximity_fid') ||
+      ' ON ' || quote_ident(schema) || '.threshold_proximity (fid)' ;
+END
+$BODY$
+  LANGUAGE plpgsql VOLATILE
+  COST 100;
+ALTER FUNCTION viirs_threshold_proximity(varchar(200), integer, interval)
+  OWNER TO postgres;
@@ -1,17 +1,42 @@
 import VIIRS_threshold_reflCor_Bulk as vt
 import viirs_config as vc 
+import viirs_landmask
+import viirs_regions
 import datetime
 import glob
 import sys
 import multiprocessing as mp
 
+def check_replayable(configs) : 
+    """raises ValueError if any of the runs has been moved into its run 
+    store. The store keeps only the results of a run, not its active fire
+    points, so a stored run cannot be reconfirmed: its granules have to be
+    loaded again."""
+    for config in configs : 
+        if not config.has_run_store() : 
+            continue
+        rows = vt.fetch_query(config, 
+            "SELECT to_regclass('\"{0}\".active_fire')".format(config.DBschema))
+        if rows[0][0] is None : 
+            raise ValueError(("Run {0} is only kept in the run store {1}, which does not " +
+                "hold its active fire points. Load its granules again to reconfirm it.").format(
+                    config.DBschema, config.RunStore))
+
 def delete_confirmed(config) : 
     """wipe out fire events and collections"""
+    check_replayable([config])
     vt.execute_query(config, 'DELETE FROM "{0}".fire_events'.format(config.DBschema))
     vt.execute_query(config, 'DELETE FROM "{0}".fire_collections'.format(config.DBschema))
+    vt.execute_query(config, "SELECT viirs_ensure_active_events('{0}')".format(config.DBschema))
+    vt.execute_query(config, 'DELETE FROM "{0}".active_events'.format(config.DBschema))
 
 def mask_points(config) : 
     """apply landcover mask to active_fire and threshold burned"""
+    landmask = vt.get_landmask(config)
+    if landmask is not None : 
+        for table in ['active_fire', 'threshold_burned'] : 
+            viirs_landmask.mask_table(config, landmask, table)
+        return
     vt.execute_query(config, "SELECT viirs_mask_points('{0}','active_fire','landmask','noburn','geom')".format(config.DBschema))
     vt.execute_query(config, "SELECT viirs_mask_points('{0}','threshold_burned','landmask','noburn','geom')".format(config.DBschema))
     
@@ -28,26 +53,47 @@ def db_date_string(dt) :
     date_4db = datetime.datetime.strftime(dt, "%Y-%m-%d %H:%M:%S")
     return date_4db
 
-def confirm_date(config, datestring) : 
-    """copy points (active fire and confirmed burn points to fire_events table"""
+def store(config) : 
+    """moves a confirmed run into the run store, if it is kept in one"""
+    if config.has_run_store() : 
+        vt.store_run(config)
+
+def confirm_date(config, datestring, engine=None) : 
+    """copy points (active fire and confirmed burn points to fire_events table.
+    If engine is given, the date is confirmed in memory instead."""
     db_date = db_date_string(image_date_time(datestring))
     print db_date
 
+    if engine is not None : 
+        engine.confirm_date(config, db_date)
+        return
     vt.execute_active_fire_2_events(config, db_date)
     vt.execute_threshold_2_events(config, db_date)
 
 
-def reconfirm_run(config) : 
-    """re-computes fire_events and fire_collections table for entire run"""
+def reconfirm_run(config, workers=1) : 
+    """re-computes fire_events and fire_collections table for entire run.
+    With more than one worker, the run is confirmed in memory, splitting 
+    the points into regions which cannot affect each other (see 
+    viirs_regions)."""
     delete_confirmed(config)
     mask_points(config)
-    for d in config.SortedImageDates : 
-        confirm_date(config, d)
+    if workers > 1 : 
+        viirs_regions.confirm_run(config, workers).write(config)
+    else : 
+        engine = vt.get_confirmer(config)
+        for d in config.SortedImageDates : 
+            confirm_date(config, d, engine)
+        if engine is not None : 
+            engine.write(config)
+    store(config)
 
 
 def reconfirm_batch(base_dir, workers=1) : 
     """re-computes fire_events and fire_collections for every run in this batch"""
     config_list = vc.VIIRSConfig.load_batch(base_dir)
+    check_replayable(config_list)
+    vt.init_run_store(config_list[0])
     
     if workers > 1 : 
         mypool = mp.Pool(processes=workers)
@@ -55,14 +101,78 @@ def reconfirm_batch(base_dir, workers=1) :
     else : 
         for c in config_list : 
             reconfirm_run(c)
+
+def confirm_collections(config) : 
+    """re-computes the fire collections of a run from its active fire 
+    points alone. The threshold points are left unconfirmed."""
+    delete_confirmed(config)
+    mask_points(config)
+    for d in config.SortedImageDates : 
+        vt.execute_active_fire_2_events(config, 
+                db_date_string(image_date_time(d)))
+
+def share_collections(configs) : 
+    """copies the fire collections of the first run in configs into the
+    other runs"""
+    leader = configs[0]
+    for config in configs[1:] : 
+        delete_confirmed(config)
+        mask_points(config)
+        vt.execute_query(config, "SELECT viirs_copy_af_collections('{0}', '{1}')".format(
+                leader.DBschema, config.DBschema))
+
+def confirm_season(config) : 
+    """confirms the threshold points of every date against the run's 
+    fire collections"""
+    vt.execute_query(config, 
+        "SELECT viirs_threshold_2_fireevents_season('{0}', '{1}', {2})".format(
+            config.DBschema, config.get_sql_interval(), int(config.SpatialProximity)))
+    store(config)
+
+def reconfirm_batch_shared(base_dir, workers=1) : 
+    """re-computes fire_events and fire_collections for every run in this 
+    batch, making the fire collections only once for each group of runs 
+    which share them. Every run must cluster active fire points with 
+    AFOnly = y, otherwise its collections depend on its thresholds."""
+    config_list = vc.VIIRSConfig.load_batch(base_dir)
+    groups = {}
+    for c in config_list : 
+        if not c.has_af_only() : 
+            raise ValueError("Run {0} does not set AFOnly = y".format(c.DBschema))
+        groups.setdefault(c.af_key(), []).append(c)
+    check_replayable(config_list)
+    vt.init_run_store(config_list[0])
+    print "{0} runs share {1} sets of collections".format(len(config_list), len(groups))
+
+    if workers > 1 : 
+        mypool = mp.Pool(processes=workers)
+        mypool.map(confirm_collections, [ g[0] for g in groups.values() ])
+        mypool.map(share_collections, groups.values())
+        mypool.map(confirm_season, config_list)
+    else : 
+        for g in groups.values() : 
+            confirm_collections(g[0])
+            share_collections(g)
+        for c in config_list : 
+            confirm_season(c)
     
 
 if __name__ == '__main__' : 
-    if len(sys.argv) not in [2,3] : 
-        print "Usage: {0} base_directory [workers]".format(sys.argv[0])
+    if len(sys.argv) not in [2,3,4] : 
+        print "Usage: {0} base_directory [workers [shared|regions]]".format(sys.argv[0])
+        print "  shared : runs of the batch share their fire collections"
+        print "  regions: runs are confirmed one at a time, split over the workers"
         sys.exit() 
 
-    if len(sys.argv) == 3 : 
+    if len(sys.argv) == 4 and sys.argv[3] == 'shared' : 
+        reconfirm_batch_shared(sys.argv[1],int(sys.argv[2]))
+    elif len(sys.argv) == 4 and sys.argv[3] == 'regions' : 
+        config_list = vc.VIIRSConfig.load_batch(sys.argv[1])
+        check_replayable(config_list)
+        vt.init_run_store(config_list[0])
+        for c in config_list : 
+            reconfirm_run(c, int(sys.argv[2]))
+    elif len(sys.argv) >= 3 : 
         reconfirm_batch(sys.argv[1],int(sys.argv[2]))
     else : 
         reconfirm_batch(sys.argv[1])
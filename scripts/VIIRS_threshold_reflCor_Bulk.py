@@ -68,7 +68,15 @@ import psycopg2
 import time
 import gc
 import subprocess
+import shutil
+import cStringIO
+import contextlib
+import threading
+import Queue
+import multiprocessing as mp
+import argparse
 import viirs_config as vc
+import viirs_proj
 from pyhdf.SD import SD, SDC
 from itertools import islice, chain
 
@@ -79,9 +87,11 @@ srids = {
   "NLCD"   : 96630
 }
 
+# Number of rows in a single M-band scan
+scan_rows = 16
+
 # batch recipe from:
 # http://code.activestate.com/recipes/303279-getting-items-in-batches/
-# used for uploading points to postgis
 def batch(iterable, size):
     sourceiter = iter(iterable)
     while True:
@@ -100,10 +110,13 @@ def id(x):
 
 
 # Write the coordinate list to text file.
-def write_coordinates2text(config, coordsList, fileName, date):
-    if not os.path.exists(os.path.join(config.BaseDir,"TextOut")):
-        os.makedirs(os.path.join(config.BaseDir,"TextOut"))
-    outfile = os.path.join(config.BaseDir, "TextOut", fileName + ".txt")
+# The file goes in BaseDir/TextOut unless outdir is given.
+def write_coordinates2text(config, coordsList, fileName, date, outdir=None):
+    if outdir is None : 
+        outdir = os.path.join(config.BaseDir,"TextOut")
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    outfile = os.path.join(outdir, fileName + ".txt")
     if os.path.exists(outfile):
         os.remove(outfile)
     
@@ -178,54 +191,192 @@ def postgis_conn_params(config) :
            config.DBname, config.DBuser, config.pwd, config.DBhost)
     return ConnParam
 
+class Session (psycopg2.extensions.connection) : 
+    """A database connection shared by all the helpers in this module. It 
+    tracks open transaction() blocks and the statements prepared on it."""
+    def __init__(self, *args, **kwargs) : 
+        psycopg2.extensions.connection.__init__(self, *args, **kwargs)
+        self.depth = 0
+        self.prepared = set()
+
+# Open sessions, keyed by process id, thread and connection parameters. 
+# Processes forked by multiprocessing inherit this dictionary, but must not 
+# use (or close) their parent's sessions. Threads each have their own, so 
+# that the transaction() blocks of one never take in the statements of 
+# another.
+_sessions = {}
+
+def _session_key(config) : 
+    return (os.getpid(), threading.current_thread().ident, postgis_conn_params(config))
+
+def get_session(config) : 
+    """returns this thread's session for the database in config, 
+    connecting if there is none or the previous one was closed."""
+    key = _session_key(config)
+    conn = _sessions.get(key, None)
+    if (conn is None) or conn.closed : 
+        conn = psycopg2.connect(key[2], connection_factory=Session)
+        _sessions[key] = conn
+    return conn
+
+def close_session(config) : 
+    """closes this thread's session for the database in config, if any"""
+    conn = _sessions.pop(_session_key(config), None)
+    if conn is not None : 
+        conn.close()
+
+def close_sessions() : 
+    """closes all of this process's sessions, in all of its threads"""
+    for key in _sessions.keys() : 
+        if key[0] == os.getpid() : 
+            _sessions.pop(key).close()
+
+@contextlib.contextmanager
+def transaction(config) : 
+    """runs the database calls made inside the with block in a single 
+    transaction, committed at the end of the block or rolled back if it 
+    raises. Blocks may be nested; only the outermost one commits."""
+    conn = get_session(config)
+    conn.depth += 1
+    try : 
+        yield conn
+    except : 
+        conn.depth -= 1
+        if conn.depth == 0 : 
+            conn.rollback()
+        raise
+    else : 
+        conn.depth -= 1
+        if conn.depth == 0 : 
+            conn.commit()
+
+@contextlib.contextmanager
+def session_cursor(config) : 
+    """yields a cursor on the session for config. The work is committed 
+    afterward (or rolled back on error), unless a transaction() is open."""
+    conn = get_session(config)
+    cur = conn.cursor()
+    try : 
+        yield cur
+    except : 
+        if conn.depth == 0 : 
+            conn.rollback()
+        raise
+    else : 
+        if conn.depth == 0 : 
+            conn.commit()
+    finally : 
+        cur.close()
+
 
 # Push the coordinates and date/time of the thresholded pixels to PostGIS
 def push_list_to_postgis(config, list, date, table, pSize, band):
+    """loads a list of (lat, lon) points into the table. The points are 
+    streamed into a temporary staging table with COPY, then inserted into 
+    the table (making the geometries) with one statement, and committed 
+    once (or with the enclosing transaction()). The Albers and NLCD
+    coordinates are computed here, for the whole list at once, and stored
+    in geom_albers and geom_nlcd. If the burn mask is cached (see 
+    get_landmask()), masked points are flagged or dropped here too."""
     print "\nPushing data to {0} DB table: {1}.{2}".format(config.DBname, config.DBschema,table)
     format = '%Y-%m-%d %H:%M:%S'
-    # Connect to VIIRS database
-    ConnParam = postgis_conn_params(config)
-    conn = psycopg2.connect(ConnParam)
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
-    
-    #batch up the list 100 items at a time
-    for batchiter in batch(list, 100) :
-        
-        # Construct a command to insert a batch of new records into table
-        preamble = "INSERT INTO \"%s\".%s (latitude, longitude, collection_date, geom, pixel_size, band_i_m) VALUES "%(config.DBschema, table)
-        values = [ ]
-        for i in batchiter : 
-            values.append("('%s','%s','%s', ST_GeomFromText('POINT(%s %s)',4326),'%s','%s')"%
-                 (i[0], i[1], datetime.datetime.strftime(date, format), i[1], i[0],pSize,band))
-        query = "{0} {1};".format(preamble, ",".join(values))
-        
-        # Execute and commit the batch loading command.
-        cur.execute(query)
-        conn.commit()
-        
-    old_isolation_level = conn.isolation_level
-    conn.set_isolation_level(0)
-    cur.execute("VACUUM ANALYZE \"%s\".%s;"%(config.DBschema, table)) 
-    conn.set_isolation_level(old_isolation_level)
-    conn.commit()
-    # Close communication with the database
-    cur.close()
-    conn.close()
+    if len(list) == 0 : 
+        return
+
+    points = np.array(list, dtype=np.float64)
+    masked = np.zeros(len(list), dtype=np.bool)
+    landmask = get_landmask(config)
+    if landmask is not None : 
+        masked = landmask.lookup_lonlat(points[:,1], points[:,0])
+        if config.BMingest == 'drop' : 
+            keep = np.logical_not(masked)
+            list = [ pt for pt, k in zip(list, keep) if k ]
+            points = points[keep]
+            masked = masked[keep]
+            if len(list) == 0 : 
+                return
+    albers_x, albers_y = viirs_proj.projections[srids["Albers"]].forward(
+                                               points[:,1], points[:,0])
+    nlcd_x, nlcd_y = viirs_proj.projections[srids["NLCD"]].forward(
+                                               points[:,1], points[:,0])
+
+    # Format the points as CSV. The coordinates are formatted exactly as 
+    # they used to be in the INSERT statements.
+    rows = cStringIO.StringIO()
+    for i, pt in enumerate(list) : 
+        rows.write("%s,%s,%r,%r,%r,%r,%s\n" % (pt[0], pt[1], albers_x[i], albers_y[i],
+                                            nlcd_x[i], nlcd_y[i], masked[i]))
+    rows.seek(0)
+
+    with session_cursor(config) as cur : 
+        # the staging table may be left over from an earlier push in the 
+        # same transaction
+        cur.execute("DROP TABLE IF EXISTS pg_temp.push_staging")
+        cur.execute("CREATE TEMPORARY TABLE push_staging (" + 
+                    "latitude double precision, longitude double precision, " + 
+                    "albers_x double precision, albers_y double precision, " + 
+                    "nlcd_x double precision, nlcd_y double precision, " + 
+                    "masked boolean) " + 
+                    "ON COMMIT DROP")
+        cur.copy_expert("COPY push_staging FROM STDIN WITH CSV", rows)
+        cur.execute(("INSERT INTO \"%s\".%s (latitude, longitude, collection_date, geom, pixel_size, band_i_m, " + 
+                     "geom_albers, geom_nlcd, masked) " + 
+                     "SELECT latitude, longitude, CAST(%%s AS timestamp), " + 
+                     "ST_SetSRID(ST_MakePoint(longitude, latitude), %d), " + 
+                     "CAST(%%s AS integer), %%s, " + 
+                     "ST_SetSRID(ST_MakePoint(albers_x, albers_y), %d), " + 
+                     "ST_SetSRID(ST_MakePoint(nlcd_x, nlcd_y), %d), masked " + 
+                     "FROM push_staging") % (config.DBschema, table, srids["WGS84"],
+                                             srids["Albers"], srids["NLCD"]), 
+                    (datetime.datetime.strftime(date, format), pSize, band))
     
+# burn masks loaded in this process, by cache directory
+_landmasks = {}
+
+def get_landmask(config) : 
+    """returns the cached copy of the burn mask if the configuration has a
+    [Burnmask] cache directory, or None if masking is done in the database.
+    The copy is exported from the database the first time, and again if 
+    the copy in the directory is of another mask table or does not cover 
+    the run's window."""
+    if not config.has_burnmask_cache() : 
+        return None
+    if config.BMingest not in ['flag', 'drop'] : 
+        raise ValueError("Unknown Burnmask ingest option: {0}".format(config.BMingest))
+    # viirs_landmask imports this module
+    import viirs_landmask
+    if not viirs_landmask.covers(config.BMcache, config) : 
+        print "Exporting {0}.{1} to {2}".format(config.BMschema, config.BMtable, config.BMcache)
+        _landmasks[config.BMcache] = viirs_landmask.Landmask.export(config, config.BMcache)
+    elif config.BMcache not in _landmasks : 
+        _landmasks[config.BMcache] = viirs_landmask.Landmask.load(config.BMcache, config)
+    return _landmasks[config.BMcache]
+
 def execute_query(config, queryText):
     print "Start", queryText, get_time()
-    ConnParam = postgis_conn_params(config)
-    conn = psycopg2.connect(ConnParam)
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
-    cur.execute(queryText)
-    conn.commit()
-    # Close communication with the database
-    cur.close()
-    conn.close()
+    with session_cursor(config) as cur : 
+        cur.execute(queryText)
     print "End", queryText, get_time()
 
+def fetch_query(config, queryText) : 
+    """executes a query and returns all the rows of the result"""
+    with session_cursor(config) as cur : 
+        cur.execute(queryText)
+        return cur.fetchall()
+
+def execute_prepared(config, name, types, queryText, params) : 
+    """executes queryText (which refers to its parameters as $1, $2, ...) as
+    the prepared statement called name, preparing it if this is the first 
+    use in the session. types lists the SQL types of the parameters."""
+    print "Start", name, params, get_time()
+    conn = get_session(config)
+    with session_cursor(config) as cur : 
+        if name not in conn.prepared : 
+            cur.execute("PREPARE {0} ({1}) AS {2}".format(name, ", ".join(types), queryText))
+            conn.prepared.add(name)
+        cur.execute("EXECUTE {0} ({1})".format(name, ", ".join(["%s"]*len(params))), params)
+    print "End", name, get_time()
+
 def execute_sql_file(config, filename):
     print "Start", get_time()
 
@@ -246,22 +397,31 @@ def execute_check_4_activity(config, collectionDate):
     query_text = "SELECT viirs_check_4_activity('{0}', '{1}', '{2}');".format(config.DBschema, collectionDate, config.get_sql_interval())
     execute_query(config,query_text)
  
+# parameter types of viirs_activefire_2_fireevents and viirs_threshold_2_fireevents
+confirm_types = ['varchar(200)', 'timestamp without time zone', 'interval', 
+                 'integer', 'text', 'text']
+
+def confirm_params(config, collectionDate) : 
+    """the parameters of the confirmation functions for collectionDate. The
+    burn mask parameters are NULL if there is no burn mask, or if it was
+    applied as the points were loaded."""
+    bm_schema = bm_table = None
+    if config.has_burnmask() and not config.has_burnmask_cache() : 
+        bm_schema, bm_table = config.BMschema, config.BMtable
+    return (config.DBschema, collectionDate, config.get_sql_interval(), 
+            int(config.SpatialProximity), bm_schema, bm_table)
+
 def execute_active_fire_2_events(config, collectionDate):
     print "Start active_fire to fire_events", get_time()
-    if not config.has_burnmask() : 
-        query_text = "SELECT VIIRS_activefire_2_fireevents('{0}', '{1}', '{2}', {3});".format(config.DBschema, collectionDate, config.get_sql_interval(), int(config.SpatialProximity))
-    else : 
-        query_text = "SELECT VIIRS_activefire_2_fireevents('{0}', '{1}', '{2}', {3}, '{4}', '{5}');".format(config.DBschema, collectionDate, config.get_sql_interval(), int(config.SpatialProximity), config.BMschema, config.BMtable)
-        
-    execute_query(config,query_text)
+    execute_prepared(config, "viirs_af_2_events", confirm_types + ['boolean'], 
+            "SELECT VIIRS_activefire_2_fireevents($1, $2, $3, $4, $5, $6, $7)", 
+            confirm_params(config, collectionDate) + (config.has_af_only(),))
 
 def execute_threshold_2_events(config, collectionDate):
     print "Start VIIRS_threshold_2_fireevents", get_time()
-    if not config.has_burnmask() : 
-        query_text = "SELECT VIIRS_threshold_2_fireevents('{0}', '{1}', '{2}', {3});".format(config.DBschema, collectionDate, config.get_sql_interval(), int(config.SpatialProximity))
-    else:
-        query_text = "SELECT VIIRS_threshold_2_fireevents('{0}', '{1}', '{2}', {3}, '{4}', '{5}');".format(config.DBschema, collectionDate, config.get_sql_interval(), int(config.SpatialProximity), config.BMschema, config.BMtable)
-    execute_query(config,query_text)
+    execute_prepared(config, "viirs_threshold_2_events", confirm_types, 
+            "SELECT VIIRS_threshold_2_fireevents($1, $2, $3, $4, $5, $6)", 
+            confirm_params(config, collectionDate))
 
 def execute_simple_confirm_burns(config, collectionDate):
     print "Start threshold_burned to fire_events", get_time()
@@ -279,30 +439,111 @@ def execute_simple_confirm_burns(config, collectionDate):
     # query_text = "SELECT copy_activefire_2_fireevents(\'{0}\');".format(collectionDate)
     # execute_query(config,query_text)
     
-def vacuum_analyze(config, table):
+def partition_suffix(config, dt) : 
+    """the suffix of the partitions holding the collection date dt, as named
+    by viirs_ensure_partition"""
+    if config.Partition == 'week' : 
+        dt = dt - datetime.timedelta(days=dt.weekday())
+    return dt.strftime('_p%Y%m01' if config.Partition == 'month' else '_p%Y%m%d')
+
+def vacuum_analyze(config, table, dt=None):
+    """vacuums and analyzes table. If the tables are partitioned and dt is
+    given, only the partition holding the collection date dt is touched."""
+    if dt is not None and config.has_partitions() : 
+        table = table + partition_suffix(config, dt)
     print "Start Vacuum {0}.{1}".format(config.DBschema, table), get_time()
     query_text = "VACUUM ANALYZE \"{0}\".{1}".format(config.DBschema, table) 
-    # Connect to VIIRS database
-    ConnParam = postgis_conn_params(config)
-    conn = psycopg2.connect(ConnParam)
-    old_isolation_level = conn.isolation_level
-    conn.set_isolation_level(0)
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
-    cur.execute(query_text)
+    # VACUUM cannot run inside a transaction
+    conn = get_session(config)
+    if conn.depth > 0 : 
+        raise ValueError("Cannot vacuum inside a transaction() block")
     conn.commit()
-    conn.set_isolation_level(old_isolation_level)
-    # Close communication with the database
-    cur.close()
-    conn.close()
+    conn.autocommit = True
+    try : 
+        cur = conn.cursor()
+        cur.execute(query_text)
+        cur.close()
+    finally : 
+        conn.autocommit = False
     print "End Vacuum {0}".format(table), get_time(), "\n"
 
-def initialize_schema_for_postgis(config) : 
-    """create the schema to hold outputs, populate with empty tables"""
-    query_text = "SELECT init_schema('{0}')".format(config.DBschema)
+def initialize_schema_for_postgis(config, deferred=False) : 
+    """create the schema to hold outputs, populate with empty tables. If 
+    the tables are partitioned, the partitions for the run's dates are made
+    up front, so that workers loading granules never race to make them.
+    If deferred, the tables have no keys or indexes (and are UNLOGGED unless
+    partitioned) until build_indexes() is called."""
+    partition = 'NULL'
+    if config.has_partitions() : 
+        partition = "'{0}'".format(config.Partition)
+    query_text = "SELECT init_schema('{0}', {1}, {2})".format(config.DBschema, 
+            partition, 'TRUE' if deferred else 'FALSE')
     execute_query(config,query_text)
+    if not config.has_partitions() : 
+        return
+
+    made = set()
+    for ImageDate in config.SortedImageDates : 
+        dt = FileSet.from_imagedate(ImageDate).get_datetime()
+        if partition_suffix(config, dt) not in made : 
+            execute_query(config, "SELECT viirs_ensure_partition('{0}', '{1}', '{2}')".format(
+                    config.DBschema, config.Partition, dt.strftime("%Y-%m-%d %H:%M:%S")))
+            made.add(partition_suffix(config, dt))
     
 
+def init_run_store(config) : 
+    """makes the run store of config, if it keeps runs in one. Drivers call
+    this once, before starting any runs, rather than every run making it."""
+    if config.has_run_store() : 
+        execute_query(config, "SELECT init_run_store('{0}')".format(config.RunStore))
+
+def build_indexes(config, set_logged=False) : 
+    """adds the keys and indexes left out of a schema initialized with 
+    deferred=True, and analyzes its tables. The tables stay UNLOGGED unless
+    set_logged."""
+    execute_query(config, "SELECT viirs_build_indexes('{0}', {1})".format(
+            config.DBschema, 'TRUE' if set_logged else 'FALSE'))
+
+def store_run(config) : 
+    """moves the finished run out of its schema, into the run store. The 
+    store keeps fire_collections, fire_events and threshold_burned, but not
+    active_fire, so a stored run cannot be reconfirmed (see 
+    misc_utils/replay_confirmation.py) without loading its granules again."""
+    if not hasattr(config, 'run_id') : 
+        raise ValueError("Only Run_NNNN schemas can be stored, not {0}".format(config.DBschema))
+    print "Storing {0} as run {1} of {2}".format(config.DBschema, config.run_id, 
+            config.RunStore), get_time()
+    execute_query(config, "SELECT viirs_store_run('{0}', '{1}', {2})".format(
+            config.DBschema, config.RunStore, int(config.run_id)))
+
+def drop_run(config) : 
+    """removes a run: its schema, its stored copy (if it is kept in a run 
+    store) and its output directory. Nothing is left to reconfirm it from."""
+    if config.has_run_store() : 
+        execute_query(config, "SELECT viirs_drop_run('{0}', {1})".format(
+                config.RunStore, int(config.run_id)))
+    execute_query(config, 'DROP SCHEMA IF EXISTS "{0}" CASCADE'.format(config.DBschema))
+    if os.path.isdir(config.ShapePath) : 
+        shutil.rmtree(config.ShapePath)
+
+@contextlib.contextmanager
+def run_workspace(config) : 
+    """for runs kept in a run store, makes the run's schema for the duration
+    of the with block, holding a fire_events view of the stored run. The 
+    evaluation functions write their tables into it, and it is dropped 
+    afterward. Does nothing for runs kept in their own schemas. The 
+    workspace has no point tables (the store has no active_fire), so it
+    serves evaluation only, not reconfirmation."""
+    if not config.has_run_store() : 
+        yield
+        return
+    execute_query(config, "SELECT viirs_run_workspace('{0}', '{1}', {2})".format(
+            config.DBschema, config.RunStore, int(config.run_id)))
+    try : 
+        yield
+    finally : 
+        execute_query(config, 'DROP SCHEMA IF EXISTS "{0}" CASCADE'.format(config.DBschema))
+
 def get_time():
     ts = time.time()
     dt = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
@@ -371,6 +612,205 @@ def ba_threshold(config, m07, m08, m10, m11, af, geo) :
         
     return BaCon
 
+def ba_threshold_counts(config, m07, m08, m10, m11, af, geo) : 
+    """produces exactly the same mask as ba_threshold(), without converting the
+    bands to reflectance. The reflectance bounds are turned into raw count 
+    bounds using each file's ReflectanceFactors and compared against the 
+    uint16 counts. The Rth ratio test is only computed (in floating point) 
+    for the pixels which survive all the other tests."""
+    M07Raw = m07.get_raw()
+    M08Raw = m08.get_raw()
+    M10Raw = m10.get_raw()
+    M11Raw = m11.get_raw()
+
+    print "Thresholding"
+    BaCon = ((M07Raw <  m07.count_below(config.M07UB)) &
+             (M08Raw >= m08.count_above(config.M08LB)) &
+             (M08Raw <  m08.count_below(config.M08UB)) &
+             (M10Raw >= m10.count_above(config.M10LB)) &
+             (M10Raw <  m10.count_below(config.M10UB)) &
+             (M11Raw >= m11.count_above(config.M11LB)) &
+             (af.get_non_fire()) &
+             (geo.day_pixels(config.MaxSolZen)) &   #this should supress night pixels
+             m07.qa & m08.qa & m10.qa & m11.qa)
+
+    # Rth ratio test on the survivors only. Pixels where M11 is zero fail.
+    idx = np.where(BaCon)
+    M08Refl = m08.get_refl_lut()[M08Raw[idx]]
+    M11Refl = m11.get_refl_lut()[M11Raw[idx]]
+    with np.errstate(divide='ignore', invalid='ignore') : 
+        Ratio = (M08Refl-config.RthSub)/M11Refl
+    BaCon[idx] = ((M11Refl != 0) & 
+                  (Ratio >= config.RthLB) & 
+                  (Ratio < config.Rth))
+
+    return BaCon
+
+def scan_blocks(nrows, block_rows) : 
+    """yields slices which cover nrows in blocks of whole M-band scans. The
+    requested block_rows is rounded up to a multiple of the scan height."""
+    nscans = max(1, int(np.ceil(block_rows / float(scan_rows))))
+    step = nscans * scan_rows
+    for start in range(0, nrows, step) : 
+        yield slice(start, min(start+step, nrows))
+
+def af750_list(config, af_750, geo_750) : 
+    """returns the list of 750m active fire coordinates"""
+    #Set up Active Fire Conditional array: AfCon
+    AfCon = af_750.get_conditional()
+                    
+    # Apply geographic window, if specified
+    geo_750.apply_window(config, AfCon)
+        
+    # Get coordinates of all active fire pixels 
+    AfLatLons = geo_750.make_list(AfCon)  
+
+    # Convert coordinate array to list
+    return array2list(AfLatLons)
+
+def empty_750(config) : 
+    """the return value of threshold_750() for a granule which lies entirely
+    outside the geographic window"""
+    if config.use750af == "y":
+        return [], []
+    return [], None
+
+def threshold_375(config, files) : 
+    """loads the I-band geolocation and 375m active fire data for a granule
+    and returns the list of 375m active fire coordinates. When a geographic 
+    window is set, only the rows which can intersect it are read. Whole rows
+    are kept so the per-row limit375 counts are unaffected by the window."""
+    granule = load_375(config, files)
+    if granule is None : 
+        return []
+    return af375_list(config, *granule)
+
+def load_375(config, files) : 
+    """reads the I-band geolocation and 375m active fire data for a granule, 
+    returning (af_375, geo_375), or None if the granule lies entirely outside
+    the geographic window. Only whole rows are ever skipped."""
+    geo = GeoFile375.open(files['GITCO_npp'])
+    rows, cols = geo.find_window(config)
+    if rows.start == rows.stop : 
+        return None
+    geo_375 = geo.read_block(rows)
+    af_375 = ActiveFire375.open(files['VF375_npp']).read_block(rows)
+    return af_375, geo_375
+
+def af375_list(config, af_375, geo_375) : 
+    """returns the list of 375m active fire coordinates"""
+    #Set up Active Fire Conditional array: AfCon
+    #filter out rows having more than limit375 high confidence
+    #points
+    AfCon = af_375.get_conditional(
+                threshold=getattr(config, "limit375", None),
+                recode_val=10)
+    af_375.filter_conditional(AfCon, 10)
+    
+    # Apply geographic window, if specified
+    geo_375.apply_window(config, AfCon)
+        
+    # Get coordinates of all active fire pixels 
+    return geo_375.make_list(AfCon) 
+
+def load_750(config, files) : 
+    """reads the M-band reflectance, geolocation and 750m active fire data for
+    a granule. When a geographic window is set, only the region which can 
+    intersect it is read. Returns (m07, m08, m10, m11, af_750, geo_750) with 
+    the reflectance still in raw counts, or None if the granule lies entirely
+    outside the window. geo_750.region holds the (rows, cols) slices which 
+    were read."""
+    # Read GMTCO, locating the part of the granule inside the window
+    geo = GeoFile750.open(files['GMTCO_npp'])
+    rows, cols = geo.find_window(config)
+    if rows.start == rows.stop : 
+        return None
+    geo_750 = geo.read_block(rows, cols)
+    geo_750.region = (rows, cols)
+
+    # load only the windowed region of the reflectance data
+    m07 = VIIRSReflectanceFile.open(files['SVM07_npp'],'SVM07_npp').read_block(rows, cols)
+    m08 = VIIRSReflectanceFile.open(files['SVM08_npp'],'SVM08_npp').read_block(rows, cols)
+    m10 = VIIRSReflectanceFile.open(files['SVM10_npp'],'SVM10_npp').read_block(rows, cols)
+    m11 = VIIRSReflectanceFile.open(files['SVM11_npp'],'SVM11_npp').read_block(rows, cols)
+
+    # Read AVAFO
+    af_750 = ActiveFire750.open(files['AVAFO_npp']).read_block(rows, cols)
+
+    return m07, m08, m10, m11, af_750, geo_750
+
+def threshold_750(config, files) : 
+    """loads the M-band data for a granule, thresholds it for burned area
+    and extracts the 750m active fire points.
+    Returns the list of burned area coordinates and the list of 750m 
+    active fire coordinates (None if use750af is not set)."""
+    if config.has_blocks() : 
+        return threshold_750_blocks(config, files)
+
+    granule = load_750(config, files)
+    if granule is None : 
+        return empty_750(config)
+    return ba_lists(config, *granule)
+
+def ba_lists(config, m07, m08, m10, m11, af_750, geo_750) : 
+    """thresholds a granule read by load_750(), returning the list of burned 
+    area coordinates and the list of 750m active fire coordinates (None if 
+    use750af is not set)."""
+    # Set up Burned Area Conditional array: BaCon
+    BaCon = ba_threshold_counts(config, m07, m08, m10, m11, af_750, geo_750)
+
+    # Apply geographic window, if specified
+    geo_750.apply_window(config,BaCon)
+                    
+    # Get Burned area coordinates as an array
+    BaOut_list = geo_750.make_list(BaCon)
+
+    AfOut_list = None
+    if config.use750af == "y":
+        AfOut_list = af750_list(config, af_750, geo_750)
+
+    return BaOut_list, AfOut_list
+
+def threshold_750_blocks(config, files) : 
+    """same as threshold_750(), but walks the granule in blocks of
+    config.BlockRows scan lines, reading only one slab of each M-band
+    dataset at a time. Peak memory is bounded by the block size rather than
+    the granule size."""
+    m07 = VIIRSReflectanceFile.open(files['SVM07_npp'],'SVM07_npp')     
+    m08 = VIIRSReflectanceFile.open(files['SVM08_npp'],'SVM08_npp')     
+    m10 = VIIRSReflectanceFile.open(files['SVM10_npp'],'SVM10_npp')     
+    m11 = VIIRSReflectanceFile.open(files['SVM11_npp'],'SVM11_npp')     
+    geo_750 = GeoFile750.open(files['GMTCO_npp'])
+    af_750 = ActiveFire750.open(files['AVAFO_npp'])            
+
+    BaOut_list = [ ] 
+    AfOut_list = None
+    if config.use750af == "y":
+        AfOut_list = [ ] 
+
+    for block_rows in scan_blocks(m07.shape[0], config.BlockRows) : 
+        # skip the block entirely if it is outside the window, otherwise
+        # read only the part of the block which is inside
+        geo_block = geo_750.read_block(block_rows)
+        rows, cols = geo_block.window_region(config)
+        if rows.start == rows.stop : 
+            continue
+        geo_block = geo_block.crop(rows, cols)
+        rows = slice(block_rows.start + rows.start, block_rows.start + rows.stop)
+
+        af_block  = af_750.read_block(rows, cols)
+        BaCon = ba_threshold_counts(config, 
+                             m07.read_block(rows, cols), m08.read_block(rows, cols), 
+                             m10.read_block(rows, cols), m11.read_block(rows, cols), 
+                             af_block, geo_block)
+        geo_block.apply_window(config, BaCon)
+        BaOut_list.extend(geo_block.make_list(BaCon))
+
+        if AfOut_list is not None : 
+            AfOut_list.extend(af750_list(config, af_block, geo_block))
+
+    return BaOut_list, AfOut_list
+
 
 class FileSet (object) : 
     """Represents a set of files containing satellite data from the same scene.
@@ -498,6 +938,28 @@ class VIIRSReflectanceFile (ReflectanceFile) :
         target._calc_qa_mask()
         return target
 
+    @classmethod
+    def open(cls, filename, band) : 
+        """opens filename without reading the reflectance data. The returned
+        object only knows the shape of the data; use read_block() to obtain
+        objects holding a slab of scan lines."""
+        target = cls()
+        target._hdf = h5py.File(filename, "r")
+        target._band = band
+        target.ReflFact = target._hdf[cls.cor_factors[band]][:]
+        target.shape = target._hdf[cls.datasets[band]].shape
+        return target
+
+    def read_block(self, rows, cols=slice(None)) : 
+        """reads the rows and cols (slices) of the raw reflectance data and 
+        returns them as a new object. Only valid on objects created with open()."""
+        block = self.__class__()
+        block.ReflArray = self._hdf[self.datasets[self._band]][rows, cols]
+        block.ReflFact = self.ReflFact
+        block.corrected = False
+        block._calc_qa_mask()
+        return block
+
     def _calc_qa_mask(self) : 
         """produces a mask of true values where data quality is good.
         Must be performed on raw data (prior to calling get_cor_refl). Not intended
@@ -508,9 +970,47 @@ class VIIRSReflectanceFile (ReflectanceFile) :
         """calculates (if necessary) and returns the corrected reflectance.
         Note this modifies the values in this object's ReflArray."""
         if not self.corrected : 
-            self.ReflArray = self.ReflArray*self.ReflFact[0]  + self.ReflFact[1]
+            self.ReflArray = self._apply_factors(self.ReflArray)
             self.corrected = True
         return self.ReflArray
+
+    def _apply_factors(self, counts) : 
+        """converts raw counts to corrected reflectance"""
+        return counts*self.ReflFact[0]  + self.ReflFact[1]
+
+    def get_raw(self) : 
+        """returns the raw (uncorrected) counts"""
+        if self.corrected : 
+            raise ValueError("Raw counts have been replaced by get_cor_refl()")
+        return self.ReflArray
+
+    def get_refl_lut(self) : 
+        """computes (if necessary) and returns the corrected reflectance of every
+        possible raw count, using the same arithmetic as get_cor_refl(). 
+        Indexing this table with raw counts gives the corrected reflectance."""
+        if not hasattr(self, '_refl_lut') : 
+            raw = self.get_raw()
+            counts = np.arange(np.iinfo(raw.dtype).max+1, dtype=raw.dtype)
+            self._refl_lut = self._apply_factors(counts)
+        return self._refl_lut
+
+    def count_below(self, refl) : 
+        """returns the raw count c such that (raw < c) exactly where 
+        (corrected reflectance < refl)."""
+        below = (self.get_refl_lut() < refl)
+        c = np.count_nonzero(below)
+        if not np.all(below[:c]) : 
+            raise ValueError("Reflectance factors do not increase with raw count")
+        return c
+
+    def count_above(self, refl) : 
+        """returns the raw count c such that (raw >= c) exactly where
+        (corrected reflectance > refl)."""
+        above = (self.get_refl_lut() > refl)
+        c = len(above) - np.count_nonzero(above)
+        if not np.all(above[c:]) : 
+            raise ValueError("Reflectance factors do not increase with raw count")
+        return c
      
 
 
@@ -542,35 +1042,97 @@ class GeoFile(object) :
         """given a specified solar zenith angle defining "sundown", returns 
         where the day pixels are"""
         return self.SolZen < zenith
+
+    @classmethod
+    def load(cls,filename) : 
+        target = cls()
+        GeoHdf = h5py.File(filename,"r")
+        for attr, dataset in cls.datasets.items() : 
+            setattr(target, attr, GeoHdf[dataset][:])
+        return target 
+
+    @classmethod
+    def open(cls, filename) : 
+        """opens filename without reading the geolocation data. Use 
+        read_block() to obtain objects holding a slab of scan lines."""
+        target = cls()
+        target._GeoHdf = h5py.File(filename,"r")
+        target.shape = target._GeoHdf[cls.datasets['LatArray']].shape
+        return target
+
+    def read_block(self, rows, cols=slice(None)) : 
+        """reads the rows and cols (slices) of all the geolocation datasets and 
+        returns them as a new object. Only valid on objects created with open().
+        Lat/lon arrays already read by find_window() are not read again."""
+        coords = getattr(self, '_coords', None)
+        block = self.__class__()
+        for attr, dataset in self.datasets.items() : 
+            if coords is not None and hasattr(coords, attr) : 
+                setattr(block, attr, getattr(coords, attr)[rows, cols])
+            else : 
+                setattr(block, attr, self._GeoHdf[dataset][rows, cols])
+        return block
+
+    def find_window(self, config) : 
+        """locates the region of the file which can intersect the geographic
+        window in config, returning (rows, cols) slices. Only the lat/lon 
+        datasets are read to do this. Only valid on objects created with open()."""
+        if not config.has_window() : 
+            return (slice(0, self.shape[0]), slice(0, self.shape[1]))
+        coords = self.__class__()
+        coords.LatArray = self._GeoHdf[self.datasets['LatArray']][:]
+        coords.LonArray = self._GeoHdf[self.datasets['LonArray']][:]
+        self._coords = coords
+        return coords.window_region(config)
+
+    def window_region(self, config) : 
+        """returns (rows, cols) slices bounding the pixels of this object which
+        lie inside the geographic window specified in config. Both slices are 
+        empty if nothing is inside the window. Without a window, the slices
+        cover the whole object."""
+        nrows, ncols = self.LatArray.shape
+        if not config.has_window() : 
+            return (slice(0, nrows), slice(0, ncols))
+        inside = ((self.LatArray <= config.north) & 
+                  (self.LatArray >= config.south) & 
+                  (self.LonArray >= config.west) & 
+                  (self.LonArray <= config.east))
+        rows = np.where(np.any(inside, 1))[0]
+        cols = np.where(np.any(inside, 0))[0]
+        if len(rows) == 0 : 
+            return (slice(0,0), slice(0,0))
+        return (slice(rows[0], rows[-1]+1), slice(cols[0], cols[-1]+1))
+
+    def crop(self, rows, cols) : 
+        """returns a new object holding the rows and cols (slices) of this
+        object's arrays. No data are read from disk."""
+        block = self.__class__()
+        for attr in self.datasets.keys() : 
+            setattr(block, attr, getattr(self, attr)[rows, cols])
+        return block
         
 
 
 class GeoFile750(GeoFile) : 
+    datasets = { 
+        'LatArray' : 'All_Data/VIIRS-MOD-GEO-TC_All/Latitude',
+        'LonArray' : 'All_Data/VIIRS-MOD-GEO-TC_All/Longitude',
+        'SolZen'   : 'All_Data/VIIRS-MOD-GEO-TC_All/SolarZenithAngle'
+    }
+
     def __init__(self) :
         self.pixel_size = 750
         self.band_i_m   = 'm'
         
-    @classmethod
-    def load(cls,filename) : 
-        target = cls()
-        GeoHdf = h5py.File(filename,"r")
-        target.LatArray = GeoHdf['All_Data/VIIRS-MOD-GEO-TC_All/Latitude'][:]
-        target.LonArray = GeoHdf['All_Data/VIIRS-MOD-GEO-TC_All/Longitude'][:]
-        target.SolZen = GeoHdf['All_Data/VIIRS-MOD-GEO-TC_All/SolarZenithAngle'][:]
-        return target 
-        
 class GeoFile375(GeoFile) : 
+    datasets = { 
+        'LatArray' : 'All_Data/VIIRS-IMG-GEO-TC_All/Latitude',
+        'LonArray' : 'All_Data/VIIRS-IMG-GEO-TC_All/Longitude'
+    }
+
     def __init__(self) : 
         self.pixel_size = 375
         self.band_i_m   = 'i'
-    
-    @classmethod
-    def load(cls, filename) :
-        target = cls()
-        GeoHdf = h5py.File(filename,"r")
-        target.LatArray = GeoHdf['All_Data/VIIRS-IMG-GEO-TC_All/Latitude'][:]
-        target.LonArray = GeoHdf['All_Data/VIIRS-IMG-GEO-TC_All/Longitude'][:]
-        return target
 
         
     
@@ -645,6 +1207,23 @@ class ActiveFire750 (ActiveFire) :
         target.AfArray = target._AfHdf['All_Data/VIIRS-AF-EDR_All/fireMask'][:]
         target.AfDateTime = h5_date_time(os.path.basename(filename))
         return target
+
+    @classmethod
+    def open(cls, filename) : 
+        """opens a 750m VIIRS HDF 5 file without reading the fire mask. Use
+        read_block() to obtain objects holding a slab of scan lines."""
+        target = cls()
+        target._AfHdf = h5py.File(filename, "r")
+        target.AfDateTime = h5_date_time(os.path.basename(filename))
+        return target
+
+    def read_block(self, rows, cols=slice(None)) : 
+        """reads the rows and cols (slices) of the fire mask and returns them 
+        as a new object. Only valid on objects created with open()."""
+        block = self.__class__()
+        block.AfArray = self._AfHdf['All_Data/VIIRS-AF-EDR_All/fireMask'][rows, cols]
+        block.AfDateTime = self.AfDateTime
+        return block
         
     
 class ActiveFire375 (ActiveFire) : 
@@ -662,6 +1241,24 @@ class ActiveFire375 (ActiveFire) :
         target.AfDateTime = h5_date_time(os.path.basename(filename))
         return target
 
+    @classmethod
+    def open(cls, filename) : 
+        """opens a 375m VIIRS HDF4 file without reading the fire mask. Use 
+        read_block() to obtain objects holding a subset of the rows."""
+        target = cls() 
+        target._AF375hdf = SD(filename, SDC.READ)
+        target._AF375_fm = target._AF375hdf.select('fire mask')
+        target.AfDateTime = h5_date_time(os.path.basename(filename))
+        return target
+
+    def read_block(self, rows, cols=slice(None)) : 
+        """reads the rows and cols (slices) of the fire mask and returns them
+        as a new object. Only valid on objects created with open()."""
+        block = self.__class__()
+        block.AfArray = self._AF375_fm[rows, cols]
+        block.AfDateTime = self.AfDateTime
+        return block
+
         
     def count_high_confidence(self) : 
         """counts the number of high confidence pixels by row"""
@@ -693,10 +1290,359 @@ class ActiveFire375 (ActiveFire) :
             self.recode_high_confidence(threshold, recode_val)                    
         return con
 
-def run(config):
+def threshold_granule(config, files) : 
+    """thresholds one granule for burned area and extracts the active fire 
+    points. Returns (BaOut_list, AfOut_list, Af375Out_list); an active fire
+    list is None when that product is not in use."""
+    # Threshold burned area and extract the 750m active fire
+    BaOut_list, AfOut_list = threshold_750(config, files)
+
+    Af375Out_list = None
+    if config.use375af == "y":
+        Af375Out_list = threshold_375(config, files)
+
+    return BaOut_list, AfOut_list, Af375Out_list
+
+def write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list, 
+                  textdir=None) : 
+    """writes the burned area and active fire points of one granule to text
+    files and/or PostGIS, as requested by config. The text files go in 
+    textdir, if given."""
+    # Burned area output to text
+    if config.TextOut == "y":
+        write_coordinates2text(config, BaOut_list, 
+             "BaOut_" + fileset.get_out_date(), fileset.get_datetime(), textdir)
+
+    # Burned area output to PostGIS 
+    if config.DatabaseOut == "y":
+        push_list_to_postgis(config, BaOut_list, 
+             fileset.get_datetime(), "threshold_burned", "750", "m")
+        #vacuum_analyze(config,"threshold_burned")
+
+    if config.TextOut == "y":
+        if config.use750af == "y":  
+            # Write active fire 750 coordinates to text
+            write_coordinates2text(config, AfOut_list, 
+                   "AfOut_" + fileset.get_out_date(), 
+                   fileset.get_datetime(), textdir)
+        if config.use375af == "y":    
+            # Write active fire 375 coordinates to text
+            write_coordinates2text(config, Af375Out_list, 
+                   "AfOut_" + fileset.get_out_date(), 
+                   fileset.get_datetime(), textdir)
+
+    # Push active fire coordinates to PostGIS
+    if config.DatabaseOut == "y":
+        if config.use375af == "y":
+            # write 375 active fire to DB
+            push_list_to_postgis(config,Af375Out_list, 
+                 fileset.get_datetime(), "active_fire", "375", "i")
+            #vacuum_analyze(config,"active_fire")
+        
+        if config.use750af == "y":
+            # write 750 active fire to DB
+            push_list_to_postgis(config,AfOut_list, 
+                 fileset.get_datetime(), "active_fire", "750", "m")
+            #vacuum_analyze(config,"active_fire")
+
+def get_confirmer(config) : 
+    """returns the in-memory confirmation engine for the run if 
+    ConfirmMethod is "memory" or "raster", or None if the dates are 
+    confirmed by the SQL functions (ConfirmMethod "sql", the default)."""
+    method = getattr(config, 'ConfirmMethod', 'sql')
+    if method == 'sql' : 
+        return None
+    if method not in ['memory', 'raster'] : 
+        raise ValueError("Unknown ConfirmMethod: {0}".format(method))
+    # viirs_confirm imports this module
+    import viirs_confirm
+    viirs_confirm.check_empty(config)
+    if method == 'raster' : 
+        return viirs_confirm.RasterConfirmEngine.for_config(config)
+    return viirs_confirm.ConfirmEngine.for_config(config)
+
+def confirm_granule(config, fileset, engine=None) : 
+    """turns the active fire and thresholded burned area points of one 
+    granule into fire events. Granules must be confirmed in date order.
+    Both steps share a transaction, so a date is either fully confirmed or
+    not confirmed at all. If engine is given (see get_confirmer()), the
+    date is confirmed in memory instead, and nothing is written until 
+    finish_run()."""
+    if engine is not None : 
+        print "\nConfirm in memory"
+        engine.confirm_date(config, fileset.get_sql_date())
+        return
+
+    with transaction(config) : 
+        # check if fires are still active
+        #print "\nChecking if fires are still active"
+        #date_4db = datetime.datetime.strftime(H5Date, "%Y-%m-%d %H:%M:%S")
+        #execute_check_4_activity(config, date_4db)
+        
+        # active fire to fires events 
+        print "\nCopy active fire to fire events and create collections"
+        execute_active_fire_2_events(config, fileset.get_sql_date())
+        #vacuum_analyze(config,"active_fire")
+
+        # simple confirm threshold burns 
+#        print "\nPerform simple confirm burned area"
+#        date_4db = datetime.datetime.strftime(H5Date, "%Y-%m-%d %H:%M:%S")
+#        execute_simple_confirm_burns(config, date_4db)
+#        #vacuum_analyze(config,"threshold_burned")
+
+        # threshold to fires events 
+        print "\nEvaluate and copy thresholded burned area to fire events"
+        execute_threshold_2_events(config, fileset.get_sql_date())
+
+    vacuum_analyze(config,"active_fire", fileset.get_datetime())
+    vacuum_analyze(config,"threshold_burned", fileset.get_datetime())
+    #vacuum_analyze(config, '')
+
+def finish_run(config, engine=None) : 
+    """writes the fire events confirmed in memory by engine (if any), the 
+    shapefiles (if requested) and saves the configuration alongside them
+    once all the granules have been processed."""
+    if engine is not None : 
+        print "\nWriting fire events confirmed in memory", get_time()
+        engine.write(config)
+
+    # Output shapefile
+    if config.ShapeOut == "y":
+        output_shape_files(config)
+
+    config.save(os.path.join(config.ShapePath, '{0}_{1}.ini'.format(config.DBname,config.DBschema)))
+
+    if config.DatabaseOut == "y" and config.has_run_store() : 
+        store_run(config)
+
+def read_granule(config, fileset) : 
+    """reader stage of run_pipelined(): reads the data for the granule 
+    without thresholding it. Returns (files, granule_750, granule_375), where 
+    granule_750 is the result of load_750() and granule_375 that of 
+    load_375(). In block mode, the M-band data are left to be read by 
+    threshold_750_blocks()."""
+    files = fileset.get_file_names(config.BaseDir)
+    granule_750 = None
+    if not config.has_blocks() : 
+        granule_750 = load_750(config, files)
+    granule_375 = None
+    if config.use375af == "y":
+        granule_375 = load_375(config, files)
+    return files, granule_750, granule_375
+
+def threshold_read(config, fileset, data) : 
+    """compute stage of run_pipelined(): thresholds a granule returned by
+    read_granule(). Returns the same as threshold_granule()."""
+    files, granule_750, granule_375 = data
+    if config.has_blocks() : 
+        BaOut_list, AfOut_list = threshold_750_blocks(config, files)
+    elif granule_750 is None : 
+        BaOut_list, AfOut_list = empty_750(config)
+    else : 
+        BaOut_list, AfOut_list = ba_lists(config, *granule_750)
+
+    Af375Out_list = None
+    if config.use375af == "y":
+        Af375Out_list = []
+        if granule_375 is not None : 
+            Af375Out_list = af375_list(config, *granule_375)
+
+    return BaOut_list, AfOut_list, Af375Out_list
+
+class _Failure (object) : 
+    """an exception raised in a pipeline stage, passed downstream in place
+    of a result so that it can be raised again by the consumer"""
+    def __init__(self) : 
+        self.exc_info = sys.exc_info()
+
+    def reraise(self) : 
+        raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+def _put(q, item, stop) : 
+    """puts item on q, giving up if stop is set while waiting for room"""
+    while not stop.is_set() : 
+        try : 
+            q.put(item, timeout=1)
+            return
+        except Queue.Full : 
+            pass
+
+def _get(q, stop) : 
+    """takes the next item from q. Returns None if stop is set first."""
+    while not stop.is_set() : 
+        try : 
+            return q.get(timeout=1)
+        except Queue.Empty : 
+            pass
+    return None
+
+def _stage(func, inq, outq, stop) : 
+    """thread body for one pipeline stage. Items are (fileset, data) pairs; 
+    func(fileset, data) is applied to each one from inq and the result is put
+    on outq, in order. None marks the end of the items. If func raises, a 
+    _Failure is put on outq and the stage ends."""
+    while True : 
+        item = _get(inq, stop)
+        if (item is None) or isinstance(item, _Failure) : 
+            _put(outq, item, stop)
+            return
+        fileset, data = item
+        try : 
+            result = (fileset, func(fileset, data))
+        except Exception : 
+            result = _Failure()
+        _put(outq, result, stop)
+        if isinstance(result, _Failure) : 
+            return
+
+def _write_stage(config, inq, outq, stop) : 
+    """thread body for the writer stage of run_pipelined(). Each granule's 
+    rows are written in one transaction, on the thread's own session, and 
+    the granule is passed on once they are committed."""
+    def write(fileset, results) : 
+        BaOut_list, AfOut_list, Af375Out_list = results
+        if config.DatabaseOut == "y":
+            with transaction(config) : 
+                write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list)
+        else : 
+            write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list)
+    try : 
+        _stage(write, inq, outq, stop)
+    finally : 
+        if config.DatabaseOut == "y":
+            close_session(config)
+
+def run_pipelined(config) : 
+    """same as run(), but reading, thresholding, writing and confirmation 
+    overlap. A reader thread reads the next granules while a compute thread
+    thresholds, a writer thread writes the results and the calling thread 
+    confirms them. Up to config.PipelineDepth granules wait between stages.
+    Granules come out of the pipeline in date order, and a date is only 
+    confirmed once its rows are committed, so confirmation still proceeds 
+    one date at a time, in order. An exception in any stage stops the 
+    pipeline and is raised here."""
+    engine = None
+    if config.DatabaseOut == "y":
+        initialize_schema_for_postgis(config)
+        engine = get_confirmer(config)
+        get_landmask(config)
+
+    start_group = datetime.datetime.now()
+    stop = threading.Event()
+    dates = Queue.Queue()
+    read_q = Queue.Queue(config.PipelineDepth)
+    done_q = Queue.Queue(config.PipelineDepth)
+    written_q = Queue.Queue(config.PipelineDepth)
+    for ImageDate in config.SortedImageDates:
+        dates.put((FileSet.from_imagedate(ImageDate), None))
+    dates.put(None)
+
+    stages = [ 
+        threading.Thread(target=_stage, args=(
+            lambda fileset, data : read_granule(config, fileset), 
+            dates, read_q, stop)),
+        threading.Thread(target=_stage, args=(
+            lambda fileset, data : threshold_read(config, fileset, data), 
+            read_q, done_q, stop)),
+        threading.Thread(target=_write_stage, args=(
+            config, done_q, written_q, stop)) ]
+    for t in stages : 
+        t.daemon = True
+        t.start()
+
+    count = 0
+    try : 
+        while True : 
+            item = _get(written_q, stop)
+            if item is None : 
+                break
+            if isinstance(item, _Failure) : 
+                item.reraise()
+            fileset = item[0]
+            count = count + 1
+
+            if config.DatabaseOut == "y":
+                confirm_granule(config, fileset, engine)
+            item = None
+            gc.collect()
+            print "Done Processing:", fileset.get_imagedate(),  
+            print "Number:", count, "of:", len(config.SortedImageDates)
+            print "*"*50 + "\n"
+    finally : 
+        stop.set()
+        for t in stages : 
+            t.join()
+
+    finish_run(config, engine)
+
+    end_group = datetime.datetime.now()
+    print end_group.strftime("%Y%m%d %H:%M:%S")
+    print "Elapsed time for group:", (end_group - start_group).total_seconds(), "seconds"
+
+    print "Done"
+
+def push_granule(args) : 
+    """pool worker for run_parallel(): reads, thresholds and writes one 
+    granule given (config, ImageDate). Returns the ImageDate once the rows 
+    have been committed."""
+    config, ImageDate = args
+    fileset = FileSet.from_imagedate(ImageDate)
+    files = fileset.get_file_names(config.BaseDir)
+    BaOut_list, AfOut_list, Af375Out_list = threshold_granule(config, files)
+    write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list)
+    return ImageDate
+
+def run_parallel(config, workers) : 
+    """same as run(), but the granules are read, thresholded and written by a
+    pool of worker processes. This process confirms the granules as they 
+    finish, in date order: a date is only confirmed once all of its rows are
+    in the database and every earlier date has been confirmed."""
+    engine = None
+    if config.DatabaseOut == "y":
+        initialize_schema_for_postgis(config)
+        engine = get_confirmer(config)
+        get_landmask(config)
+
+    start_group = datetime.datetime.now()
+    pool = mp.Pool(processes=workers)
+    try : 
+        # imap hands back results in the order of the dates, however the 
+        # workers finish
+        work = [ (config, ImageDate) for ImageDate in config.SortedImageDates ]
+        count = 0
+        for ImageDate in pool.imap(push_granule, work) : 
+            count = count + 1
+            if config.DatabaseOut == "y":
+                confirm_granule(config, FileSet.from_imagedate(ImageDate), engine)
+            print "Done Processing:", ImageDate,  
+            print "Number:", count, "of:", len(config.SortedImageDates)
+            print "*"*50 + "\n"
+        pool.close()
+    except : 
+        pool.terminate()
+        raise
+    finally : 
+        pool.join()
+
+    finish_run(config, engine)
+
+    end_group = datetime.datetime.now()
+    print end_group.strftime("%Y%m%d %H:%M:%S")
+    print "Elapsed time for group:", (end_group - start_group).total_seconds(), "seconds"
+
+    print "Done"
+
+def run(config, workers=1):
+    if workers > 1 : 
+        return run_parallel(config, workers)
+    if config.has_pipeline() : 
+        return run_pipelined(config)
     
+    engine = None
     if config.DatabaseOut == "y":
         initialize_schema_for_postgis(config)
+        engine = get_confirmer(config)
+        get_landmask(config)
 
     #Loop through BaseDir, look for h5s and load arrays
     count = 0
@@ -710,157 +1656,14 @@ def run(config):
         fileset = FileSet.from_imagedate(ImageDate)
         files = fileset.get_file_names(config.BaseDir)
 
-        # load the reflectance data from the hdf files
-        m07 = VIIRSReflectanceFile.load(files['SVM07_npp'],'SVM07_npp')     
-        m08 = VIIRSReflectanceFile.load(files['SVM08_npp'],'SVM08_npp')     
-        m10 = VIIRSReflectanceFile.load(files['SVM10_npp'],'SVM10_npp')     
-        m11 = VIIRSReflectanceFile.load(files['SVM11_npp'],'SVM11_npp')     
-
-        # Read GMTCO
-        geo_750 = GeoFile750.load(files['GMTCO_npp'])
-        
-        if config.use375af.lower() == "y":
-            # Read GITCO
-            geo_375 = GeoFile375.load(files['GITCO_npp'])
-            
-            # Read VF375
-            af_375 = ActiveFire375.load(files['VF375_npp'])
-        
-        # Read AVAFO
-        af_750 = ActiveFire750.load(files['AVAFO_npp'])            
+        BaOut_list, AfOut_list, Af375Out_list = threshold_granule(config, files)
+        write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list)
+        if config.DatabaseOut == "y":
+            confirm_granule(config, fileset, engine)
         
-        # Set up Burned Area Conditional array: BaCon
-        BaCon = ba_threshold(config, m07, m08, m10, m11, af_750, geo_750)
-
-        # Apply geographic window, if specified
-        geo_750.apply_window(config,BaCon)
-                        
-        # Get Burned area coordinates as an array
-        BaOut_list = geo_750.make_list(BaCon)
         # Clean up arrays
-        BaCon = None
-        del BaCon
-        
-        # Burned area output to text
-        if config.TextOut == "y":
-            write_coordinates2text(config, BaOut_list, 
-                 "BaOut_" + fileset.get_out_date(), fileset.get_datetime())
-
-        # Burned area output to PostGIS 
-        if config.DatabaseOut == "y":
-            push_list_to_postgis(config, BaOut_list, 
-                 fileset.get_datetime(), "threshold_burned", "750", "m")
-            #vacuum_analyze(config,"threshold_burned")
-    
-            # Clean up arrays
         BaOut_list = None
         del BaOut_list
-        # #######################################################################
-        # Finish burned area thresholding
-        # #######################################################################
-        
-        # #######################################################################
-        # Begin Active Fire
-        # #######################################################################
-        
-        if config.use750af == "y":
-            # #######################################################################
-            # Begin 750-m Active Fire
-            # #######################################################################
-            
-            #Set up Active Fire Conditional array: AfCon
-            AfCon = af_750.get_conditional()
-                            
-            # Apply geographic window, if specified
-            geo_750.apply_window(config, AfCon)
-                
-            # Get coordinates of all active fire pixels 
-            AfLatLons = geo_750.make_list(AfCon)  
-             
-            # Clean up arrays
-            AfCon = None
-            del AfCon
-            # Convert coordinate array to list
-            AfOut_list = array2list(AfLatLons)
-            # Clean up arrays
-            AfLatLons = None
-            del AfLatLons
-        
-        
-        if config.use375af == "y":
-            # #######################################################################
-            # Begin 375-m Active Fire
-            # #######################################################################
-            
-            #Set up Active Fire Conditional array: AfCon
-            #filter out rows having more than limit375 high confidence
-            #points
-            AfCon = af_375.get_conditional(
-                        threshold=getattr(config, "limit375", None),
-                        recode_val=10)
-            af_375.filter_conditional(AfCon, 10)
-            
-            # Apply geographic window, if specified
-            geo_375.apply_window(config, AfCon)
-                
-            # Get coordinates of all active fire pixels 
-            Af375Out_list = geo_375.make_list(AfCon) 
-              
-            # Clean up arrays
-            AfCon = None
-            del AfCon
-            
-        if config.TextOut == "y":
-            if config.use750af == "y":  
-                # Write active fire 750 coordinates to text
-                write_coordinates2text(config, AfOut_list, 
-                       "AfOut_" + fileset.get_out_date(), 
-                       fileset.get_datetime() )
-            if config.use375af == "y":    
-                # Write active fire 375 coordinates to text
-                write_coordinates2text(config, Af375Out_list, 
-                       "AfOut_" + fileset.get_out_date(), 
-                       fileset.get_datetime())
-
-        # Push active fire coordinates to PostGIS
-        if config.DatabaseOut == "y":
-            if config.use375af == "y":
-                # write 375 active fire to DB
-                push_list_to_postgis(config,Af375Out_list, 
-                     fileset.get_datetime(), "active_fire", "375", "i")
-                #vacuum_analyze(config,"active_fire")
-            
-            if config.use750af == "y":
-                # write 750 active fire to DB
-                push_list_to_postgis(config,AfOut_list, 
-                     fileset.get_datetime(), "active_fire", "750", "m")
-                #vacuum_analyze(config,"active_fire")
-        
-            # check if fires are still active
-            #print "\nChecking if fires are still active"
-            #date_4db = datetime.datetime.strftime(H5Date, "%Y-%m-%d %H:%M:%S")
-            #execute_check_4_activity(config, date_4db)
-            
-            # active fire to fires events 
-            print "\nCopy active fire to fire events and create collections"
-            execute_active_fire_2_events(config, fileset.get_sql_date())
-            #vacuum_analyze(config,"active_fire")
-    
-            # simple confirm threshold burns 
-#            print "\nPerform simple confirm burned area"
-#            date_4db = datetime.datetime.strftime(H5Date, "%Y-%m-%d %H:%M:%S")
-#            execute_simple_confirm_burns(config, date_4db)
-#            #vacuum_analyze(config,"threshold_burned")
-   
-            # threshold to fires events 
-            print "\nEvaluate and copy thresholded burned area to fire events"
-            execute_threshold_2_events(config, fileset.get_sql_date())
-
-            vacuum_analyze(config,"active_fire")
-            vacuum_analyze(config,"threshold_burned")
-            #vacuum_analyze(config, '')
-        
-        # Clean up arrays
         AfOut_list = None
         del AfOut_list
         Af375Out_list = None
@@ -874,11 +1677,7 @@ def run(config):
         print "Elapsed time for individual:", (end_indiviudal - start_indiviudal).total_seconds(), "seconds"
         print "*"*50 + "\n"
 
-    # Output shapefile
-    if config.ShapeOut == "y":
-        output_shape_files(config)
-
-    config.save(os.path.join(config.ShapePath, '{0}_{1}.ini'.format(config.DBname,config.DBschema)))
+    finish_run(config, engine)
 
     end_group = datetime.datetime.now()
     print end_group.strftime("%Y%m%d %H:%M:%S")
@@ -894,10 +1693,16 @@ if __name__ == "__main__":
         print "\nMissing argrument"
         print "\nEnter the ini file name as an argument when launching this script."
         print "e.g., VIIRS_threshold.py VIIRS_threshold.ini"	
-        print "The ini file should be in the current working directory.\n"
+        print "The ini file should be in the current working directory."
+        print "Add --workers N to threshold granules in N parallel processes.\n"
         sys.exit()
-    IniFileName = sys.argv[1]    
-    IniFile = os.path.join(os.getcwd(), IniFileName)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("ini", help="ini file, in the current working directory")
+    parser.add_argument("--workers", type=int, default=1,
+        help="number of processes to threshold granules with (default 1)")
+    args = parser.parse_args()
+    IniFile = os.path.join(os.getcwd(), args.ini)
     config = vc.VIIRSConfig.load(IniFile)
 	
-    run(config)
+    init_run_store(config)
+    run(config, args.workers)
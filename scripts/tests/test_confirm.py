@@ -0,0 +1,158 @@
+import unittest
+import datetime
+import numpy as np
+import viirs_proj
+import viirs_confirm as vcf
+
+
+def make_points(fids, xy) :
+    """points at the given Albers coordinates, in the form of
+    viirs_confirm.points()"""
+    n = len(fids)
+    xy = np.array(xy, dtype=np.float64).reshape((n, 2))
+    return { 'fid' : np.array(fids), 'x' : xy[:,0], 'y' : xy[:,1],
+             'lon' : np.zeros(n), 'lat' : np.zeros(n),
+             'latitude' : np.zeros(n, dtype=np.float32),
+             'longitude' : np.zeros(n, dtype=np.float32),
+             'pixel_size' : np.array([750]*n), 'band_i_m' : np.array(['m']*n) }
+
+class TestProjection (unittest.TestCase) :
+    def test_albers(self) :
+        """agrees with PROJ to well under a millimeter"""
+        x, y = viirs_proj.projections[102008].forward(-120.5, 45.25)
+        self.assertAlmostEqual(x, -1788928.9434242435, 3)
+        self.assertAlmostEqual(y, 852704.3422274175, 3)
+        x, y = viirs_proj.projections[102008].forward(-96., 40.)
+        self.assertAlmostEqual(x, 0., 6)
+        self.assertAlmostEqual(y, 0., 6)
+        x, y = viirs_proj.projections[96630].forward(-120.5, 45.25)
+        self.assertAlmostEqual(x, -1900817.8563218256, 3)
+        self.assertAlmostEqual(y, 2719917.9094809764, 3)
+
+class TestConfirmEngine (unittest.TestCase) :
+    def setUp(self) :
+        self.engine = vcf.ConfirmEngine(1000, datetime.timedelta(days=5))
+        self.day = [ datetime.datetime(2016,1,1) + datetime.timedelta(days=d)
+                     for d in range(12) ]
+
+    def collection_of(self, source) :
+        return [ e['collection_id'] for e in self.engine.events
+                                    if e['source'] == source ]
+
+    def test_clusters(self) :
+        """points chained within distance share a new collection"""
+        eng = self.engine
+        eng.active_fire(self.day[0], make_points([3, 1, 2, 4],
+                    [(1600,0), (0,0), (800,0), (10000,0)]))
+        self.assertEqual(len(eng.collections), 2)
+        self.assertEqual([ c[2] for c in eng.collections ], [1, 4])
+        # events are inserted in fid order
+        self.assertEqual(self.collection_of('ActiveFire'), [1, 1, 1, 2])
+
+    def test_match_existing(self) :
+        """points join the collection of the nearest event, and their
+        clusters join the lowest numbered collection matched"""
+        eng = self.engine
+        eng.active_fire(self.day[0], make_points([1, 2], [(0,0), (5000,0)]))
+        eng.active_fire(self.day[2], make_points([3, 4, 5],
+                    [(4100,0), (3200,0), (-900,0)]))
+        self.assertEqual(len(eng.collections), 2)
+        self.assertEqual(self.collection_of('ActiveFire'), [1, 2, 2, 2, 1])
+        self.assertEqual([ c[1] for c in eng.collections ], [self.day[2]]*2)
+
+        # 7 is unmatched but chained to 6 (collection 1) and 8 (collection 2)
+        eng.active_fire(self.day[3], make_points([6, 7, 8],
+                    [(900,0), (1800,0), (2700,0)]))
+        self.assertEqual(self.collection_of('ActiveFire')[5:], [1, 1, 2])
+
+    def test_threshold(self) :
+        """threshold points join the collection of the latest active fire
+        event within distance, without updating it"""
+        eng = self.engine
+        eng.active_fire(self.day[0], make_points([1, 2], [(0,0), (1500,0)]))
+        eng.threshold(self.day[1], make_points([11, 10, 12],
+                    [(750,0), (-500,0), (5000,0)]))
+        self.assertEqual(eng.confirmed, [10, 11])
+        self.assertEqual(self.collection_of('Threshold'), [1, 2])
+        self.assertEqual([ c[1] for c in eng.collections ], [self.day[0]]*2)
+
+        # threshold events are not seeds for other threshold points
+        eng.threshold(self.day[1], make_points([13], [(-1200,0)]))
+        self.assertEqual(eng.confirmed, [10, 11])
+
+    def test_eviction(self) :
+        """collections not updated within the temporal window are closed"""
+        eng = self.engine
+        eng.active_fire(self.day[0], make_points([1], [(0,0)]))
+        eng.evict(self.day[5])
+        eng.active_fire(self.day[5], make_points([2], [(500,0)]))
+        self.assertEqual(len(eng.collections), 1)
+        eng.evict(self.day[11])
+        eng.threshold(self.day[11], make_points([10], [(0,0)]))
+        self.assertEqual(eng.confirmed, [])
+        eng.active_fire(self.day[11], make_points([3], [(0,0)]))
+        self.assertEqual(self.collection_of('ActiveFire'), [1, 1, 2])
+        self.assertEqual(len(eng.grid), 1)
+
+    def test_af_only(self) :
+        """with af_only, threshold events do not draw in active fire points"""
+        for af_only, expected in [(False, [1, 1]), (True, [1, 2])] :
+            eng = vcf.ConfirmEngine(1000, datetime.timedelta(days=5), af_only)
+            eng.active_fire(self.day[0], make_points([1], [(0,0)]))
+            eng.threshold(self.day[0], make_points([10], [(900,0)]))
+            eng.active_fire(self.day[1], make_points([2], [(1800,0)]))
+            self.assertEqual([ e['collection_id'] for e in eng.events
+                               if e['source'] == 'ActiveFire' ], expected)
+
+class TestRasterConfirmEngine (unittest.TestCase) :
+    def run_engine(self, engine, seed) :
+        """confirms 12 days of random points, with the active fire points on
+        distinct cell centers so the raster places them exactly"""
+        rng = np.random.RandomState(seed)
+        cells = rng.permutation(200 * 200)[:12 * 30]
+        fid = 1
+        for d in range(12) :
+            date = datetime.datetime(2016,1,1) + datetime.timedelta(days=d)
+            c = cells[d*30:(d+1)*30]
+            af = np.column_stack([(c // 200 + 0.5) * 100., (c % 200 + 0.5) * 100.])
+            engine.evict(date)
+            engine.active_fire(date, make_points(range(fid, fid+30), af))
+            fid += 30
+            tb = rng.uniform(0, 20000, (50, 2))
+            engine.threshold(date, make_points(range(fid, fid+50), tb))
+            fid += 50
+        return engine
+
+    def test_matches_vector(self) :
+        """agrees with ConfirmEngine when events sit on cell centers"""
+        for seed in range(3) :
+            vector = self.run_engine(
+                vcf.ConfirmEngine(1000, datetime.timedelta(days=3)), seed)
+            raster = self.run_engine(
+                vcf.RasterConfirmEngine(1000, datetime.timedelta(days=3), cell=100), seed)
+            self.assertTrue(len(vector.confirmed) > 0)
+            self.assertEqual(raster.confirmed, vector.confirmed)
+            self.assertEqual([ e['collection_id'] for e in raster.events ],
+                             [ e['collection_id'] for e in vector.events ])
+
+    def test_tile_edges(self) :
+        """disks spanning several tiles find events on each of them"""
+        eng = vcf.RasterConfirmEngine(1000, datetime.timedelta(days=3), cell=10)
+        day = datetime.datetime(2016,1,1)
+        # tiles are 2560 m on a side, and meet at (0, 0)
+        eng.active_fire(day, make_points([1, 2], [(-5.,-5.), (2565., 2565.)]))
+        eng.threshold(day, make_points([10, 11, 12],
+                    [(400.,400.), (2200.,2200.), (1280.,1280.)]))
+        self.assertEqual(eng.confirmed, [10, 11])
+
+    def test_chunks(self) :
+        """the points give the same events when taken a few at a time"""
+        whole = self.run_engine(
+            vcf.RasterConfirmEngine(1000, datetime.timedelta(days=3), cell=100), 0)
+        chunked = vcf.RasterConfirmEngine(1000, datetime.timedelta(days=3), cell=100)
+        chunked.cells = 7 * len(chunked.offsets[0])
+        self.run_engine(chunked, 0)
+        self.assertTrue(len(whole.confirmed) > 0)
+        self.assertEqual(chunked.confirmed, whole.confirmed)
+        self.assertEqual([ e['collection_id'] for e in chunked.events ],
+                         [ e['collection_id'] for e in whole.events ])
@@ -0,0 +1,77 @@
+import unittest
+import viirs_config as vc
+import viirs_halving as vh
+
+
+class TestHalving (unittest.TestCase) :
+    def setUp(self) :
+        self.dates = [ 'd201607{:02d}_t1200000'.format(d) for d in range(1, 31) ]
+        self.template = vc.VIIRSConfig()
+        self.template.ImageDates = list(reversed(self.dates))
+        self.template.sort_dates()
+        self.seen = []
+
+    def test_stratified_dates(self) :
+        """each stratum gives a central run of consecutive dates"""
+        subset = vh.stratified_dates(self.template.ImageDates, 0.2, strata=3)
+        self.assertEqual(subset, [ self.dates[i] for i in [4, 5, 14, 15, 24, 25] ])
+        self.assertEqual(vh.stratified_dates(self.dates, 1.), self.dates)
+        self.assertEqual(len(vh.stratified_dates(self.dates, 0.001)), 4)
+
+    def test_nested(self) :
+        """larger fractions hold the dates of smaller ones"""
+        last = set()
+        for f in [ 0.05, 0.1, 0.3, 0.5, 0.9, 1. ] :
+            subset = set(vh.stratified_dates(self.dates, f))
+            self.assertTrue(last <= subset)
+            last = subset
+
+    def test_schedule(self) :
+        counts, cost = vh.schedule(243, vh.default_fractions, 3)
+        self.assertEqual(counts, [243, 81, 27, 9])
+        self.assertAlmostEqual(cost, 36.)
+
+    def evaluator(self, template, fraction) :
+        """a figure of merit which favors large Rth, known once a run sees
+        enough dates"""
+        self.assertAlmostEqual(fraction, len(template.SortedImageDates) / 30.)
+        def evaluate(runs) :
+            fom = {}
+            for run_id, vec in runs :
+                self.seen.append( (len(template.SortedImageDates), run_id) )
+                fom[run_id] = vec.Rth * min(1., len(template.SortedImageDates) / 10.)
+            return fom
+        return evaluate
+
+    def test_halving(self) :
+        """the best candidate survives, and the finalists keep their run ids"""
+        ref = vc.ConfigVector(M07UB=0.18, M08LB=0.05, M08UB=0.2,
+                    M10LB=0.1, M10UB=1.0, M11LB=0.05, RthSub=0.05, Rth=0.8,
+                    RthLB=0.0, MaxSolZen=96., TemporalProximity=10,
+                    SpatialProximity=5000)
+        vectors = [ ref._replace(Rth=0.5 + 0.01 * i) for i in range(27) ]
+        run_ids = range(100, 127)
+        discarded = []
+        result = vh.halving(self.template, vectors, run_ids, self.evaluator,
+                            fractions=[0.1, 0.4, 1.], ratio=3,
+                            discard=lambda t, runs : discarded.extend([ r for r, v in runs ]))
+
+        self.assertEqual(list(result.groupby('rung').size()), [27, 9, 3])
+        final = result[result['rung'] == 2]
+        self.assertEqual(sorted(final['run_id']), [124, 125, 126])
+        self.assertEqual(final.loc[final['fom'].idxmax(), 'candidate'], 126)
+        self.assertEqual(min(result[result['rung'] < 2]['run_id']), 127)
+        self.assertEqual(len(set(result['run_id'])), len(result))
+        self.assertEqual(set([ d for d, r in self.seen ]), set([4, 12, 30]))
+        self.assertEqual(sorted(discarded), sorted(result[result['rung'] < 2]['run_id']))
+
+    def test_scaled_ioveru(self) :
+        """partial runs are scored against the matching part of the truth"""
+        vf = vh.vo.vf
+        self.assertAlmostEqual(vf.scaled_ioveru(50, 100, 400, 1.), 50 / 450.)
+        self.assertAlmostEqual(vf.scaled_ioveru(50, 100, 400, 0.25), 50 / 150.)
+        # a permissive run no longer wins just by covering more truth
+        strict = vf.scaled_ioveru(40, 50, 400, 0.25)
+        loose = vf.scaled_ioveru(60, 300, 400, 0.25)
+        self.assertTrue(strict > loose)
+        self.assertEqual(vf.scaled_ioveru(0, 0, 0, 0.5), 0.)
@@ -0,0 +1,94 @@
+import unittest
+import os.path
+import tempfile
+import shutil
+import numpy as np
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_hist as vh
+from tests.test_threshold import ThresholdFixture
+
+
+class TestThresholdCube (ThresholdFixture, unittest.TestCase) :
+    def vectors(self) :
+        c = self.config
+        vec = vh.vc.ConfigVector(M07UB=c.M07UB, M08LB=c.M08LB, M08UB=c.M08UB,
+                    M10LB=c.M10LB, M10UB=c.M10UB, M11LB=c.M11LB,
+                    RthSub=c.RthSub, Rth=c.Rth, RthLB=c.RthLB,
+                    MaxSolZen=c.MaxSolZen, TemporalProximity=5,
+                    SpatialProximity=1000)
+        return [ vec,
+                 vec._replace(M07UB=0.3, M08LB=0.1),
+                 vec._replace(M08UB=0.4, M10LB=0.2, M11LB=0.02),
+                 vec._replace(Rth=1.0, RthLB=0.2) ]
+
+    def truth(self, vec) :
+        return np.count_nonzero(vt.ba_threshold(vec, self.refl('m07'),
+                    self.refl('m08'), self.refl('m10'), self.refl('m11'),
+                    self.af, self.geo))
+
+    def cube(self, per_granule=True) :
+        cube = vh.ThresholdCube.from_vectors(self.vectors(), per_granule=per_granule)
+        cube.add_granule('d20160118_t0521324', self.config, self.refl('m07'),
+                    self.refl('m08'), self.refl('m10'), self.refl('m11'),
+                    self.af, self.geo)
+        return cube
+
+    def test_cells(self) :
+        """values on an edge get their own bin"""
+        edges = np.array([1., 2.], dtype=np.float32)
+        vals = np.array([0.5, 1., 1.5, 2., 3.], dtype=np.float32)
+        self.assertEqual(list(vh.cells(edges, vals)), [0, 1, 2, 3, 4])
+
+    def test_exact(self) :
+        """vectors whose thresholds are all edges are counted exactly"""
+        cube = self.cube()
+        for vec in self.vectors() :
+            n = self.truth(vec)
+            self.assertTrue(n > 0)
+            self.assertEqual(cube.count(vec), (n, n))
+            self.assertEqual(cube.count(vec, 'd20160118_t0521324'), (n, n))
+
+    def test_totals_only(self) :
+        """without per granule counts, totals are the same and granules are
+        not kept"""
+        cube = self.cube(per_granule=False)
+        for vec in self.vectors() :
+            self.assertEqual(cube.count(vec), self.cube().count(vec))
+        self.assertEqual(cube.granules, {})
+        self.assertRaises(ValueError, cube.count, self.vectors()[0], 'd20160118_t0521324')
+
+    def test_granules_add_up(self) :
+        """the total of two granules is the sum of their counts"""
+        cube = self.cube()
+        cube.add_granule('d20160119_t0503137', self.config, self.refl('m07'),
+                    self.refl('m08'), self.refl('m10'), self.refl('m11'),
+                    self.af, self.geo)
+        vec = self.vectors()[0]._replace(M07UB=0.4, M08LB=0.07, Rth=1.2)
+        first = cube.count(vec, 'd20160118_t0521324')
+        self.assertEqual(cube.count(vec), (2*first[0], 2*first[1]))
+
+    def test_bounded(self) :
+        """other vectors are bracketed"""
+        cube = self.cube()
+        vec = self.vectors()[0]._replace(M07UB=0.4, M08LB=0.07, Rth=1.2)
+        lower, upper = cube.count(vec)
+        self.assertTrue(lower <= self.truth(vec) <= upper)
+        self.assertTrue(lower < upper)
+
+    def test_other_rthsub(self) :
+        """a vector with a different RthSub cannot use the cube"""
+        vec = self.vectors()[0]._replace(RthSub=0.02)
+        self.assertRaises(ValueError, self.cube().count, vec)
+
+    def test_save_load(self) :
+        cube = self.cube()
+        path = tempfile.mkdtemp()
+        try :
+            cube.save(os.path.join(path, 'cube.npz'))
+            loaded = vh.ThresholdCube.load(os.path.join(path, 'cube.npz'))
+            for vec in self.vectors() :
+                self.assertEqual(loaded.count(vec), cube.count(vec))
+                self.assertEqual(loaded.count(vec, 'd20160118_t0521324'),
+                                 cube.count(vec, 'd20160118_t0521324'))
+        finally :
+            shutil.rmtree(path)
@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+import numpy as np
+import pandas as pd
+import viirs_config as vc
+import viirs_landmask as vl
+
+
+class TestLandmask (unittest.TestCase) :
+    def setUp(self) :
+        rng = np.random.RandomState(7)
+        self.mask = rng.rand(40, 50) < 0.3
+        self.landmask = vl.Landmask(self.mask, -2000000., 2500000., 30., -30., 96630)
+        # points over the raster and a margin around it
+        self.x = rng.uniform(-2000000. - 60, -2000000. + 50*30 + 60, 20000)
+        self.y = rng.uniform(2500000. - 40*30 - 60, 2500000. + 60, 20000)
+
+    def brute_force(self, x, y) :
+        """within half a pixel of the center of any masked pixel"""
+        rows, cols = np.where(self.mask)
+        cx = -2000000. + (cols + 0.5) * 30.
+        cy = 2500000. - (rows + 0.5) * 30.
+        d = np.hypot(x[:,np.newaxis] - cx[np.newaxis,:],
+                     y[:,np.newaxis] - cy[np.newaxis,:])
+        return np.any(d <= 15., axis=1)
+
+    def test_lookup(self) :
+        """matches testing the distance to every masked pixel center"""
+        masked = self.landmask.lookup(self.x, self.y)
+        self.assertTrue(np.count_nonzero(masked) > 0)
+        self.assertTrue(np.array_equal(masked, self.brute_force(self.x, self.y)))
+
+    def test_corners(self) :
+        """points between pixels are only masked on the discs"""
+        self.mask[:] = True
+        # a pixel center, a pixel corner and the middle of a pixel edge
+        x = np.array([-2000000. + 45., -2000000. + 30., -2000000. + 30.])
+        y = np.array([2500000. - 45., 2500000. - 30., 2500000. - 45.])
+        self.assertEqual(list(self.landmask.lookup(x, y)), [True, False, True])
+
+class TestLandmaskSource (unittest.TestCase) :
+    def setUp(self) :
+        self.dir = tempfile.mkdtemp()
+        self.config = vc.VIIRSConfig()
+        self.config.BMschema = 'landmask'
+        self.config.BMtable = 'noburn'
+
+    def tearDown(self) :
+        shutil.rmtree(self.dir)
+
+    def window(self, north, south, east, west) :
+        self.config.north = north
+        self.config.south = south
+        self.config.east = east
+        self.config.west = west
+
+    def save(self, table, window) :
+        np.save(os.path.join(self.dir, 'mask.npy'), np.zeros((2, 2), dtype=np.bool))
+        pd.DataFrame([{ 'ulx' : 0., 'uly' : 0., 'scale_x' : 30., 'scale_y' : -30.,
+                        'srid' : 96630, 'table' : table, 'window' : window }]).to_csv(
+                os.path.join(self.dir, 'geotransform.csv'), index=False)
+
+    def test_same_source(self) :
+        """a copy serves the same table over a window it holds"""
+        self.window(45., 40., -110., -120.)
+        wanted = vl.source(self.config)
+        self.assertEqual(wanted['table'], 'landmask.noburn')
+        self.assertTrue(vl.same_source(wanted, wanted))
+        self.assertTrue(vl.same_source({ 'table' : 'landmask.noburn', 'window' : '' }, wanted))
+        self.assertTrue(vl.same_source(
+            { 'table' : 'landmask.noburn', 'window' : '46.0,39.0,-100.0,-121.0' }, wanted))
+        self.assertFalse(vl.same_source(
+            { 'table' : 'landmask.noburn', 'window' : '45.0,41.0,-110.0,-120.0' }, wanted))
+        self.assertFalse(vl.same_source({ 'table' : 'other.noburn', 'window' : '' }, wanted))
+        self.assertFalse(vl.same_source(wanted, { 'table' : 'landmask.noburn', 'window' : '' }))
+
+    def test_covers(self) :
+        """stale and older copies are refused"""
+        self.assertFalse(vl.covers(self.dir, self.config))
+        self.save('landmask.noburn', '')
+        self.assertTrue(vl.covers(self.dir, self.config))
+        self.assertEqual(vl.Landmask.load(self.dir, self.config).srid, 96630)
+        self.save('landmask.other', '')
+        self.assertFalse(vl.covers(self.dir, self.config))
+        self.assertRaises(ValueError, vl.Landmask.load, self.dir, self.config)
+        self.save('landmask.noburn', '45.0,40.0,-110.0,-120.0')
+        self.assertFalse(vl.covers(self.dir, self.config))
+
+        # made before the source was recorded
+        pd.DataFrame([{ 'ulx' : 0., 'uly' : 0., 'scale_x' : 30., 'scale_y' : -30.,
+                        'srid' : 96630 }]).to_csv(
+                os.path.join(self.dir, 'geotransform.csv'), index=False)
+        self.assertFalse(vl.covers(self.dir, self.config))
@@ -0,0 +1,94 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+import viirs_config as vc
+import viirs_optimize as vo
+
+
+class TestOptimize (unittest.TestCase) :
+    def setUp(self) :
+        self.dir = tempfile.mkdtemp()
+        self.memo_file = os.path.join(self.dir, 'memo.csv')
+        self.reference = vc.ConfigVector(M07UB=0.18, M08LB=0.05, M08UB=0.2,
+                    M10LB=0.1, M10UB=1.0, M11LB=0.05, RthSub=0.05, Rth=0.8,
+                    RthLB=0.0, MaxSolZen=96., TemporalProximity=10,
+                    SpatialProximity=5000)
+        self.runs = []
+
+    def memo(self, fingerprint='template') :
+        return vo.Memo(self.memo_file, fingerprint, 500)
+
+    def tearDown(self) :
+        shutil.rmtree(self.dir)
+
+    def evaluate(self, runs) :
+        """a smooth figure of merit, best at Rth=0.9, RthSub=0.11"""
+        self.runs.extend(runs)
+        fom = {}
+        for run_id, vec in runs :
+            fom[run_id] = 0.8 - (vec.Rth - 0.9)**2 - 2 * (vec.RthSub - 0.11)**2
+        return fom
+
+    def optimizer(self, memo, workers=1, max_evals=40) :
+        return vo.NelderMead(self.reference, ['Rth', 'RthSub'], memo,
+                    self.evaluate, workers=workers, max_evals=max_evals)
+
+    def test_rounded(self) :
+        """floats are kept to two decimals and ints are whole"""
+        vec = vo.rounded(self.reference._replace(Rth=0.8049, SpatialProximity=4999.6))
+        self.assertEqual(vec.Rth, 0.80)
+        self.assertEqual(vec.SpatialProximity, 5000)
+        self.assertTrue(isinstance(vec.SpatialProximity, int))
+
+    def test_minimize(self) :
+        """the optimum is found in tens of runs, each vector run once"""
+        best, fom = self.optimizer(self.memo()).minimize()
+        self.assertAlmostEqual(best.Rth, 0.9, delta=0.015)
+        self.assertAlmostEqual(best.RthSub, 0.11, delta=0.015)
+        self.assertTrue(len(self.runs) <= 40)
+        keys = [ vo.memo_key(vec) for run_id, vec in self.runs ]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_parallel(self) :
+        """speculative steps find the same optimum"""
+        best, fom = self.optimizer(self.memo(), workers=4).minimize()
+        self.assertAlmostEqual(best.Rth, 0.9, delta=0.015)
+        self.assertAlmostEqual(best.RthSub, 0.11, delta=0.015)
+
+    def test_memo_persists(self) :
+        """a second optimization from the same memo file runs nothing"""
+        first = self.optimizer(self.memo()).minimize()
+        count = len(self.runs)
+        memo = self.memo()
+        self.assertEqual(memo.next_run, 500 + count)
+        second = self.optimizer(memo).minimize()
+        self.assertEqual(len(self.runs), count)
+        self.assertEqual(first[0], second[0])
+        self.assertAlmostEqual(first[1], second[1])
+
+    def test_budget(self) :
+        """no more than max_evals vectors are run"""
+        self.optimizer(self.memo(), workers=4, max_evals=8).minimize()
+        self.assertTrue(len(self.runs) <= 8)
+
+    def test_first_run(self) :
+        """runs are numbered from the starting run_id"""
+        self.optimizer(self.memo(), max_evals=8).minimize()
+        self.assertEqual(sorted([ r for r, v in self.runs ]), range(500, 508))
+
+    def test_fingerprint(self) :
+        """a memo of another template or ground truth is refused"""
+        self.optimizer(self.memo(), max_evals=4).minimize()
+        self.assertRaises(ValueError, self.memo, 'other')
+
+        template = vc.VIIRSConfig()
+        template.BaseDir = 'granules'
+        template.ImageDates = ['d20160701_t1200000', 'd20160702_t1200000']
+        template.use375af = 'y'
+        template.use750af = 'y'
+        fp = vo.fingerprint(template, 'gt', 'mask')
+        self.assertEqual(fp, vo.fingerprint(template, 'gt', 'mask'))
+        self.assertNotEqual(fp, vo.fingerprint(template, 'gt', 'other_mask'))
+        template.ImageDates = template.ImageDates[:1]
+        self.assertNotEqual(fp, vo.fingerprint(template, 'gt', 'mask'))
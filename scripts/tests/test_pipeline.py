@@ -0,0 +1,98 @@
+import unittest
+import threading
+import Queue
+import VIIRS_threshold_reflCor_Bulk as vt
+
+
+class TestPipelineStage (unittest.TestCase) :
+    def run_stage(self, func, items) :
+        stop = threading.Event()
+        inq = Queue.Queue()
+        outq = Queue.Queue(2)
+        for i in items :
+            inq.put((i, i))
+        inq.put(None)
+        t = threading.Thread(target=vt._stage, args=(func, inq, outq, stop))
+        t.start()
+        results = []
+        while True :
+            item = outq.get()
+            if (item is None) or isinstance(item, vt._Failure) :
+                results.append(item)
+                break
+            results.append(item[1])
+        t.join()
+        return results
+
+    def test_order(self) :
+        """results come out in the order the items went in"""
+        results = self.run_stage(lambda f, d : d*2, range(10))
+        self.assertEqual(results, [ i*2 for i in range(10) ] + [None])
+
+    def test_failure(self) :
+        """an exception is passed downstream and ends the stage"""
+        def func(f, d) :
+            if d == 3 :
+                raise KeyError(d)
+            return d
+        results = self.run_stage(func, range(10))
+        self.assertEqual(results[:3], [0, 1, 2])
+        self.assertEqual(len(results), 4)
+        self.assertRaises(KeyError, results[3].reraise)
+
+class TestPipeline (unittest.TestCase) :
+    def setUp(self) :
+        self.saved = dict([ (name, getattr(vt, name)) for name in
+            ['initialize_schema_for_postgis', 'get_confirmer', 'get_landmask',
+             'read_granule', 'threshold_read', 'write_granule', 'confirm_granule',
+             'finish_run', 'transaction', 'close_session'] ])
+        self.log = []
+        self.lock = threading.Lock()
+
+    def tearDown(self) :
+        for name, func in self.saved.items() :
+            setattr(vt, name, func)
+
+    def record(self, *entry) :
+        with self.lock :
+            self.log.append(entry)
+
+    def test_write_before_confirm(self) :
+        """a writer thread writes each date, and the date is confirmed only
+        after its transaction ends"""
+        import contextlib
+        @contextlib.contextmanager
+        def transaction(config) :
+            yield None
+            self.record('commit', threading.current_thread().ident)
+        vt.initialize_schema_for_postgis = lambda config : None
+        vt.get_confirmer = lambda config : None
+        vt.get_landmask = lambda config : None
+        vt.read_granule = lambda config, fileset : None
+        vt.threshold_read = lambda config, fileset, data : ([], [], [])
+        vt.write_granule = lambda config, fileset, *lists : self.record(
+                'write', fileset.get_imagedate(), threading.current_thread().ident)
+        vt.confirm_granule = lambda config, fileset, engine : self.record(
+                'confirm', fileset.get_imagedate())
+        vt.finish_run = lambda config, engine : None
+        vt.transaction = transaction
+        vt.close_session = lambda config : None
+
+        class Config (object) :
+            DatabaseOut = 'y'
+            PipelineDepth = 2
+            SortedImageDates = [ 'd201607{:02d}_t1200000'.format(d) for d in range(1, 8) ]
+        vt.run_pipelined(Config())
+
+        main = threading.current_thread().ident
+        confirmed = [ e[1] for e in self.log if e[0] == 'confirm' ]
+        self.assertEqual(confirmed, Config.SortedImageDates)
+        for i, entry in enumerate(self.log) :
+            if entry[0] == 'write' :
+                self.assertNotEqual(entry[2], main)
+            if entry[0] == 'confirm' :
+                # the writer committed after writing the date
+                w = [ j for j, e in enumerate(self.log[:i])
+                        if e[0] == 'write' and e[1] == entry[1] ]
+                self.assertEqual(len(w), 1)
+                self.assertTrue(('commit', self.log[w[0]][2]) in self.log[w[0]:i])
@@ -0,0 +1,29 @@
+import unittest
+import itertools
+import numpy as np
+import pandas as pd
+import viirs_proximity as vp
+
+
+class TestProximity (unittest.TestCase) :
+    def test_frontier(self) :
+        """only the pairs no other pair beats on both counts are kept"""
+        pairs = pd.DataFrame({ 'fid' : [1, 1, 1, 1, 1, 2, 2],
+                               'distance' : [500., 300., 400., 100., 300., 50., 50.],
+                               'gap' : [0, 1, 1, 3, 4, 2, 2] })
+        kept = vp.frontier(pairs)
+        self.assertEqual(sorted(zip(kept['fid'], kept['distance'], kept['gap'])),
+                         [(1, 100., 3), (1, 300., 1), (1, 500., 0), (2, 50., 2)])
+
+    def test_frontier_confirms(self) :
+        """any (D, T) confirms the same points from the frontier as from
+        all the pairs"""
+        rng = np.random.RandomState(0)
+        pairs = pd.DataFrame({ 'fid' : rng.randint(0, 20, 300),
+                               'distance' : rng.randint(0, 10, 300) * 100.,
+                               'gap' : rng.randint(0, 8, 300) })
+        kept = vp.frontier(pairs)
+        self.assertTrue(len(kept) < len(pairs))
+        confirmed = lambda t, d, g : set(t[(t['distance'] <= d) & (t['gap'] <= g)]['fid'])
+        for d, g in itertools.product(range(0, 1000, 100), range(8)) :
+            self.assertEqual(confirmed(kept, d, g), confirmed(pairs, d, g))
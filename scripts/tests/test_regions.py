@@ -0,0 +1,83 @@
+import unittest
+import datetime
+import numpy as np
+import viirs_config as vc
+import viirs_regions as vr
+from tests.test_confirm import make_points
+
+
+class TestRegions (unittest.TestCase) :
+    def setUp(self) :
+        self.config = vc.VIIRSConfig()
+        self.config.SpatialProximity = 1000
+        self.config.TemporalProximity = 3
+
+    def season(self, seed) :
+        """12 days of points scattered about a few fire centers"""
+        rng = np.random.RandomState(seed)
+        centers = rng.uniform(0, 100000, (6, 2))
+        af = []
+        tb = []
+        fid = 1
+        for d in range(12) :
+            date = datetime.datetime(2016,7,1) + datetime.timedelta(days=d)
+            for table, count in [ (af, 20), (tb, 30) ] :
+                xy = (centers[rng.randint(0, 6, count)] +
+                      rng.normal(0, 1500, (count, 2)))
+                pts = make_points(range(fid, fid+count), xy)
+                pts['date'] = np.array([date] * count, dtype=object)
+                table.append(pts)
+                fid += count
+        join = lambda t : dict([ (k, np.concatenate([ p[k] for p in t ])) for k in t[0] ])
+        return join(af), join(tb), datetime.datetime(2016,7,12)
+
+    def test_components(self) :
+        """points are connected through chains within reach"""
+        x = np.array([0., 900., 1800., 5000., 5500., 20000.])
+        y = np.zeros(6)
+        labels = vr.components(x, y, 1000.)
+        self.assertEqual(len(set(labels)), 3)
+        self.assertEqual(labels[0], labels[2])
+        self.assertEqual(labels[3], labels[4])
+        self.assertNotEqual(labels[0], labels[3])
+
+    def test_threshold_links(self) :
+        """threshold points join active fire points but not each other"""
+        x = np.array([0., 900., 1800., 2700., 10000., 10900.])
+        y = np.zeros(6)
+        is_af = np.array([True, False, False, True, False, False])
+        labels = vr.components(x, y, 1000., is_af)
+        self.assertEqual(len(set(labels)), 4)
+        self.assertEqual(labels[0], labels[1])
+        self.assertEqual(labels[2], labels[3])
+        self.assertNotEqual(labels[0], labels[3])
+        self.assertNotEqual(labels[4], labels[5])
+
+        # a threshold point within reach of two fires joins them
+        labels = vr.components(np.array([0., 900., 1800.]), np.zeros(3), 1000.,
+                               np.array([True, False, True]))
+        self.assertEqual(len(set(labels)), 1)
+
+    def test_matches_single_engine(self) :
+        """confirming the regions apart and merging matches one engine"""
+        for seed in range(3) :
+            af, tb, last = self.season(seed)
+            single = vr.confirm_unit((self.config, af, tb, last))
+
+            n = len(af['fid'])
+            labels = vr.components(np.concatenate([af['x'], tb['x']]),
+                                   np.concatenate([af['y'], tb['y']]), 1000.,
+                                   np.arange(n + len(tb['fid'])) < n)
+            unit = vr.assign(np.bincount(labels), 3)[labels]
+            self.assertEqual(len(set(unit)), 3)
+            engines = [ vr.confirm_unit((self.config,
+                            vr._subset(af, unit[:n] == u), vr._subset(tb, unit[n:] == u), last))
+                        for u in range(3) ]
+            merged = vr.merge(self.config, engines)
+
+            self.assertEqual(merged.collections, single.collections)
+            self.assertEqual(merged.confirmed, single.confirmed)
+            self.assertEqual(sorted(merged.active.keys()), sorted(single.active.keys()))
+            key = lambda e : (e['fid'], e['point_fid'], e['source'], e['collection_id'])
+            self.assertEqual([ key(e) for e in merged.events ],
+                             [ key(e) for e in single.events ])
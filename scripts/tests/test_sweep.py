@@ -0,0 +1,124 @@
+import unittest
+import tempfile
+import shutil
+import os.path
+import numpy as np
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_sweep as vs
+from tests.test_threshold import ThresholdFixture
+
+
+class TestSweep (ThresholdFixture, unittest.TestCase) :
+    def vectors(self) :
+        """a handful of parameter vectors around the default configuration"""
+        c = self.config
+        vec = vs.vc.ConfigVector(M07UB=c.M07UB, M08LB=c.M08LB, M08UB=c.M08UB,
+                    M10LB=c.M10LB, M10UB=c.M10UB, M11LB=c.M11LB,
+                    RthSub=c.RthSub, Rth=c.Rth, RthLB=c.RthLB,
+                    MaxSolZen=c.MaxSolZen, TemporalProximity=5,
+                    SpatialProximity=1000)
+        return [ vec,
+                 vec._replace(M07UB=0.3, M08LB=0.1),
+                 vec._replace(M08UB=0.4, M10LB=0.2, M11LB=0.02),
+                 vec._replace(RthSub=0.0, Rth=1.0, RthLB=0.2),
+                 vec._replace(MaxSolZen=60.) ]
+
+    def test_envelope(self) :
+        """the envelope holds the loosest bound of each parameter"""
+        env = vs.envelope(self.vectors())
+        self.assertEqual(env.M07UB, 0.5)
+        self.assertEqual(env.M08LB, 0.05)
+        self.assertEqual(env.M10LB, 0.1)
+        self.assertEqual(env.M11LB, 0.02)
+        self.assertEqual(env.MaxSolZen, 96.)
+
+    def test_matches_ba_threshold(self) :
+        """each row of the batched result matches thresholding the full
+        granule with that vector"""
+        vectors = self.vectors()
+        cand = vs.extract_candidates(vs.envelope(vectors),
+                    self.refl('m07'), self.refl('m08'), self.refl('m10'),
+                    self.refl('m11'), self.af, self.geo)
+        masks = vs.threshold_candidates(vectors, cand)
+        self.assertEqual(masks.shape, (len(vectors), len(cand['M07'])))
+
+        for i, vec in enumerate(vectors) :
+            ref = vt.ba_threshold(vec, self.refl('m07'), self.refl('m08'),
+                                  self.refl('m10'), self.refl('m11'),
+                                  self.af, self.geo)
+            rows, cols = np.where(ref)
+            self.assertTrue(len(rows) > 0)
+            self.assertTrue(np.array_equal(cand['Row'][masks[i]], rows))
+            self.assertTrue(np.array_equal(cand['Col'][masks[i]], cols))
+
+    def test_chunks(self) :
+        """thresholding in small chunks gives the same masks"""
+        vectors = self.vectors()
+        cand = vs.extract_candidates(vs.envelope(vectors),
+                    self.refl('m07'), self.refl('m08'), self.refl('m10'),
+                    self.refl('m11'), self.af, self.geo)
+        whole = vs.threshold_candidates(vectors, cand)
+        for cells in [ 1, 7, 100, 1001 ] :
+            self.assertTrue(np.array_equal(whole,
+                        vs.threshold_candidates(vectors, cand, cells)))
+
+    def test_covers(self) :
+        """vectors inside the envelope are covered, looser ones are not"""
+        vectors = self.vectors()
+        env = vs.envelope(vectors)
+        self.assertTrue(all([vs.covers(env, v) for v in vectors]))
+        self.assertFalse(vs.covers(env, vectors[0]._replace(M07UB=0.6)))
+        self.assertFalse(vs.covers(env, vectors[0]._replace(M11LB=0.01)))
+
+    def template(self) :
+        template = vs.vc.VIIRSConfig()
+        template.BaseDir = 'granules'
+        template.use375af = 'n'
+        template.use750af = 'n'
+        template.ImageDates = ['d20160118_t0521324', 'd20160119_t0503137']
+        return template
+
+    def test_store_settings(self) :
+        """a store only serves configurations with its settings"""
+        template = self.template()
+        stored = vs.store_settings(template)
+        self.assertTrue(vs.same_settings(stored, vs.store_settings(template)))
+
+        template.ImageDates = template.ImageDates[:1]
+        self.assertTrue(vs.same_settings(stored, vs.store_settings(template)))
+        template.ImageDates = ['d20160120_t0445075']
+        self.assertFalse(vs.same_settings(stored, vs.store_settings(template)))
+
+        template = self.template()
+        template.use750af = 'y'
+        self.assertFalse(vs.same_settings(stored, vs.store_settings(template)))
+
+        template = self.template()
+        template.north, template.south, template.east, template.west = 45, 40, -100, -110
+        self.assertFalse(vs.same_settings(stored, vs.store_settings(template)))
+
+    def test_store_round_trip(self) :
+        """features loaded from a store threshold the same as fresh ones"""
+        vectors = self.vectors()
+        env = vs.envelope(vectors)
+        cand = vs.extract_candidates(env,
+                    self.refl('m07'), self.refl('m08'), self.refl('m10'),
+                    self.refl('m11'), self.af, self.geo)
+        path = tempfile.mkdtemp()
+        try :
+            os.makedirs(os.path.join(path, 'd20160118_t0521324'))
+            for name, values in cand.items() :
+                np.save(os.path.join(path, 'd20160118_t0521324', name + '.npy'), values)
+            vs.pd.DataFrame([env._asdict()]).to_csv(os.path.join(path, 'envelope.csv'),
+                                                    index=False)
+            template = self.template()
+            vs.pd.DataFrame([vs.store_settings(template)]).to_csv(
+                        os.path.join(path, 'settings.csv'), index=False)
+            store = vs.FeatureStore(path)
+            self.assertTrue(store.covers(template, vectors))
+            stored, af750, af375 = store.load('d20160118_t0521324')
+            self.assertEqual(af750, None)
+            self.assertTrue(np.array_equal(vs.threshold_candidates(vectors, cand),
+                                           vs.threshold_candidates(vectors, stored)))
+        finally :
+            shutil.rmtree(path)
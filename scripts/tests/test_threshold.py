@@ -0,0 +1,106 @@
+import unittest
+import numpy as np
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+
+
+def make_refl(raw, factors) :
+    refl = vt.VIIRSReflectanceFile()
+    refl.ReflArray = raw.copy()
+    refl.ReflFact = np.array(factors, dtype=np.float32)
+    refl.corrected = False
+    refl._calc_qa_mask()
+    return refl
+
+class ThresholdFixture (object) :
+    """a synthetic granule and configuration, shared by the threshold tests"""
+    def setUp(self) :
+        rng = np.random.RandomState(42)
+        shape = (96, 200)
+
+        # raw counts, sprinkled with the fill values which fail qa
+        self.raw = {}
+        for b in ['m07', 'm08', 'm10', 'm11'] :
+            raw = rng.randint(0, 50000, size=shape).astype(np.uint16)
+            raw[rng.rand(*shape) < 0.02] = 65533
+            raw[rng.rand(*shape) < 0.02] = 0
+            self.raw[b] = raw
+        self.factors = { 'm07' : [2.0e-5, -1.0e-4],
+                         'm08' : [1.9e-5,  3.0e-4],
+                         'm10' : [2.1e-5,  0.0   ],
+                         'm11' : [1.7e-5, -2.0e-4] }
+
+        self.af = vt.ActiveFire750()
+        self.af.AfArray = np.where(rng.rand(*shape) < 0.1, 4, 5).astype(np.uint8)
+
+        self.geo = vt.GeoFile750()
+        self.geo.SolZen = (rng.rand(*shape) * 120).astype(np.float32)
+        self.geo.LatArray, self.geo.LonArray = np.mgrid[40:41:shape[0]*1j,
+                                                        -110:-108:shape[1]*1j]
+
+        config = vc.VIIRSConfig()
+        config.M07UB = 0.5
+        config.M08LB = 0.05
+        config.M08UB = 0.6
+        config.M10LB = 0.1
+        config.M10UB = 1.0
+        config.M11LB = 0.05
+        config.RthSub = 0.05
+        config.Rth = 1.5
+        config.RthLB = 0.0
+        config.MaxSolZen = 96.
+        self.config = config
+
+    def refl(self, band) :
+        return make_refl(self.raw[band], self.factors[band])
+
+class TestCountThreshold (ThresholdFixture, unittest.TestCase) :
+
+    def compare(self) :
+        """thresholds both ways and checks that the masks are identical"""
+        c = self.config
+        ref = vt.ba_threshold(c, self.refl('m07'), self.refl('m08'),
+                              self.refl('m10'), self.refl('m11'),
+                              self.af, self.geo)
+        test = vt.ba_threshold_counts(c, self.refl('m07'), self.refl('m08'),
+                              self.refl('m10'), self.refl('m11'),
+                              self.af, self.geo)
+        self.assertTrue(np.count_nonzero(ref) > 0)
+        self.assertTrue(np.array_equal(ref.astype(np.bool), test))
+
+    def test_identical(self) :
+        """the count domain threshold matches the reflectance domain one"""
+        self.compare()
+
+    def on_grid(self, band, val) :
+        """returns the corrected reflectance value closest to val which some
+        raw count maps to exactly"""
+        lut = self.refl(band).get_refl_lut()
+        return float(lut[np.argmin(np.abs(lut - val))])
+
+    def test_identical_on_boundaries(self) :
+        """bounds which exactly equal a corrected reflectance value are
+        handled with the same strictness"""
+        c = self.config
+        c.M07UB = self.on_grid('m07', c.M07UB)
+        c.M08LB = self.on_grid('m08', c.M08LB)
+        c.M08UB = self.on_grid('m08', c.M08UB)
+        c.M10LB = self.on_grid('m10', c.M10LB)
+        c.M11LB = self.on_grid('m11', c.M11LB)
+        self.compare()
+
+    def test_count_bounds(self) :
+        """count bounds agree with the corrected reflectance comparisons"""
+        m08 = self.refl('m08')
+        cor = self.refl('m08').get_cor_refl()
+        for val in [ -1., 0., 0.05, 0.3, 2. ] :
+            self.assertTrue(np.array_equal(self.raw['m08'] < m08.count_below(val),
+                                           cor < val))
+            self.assertTrue(np.array_equal(self.raw['m08'] >= m08.count_above(val),
+                                           cor > val))
+
+    def test_corrected_has_no_raw(self) :
+        """raw counts are unavailable once the reflectance has been corrected"""
+        m07 = self.refl('m07')
+        m07.get_cor_refl()
+        self.assertRaises(ValueError, m07.get_raw)
@@ -248,4 +248,26 @@ class TestVIIRSConfig (unittest.TestCase) :
         base_dir = '/hey/there/Ima/path'
         new_dir  = self.config.perturb_dir(base_dir)
         self.assertEqual(os.path.join('/hey/there/Ima','Run_{0}'.format(self.config.run_id)),new_dir)
-                
\ No newline at end of file
+                
+    def test_processing_round_trip(self) : 
+        """[Processing] options survive the ini view and a merge"""
+        self.assertFalse(self.config.has_processing())
+        self.assertFalse('Processing' in self.config.get_ini_obj().sections())
+
+        self.config.BlockRows = 64
+        self.assertTrue(self.config.has_blocks())
+        ini = copy_config_parser(self.config.get_ini_obj())
+        self.assertEqual(ini.getint('Processing', 'BlockRows'), 64)
+
+        m = vc.VIIRSConfig.merge_into_template(self.config.get_vector(), self.config)
+        self.assertEqual(m.BlockRows, 64)
+
+    def test_run_store_round_trip(self) : 
+        """the run store survives the ini view and a merge"""
+        self.assertFalse(self.config.has_run_store())
+        self.config.RunStore = 'runs'
+        ini = copy_config_parser(self.config.get_ini_obj())
+        self.assertEqual(ini.get('DataBaseInfo', 'RunStore'), 'runs')
+
+        m = vc.VIIRSConfig.merge_into_template(self.config.get_vector(), self.config)
+        self.assertEqual(m.RunStore, 'runs')
@@ -128,6 +128,7 @@ if __name__ == "__main__":
     # do the work
     workers=12
     print "Running {0} iterations, using {1} parallel workers.".format(len(p), workers)
+    vt.init_run_store(template_ini)
     mypool = mp.Pool(processes=workers)
     mypool.map(vt.run, p)
         
@@ -30,6 +30,14 @@ int_vector_params = ['TemporalProximity', 'SpatialProximity']
 vector_param_names = float_vector_params + int_vector_params
 
 ConfigVector = namedtuple('ConfigVector', vector_param_names )
+
+# optional [Processing] parameters: these control how the work is done, but
+# not the results. Each entry is (name, type).
+processing_params = [ ('BlockRows', int),
+                      ('PipelineDepth', int),
+                      ('ConfirmMethod', str),
+                      ('RasterCell', int),
+                      ('Partition', str) ]
                   
 class VIIRSConfig (object) : 
     @classmethod
@@ -52,6 +60,8 @@ class VIIRSConfig (object) :
         merged.DBschema      = template.DBschema
         merged.DBhost        = template.DBhost
         merged.pwd           = template.pwd
+        if template.has_run_store() : 
+            merged.RunStore  = template.RunStore
         
         merged.ImageDates    = template.ImageDates
         merged.BaseDir       = template.BaseDir
@@ -65,6 +75,9 @@ class VIIRSConfig (object) :
         for p in vector_param_names : 
             setattr(merged, p, getattr(thresh_vec, p))        
 
+        if template.has_af_only() : 
+            merged.AFOnly = template.AFOnly
+
         # merge in the geographic window if present
         if template.has_window() : 
             merged.north = template.north 
@@ -75,6 +88,13 @@ class VIIRSConfig (object) :
         if template.has_burnmask() : 
             merged.BMschema = template.BMschema
             merged.BMtable  = template.BMtable
+            if template.has_burnmask_cache() : 
+                merged.BMcache  = template.BMcache
+                merged.BMingest = template.BMingest
+
+        for p, ptype in processing_params : 
+            if hasattr(template, p) : 
+                setattr(merged, p, getattr(template, p))
 
         # handle changes
         if runid is not None : 
@@ -163,6 +183,8 @@ class VIIRSConfig (object) :
 
         target.TemporalProximity = int(ini.get("ConfirmBurnParameters", "TemporalProximity"))
         target.SpatialProximity  = int(ini.get("ConfirmBurnParameters", "SpatialProximity")) 
+        if ini.has_option("ConfirmBurnParameters", "AFOnly") : 
+            target.AFOnly = ini.get("ConfirmBurnParameters", "AFOnly").lower()
 
         target.TextOut = ini.get("OutputFlags", "TextFile").lower()
         target.ShapeOut = ini.get("OutputFlags", "ShapeFile").lower()
@@ -180,6 +202,8 @@ class VIIRSConfig (object) :
             target.DBhost = ini.get("DataBaseInfo", "Host")
         else : 
             target.DBhost = None
+        if ini.has_option("DataBaseInfo", "RunStore") : 
+            target.RunStore = ini.get("DataBaseInfo", "RunStore")
 
         if ini.has_section('GeogWindow') : 
             target.north = ini.getfloat('GeogWindow','North')
@@ -190,6 +214,16 @@ class VIIRSConfig (object) :
         if ini.has_section('Burnmask') : 
             target.BMschema = ini.get('Burnmask', 'schema')
             target.BMtable  = ini.get('Burnmask', 'table')
+            if ini.has_option('Burnmask', 'cache') : 
+                target.BMcache = ini.get('Burnmask', 'cache')
+                target.BMingest = 'flag'
+                if ini.has_option('Burnmask', 'ingest') : 
+                    target.BMingest = ini.get('Burnmask', 'ingest').lower()
+
+        if ini.has_section('Processing') : 
+            for p, ptype in processing_params : 
+                if ini.has_option('Processing', p) : 
+                    setattr(target, p, ptype(ini.get('Processing', p)))
         
         target.parse_schema()
         target.sort_dates()
@@ -257,6 +291,8 @@ class VIIRSConfig (object) :
                    '{:d}'.format(int(self.TemporalProximity)))
         ini.set("ConfirmBurnParameters", "SpatialProximity", 
                    '{:d}'.format(int(self.SpatialProximity)))
+        if self.has_af_only() : 
+            ini.set("ConfirmBurnParameters", "AFOnly", self.AFOnly)
 
         ini.add_section("OutputFlags")
         ini.set("OutputFlags", "TextFile", self.TextOut.lower())
@@ -275,6 +311,8 @@ class VIIRSConfig (object) :
         ini.set("DataBaseInfo", "password", self.pwd)
         if self.DBhost is not None : 
             ini.set("DataBaseInfo", "Host", self.DBhost)
+        if self.has_run_store() : 
+            ini.set("DataBaseInfo", "RunStore", self.RunStore)
 
         if self.has_window() : 
             ini.add_section("GeogWindow")
@@ -288,6 +326,15 @@ class VIIRSConfig (object) :
              ini.add_section("Burnmask")
              ini.set("Burnmask", "schema", self.BMschema)
              ini.set("Burnmask", "table",  self.BMtable) 
+             if self.has_burnmask_cache() : 
+                 ini.set("Burnmask", "cache",  self.BMcache)
+                 ini.set("Burnmask", "ingest", self.BMingest)
+
+        if self.has_processing() : 
+            ini.add_section("Processing")
+            for p, ptype in processing_params : 
+                if hasattr(self, p) : 
+                    ini.set("Processing", p, str(getattr(self, p)))
         
         return ini
         
@@ -308,6 +355,53 @@ class VIIRSConfig (object) :
     def has_burnmask(self) : 
         """checks for the presence of burnmask properties on this object"""
         return hasattr(self, "BMschema")
+
+    def has_burnmask_cache(self) : 
+        """checks whether the burnmask is applied from a local copy as the 
+        points are loaded, rather than in the database"""
+        return hasattr(self, "BMcache")
+
+    def has_af_only(self) : 
+        """checks whether active fire points are clustered only with the 
+        active fire events of collections, not their threshold events"""
+        return hasattr(self, "AFOnly") and self.AFOnly == 'y'
+
+    def af_key(self) : 
+        """the settings which determine the fire collections when active 
+        fire points are clustered only with active fire events. Runs with
+        equal keys (and the same dates and active fire inputs) make the same
+        collections."""
+        bm = None
+        if self.has_burnmask() : 
+            bm = (self.BMschema, self.BMtable)
+        window = None
+        if self.has_window() : 
+            window = (self.north, self.south, self.east, self.west)
+        return (int(self.SpatialProximity), int(self.TemporalProximity), bm, window,
+                self.use375af.lower(), self.use750af.lower(), 
+                getattr(self, 'limit375', None), tuple(self.SortedImageDates))
+
+    def has_run_store(self) : 
+        """checks whether finished runs are moved out of their own schemas
+        into a shared run store (see SqlFunctions/viirs_run_store.sql)"""
+        return hasattr(self, "RunStore")
+
+    def has_processing(self) : 
+        """checks for the presence of any [Processing] options on this object"""
+        return any([hasattr(self, p) for p, ptype in processing_params])
+
+    def has_blocks(self) : 
+        """checks whether granules should be processed in blocks of scan lines"""
+        return hasattr(self, "BlockRows")
+
+    def has_partitions(self) : 
+        """checks whether the point and event tables are partitioned by 
+        collection date (Partition is week or month)"""
+        return hasattr(self, "Partition")
+
+    def has_pipeline(self) : 
+        """checks whether reading, thresholding and output should overlap"""
+        return hasattr(self, "PipelineDepth")
         
     def get_vector(self) : 
         """returns the vector representation of the numeric parameters
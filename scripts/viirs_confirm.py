@@ -0,0 +1,403 @@
+"""Confirms burned area in memory, without a trip to PostGIS per date.
+
+ConfirmEngine gives the same results as the SQL functions
+viirs_activefire_2_fireevents and viirs_threshold_2_fireevents, but keeps
+the fire events of the active collections in a hash grid on Albers (102008)
+coordinates. The grid cells are SpatialProximity on a side, so the events
+within SpatialProximity of a point are all in the 3x3 block of cells around
+it. A collection's events leave the grid once its last update falls more
+than TemporalProximity days behind the date being confirmed.
+
+The active_fire and threshold_burned points are still read from the
+database (after masking, if there is a burn mask), one date at a time. The
+fire events and collections are bulk loaded by write() once the whole run
+has been confirmed, and the confirmed threshold points are flagged then.
+
+Distances are computed from the Albers coordinates stored in geom_albers
+when the points were loaded, as the SQL functions do. Points loaded without
+them are projected by PostGIS when they are read.
+
+RasterConfirmEngine (ConfirmMethod "raster") clusters active fire points
+the same way, but confirms threshold points against a raster instead: a
+fixed Albers grid of RasterCell meters, where each cell holds the latest
+active fire event to fall in it and that event's collection. A threshold
+point is confirmed when a cell whose center lies within SpatialProximity
+of it holds an event of an active collection, so the cost per point is
+set by the disk of cells, not by the number of fire events. It differs
+from the vector test at cell edges:
+
+- events are placed at the centers of their cells, so an event up to half
+  a cell diagonal further than SpatialProximity may confirm a point, and
+  one up to half a diagonal nearer may not;
+- a cell only remembers its latest event, so an older event sharing the
+  cell with a newer one from a collection which has since closed no longer
+  confirms anything;
+- among the cells in reach, the latest event picks the collection, as the
+  vector test does, but ties between events in one cell go to the latest.
+"""
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_proj
+import numpy as np
+import datetime
+import cStringIO
+
+nlcd = viirs_proj.projections[vt.srids['NLCD']]
+
+def fetch_points(config, table, collectionDate) :
+    """reads the unmasked points of one date from table (active_fire or
+    threshold_burned), in fid order. Returns a dictionary of arrays."""
+    rows = vt.fetch_query(config,
+        "SELECT fid, ST_X(geom), ST_Y(geom), " +
+        "ST_X(COALESCE(geom_albers, ST_Transform(geom, {0}))), ".format(vt.srids['Albers']) +
+        "ST_Y(COALESCE(geom_albers, ST_Transform(geom, {0}))), ".format(vt.srids['Albers']) +
+        "latitude, longitude, pixel_size, band_i_m " +
+        "FROM \"{0}\".{1} WHERE collection_date = '{2}' AND NOT masked ORDER BY fid".format(
+            config.DBschema, table, collectionDate))
+    return points(rows)
+
+def points(rows) :
+    """turns rows of (fid, lon, lat, x, y, latitude, longitude, pixel_size,
+    band_i_m) into a dictionary of arrays, where (x, y) are the Albers 
+    coordinates of (lon, lat)"""
+    names = ['fid', 'lon', 'lat', 'x', 'y', 'latitude', 'longitude', 
+             'pixel_size', 'band_i_m']
+    pts = {}
+    for i, n in enumerate(names) :
+        pts[n] = np.array([ r[i] for r in rows ])
+    for n in ['lon', 'lat', 'x', 'y'] :
+        pts[n] = pts[n].astype(np.float64)
+    return pts
+
+def _find(parent, i) :
+    while parent[i] != i :
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+class ConfirmEngine (object) :
+    """the fire events and collections of one run, built in date order"""
+
+    def __init__(self, distance, recent, af_only=False) :
+        """distance is SpatialProximity in meters, recent is TemporalProximity
+        as a timedelta. If af_only, active fire points are only matched to
+        the active fire events of collections."""
+        self.distance = float(distance)
+        self.recent = recent
+        self.af_only = af_only
+        # points further apart than this never affect each other
+        self.reach = self.distance
+        self.grid = {}            # cell -> indices of events in active collections
+        self.active = {}          # collection fid -> indices of its events
+        self.collections = []     # [initial_date, last_update, initial_fid], by fid-1
+        self.events = []          # event rows, by fid-1
+        self.confirmed = []       # fids of confirmed threshold_burned points
+
+    @classmethod
+    def for_config(cls, config) :
+        return cls(int(config.SpatialProximity),
+                   datetime.timedelta(days=int(config.TemporalProximity)),
+                   config.has_af_only())
+
+    def _cell(self, x, y) :
+        return (int(np.floor(x / self.distance)), int(np.floor(y / self.distance)))
+
+    def _near(self, x, y) :
+        """indices and distances of events in active collections which are
+        within distance of (x, y)"""
+        cx, cy = self._cell(x, y)
+        idx = []
+        for i in range(cx-1, cx+2) :
+            for j in range(cy-1, cy+2) :
+                idx.extend(self.grid.get((i,j), []))
+        found = []
+        for e in idx :
+            d = np.hypot(self.events[e]['x'] - x, self.events[e]['y'] - y)
+            if d <= self.distance :
+                found.append((e, d))
+        return found
+
+    def _add_event(self, pts, i, source, collection_id, collectionDate) :
+        """appends point i of pts as an event of collection_id"""
+        e = len(self.events)
+        self.events.append({ 'fid' : e+1, 'point_fid' : pts['fid'][i],
+               'x' : pts['x'][i], 'y' : pts['y'][i],
+               'lon' : pts['lon'][i], 'lat' : pts['lat'][i],
+               'latitude' : pts['latitude'][i], 'longitude' : pts['longitude'][i],
+               'source' : source, 'collection_id' : collection_id,
+               'collection_date' : collectionDate,
+               'pixel_size' : pts['pixel_size'][i], 'band_i_m' : pts['band_i_m'][i] })
+        self.grid.setdefault(self._cell(pts['x'][i], pts['y'][i]), []).append(e)
+        self.active.setdefault(collection_id, []).append(e)
+
+    def evict(self, collectionDate) :
+        """drops the events of collections last updated before the temporal
+        window of collectionDate from the grid"""
+        oldest = collectionDate - self.recent
+        for fc in [ fc for fc in self.active if self.collections[fc-1][1] < oldest ] :
+            for e in self.active.pop(fc) :
+                cell = self._cell(self.events[e]['x'], self.events[e]['y'])
+                self.grid[cell].remove(e)
+                if len(self.grid[cell]) == 0 :
+                    del self.grid[cell]
+
+    def active_fire(self, collectionDate, pts) :
+        """adds the active fire points of one date, as
+        viirs_activefire_2_fireevents does. A point joins the collection of
+        the nearest event in an active collection. Points within distance of
+        each other form clusters; unmatched points join the lowest numbered
+        collection matched in their cluster, and unmatched clusters become
+        new collections."""
+        n = len(pts['fid'])
+        fc_fid = [None] * n
+        for i in range(n) :
+            near = [ (d, self.events[e]['collection_id'])
+                     for e, d in self._near(pts['x'][i], pts['y'][i])
+                       if not self.af_only or self.events[e]['source'] == 'ActiveFire' ]
+            if len(near) > 0 :
+                fc_fid[i] = min(near)[1]
+
+        # clusters (connected components) of the date's points
+        parent = range(n)
+        cells = {}
+        for i in range(n) :
+            cells.setdefault(self._cell(pts['x'][i], pts['y'][i]), []).append(i)
+        for i in range(n) :
+            cx, cy = self._cell(pts['x'][i], pts['y'][i])
+            for ci in range(cx-1, cx+2) :
+                for cj in range(cy-1, cy+2) :
+                    for j in cells.get((ci,cj), []) :
+                        if (j < i and
+                            np.hypot(pts['x'][i]-pts['x'][j], pts['y'][i]-pts['y'][j]) <= self.distance) :
+                            parent[_find(parent, i)] = _find(parent, j)
+        cluster_fid = {}
+        for i in range(n) :
+            root = _find(parent, i)
+            cluster_fid[root] = min(cluster_fid.get(root, pts['fid'][i]), pts['fid'][i])
+        cluster = [ cluster_fid[_find(parent, i)] for i in range(n) ]
+
+        joined = {}
+        for i in range(n) :
+            if fc_fid[i] is not None :
+                joined[cluster[i]] = min(joined.get(cluster[i], fc_fid[i]), fc_fid[i])
+        for c in sorted(set(cluster)) :
+            if c not in joined :
+                self.collections.append([collectionDate, collectionDate, c])
+                joined[c] = len(self.collections)
+        for i in range(n) :
+            if fc_fid[i] is None :
+                fc_fid[i] = joined[cluster[i]]
+
+        for i in np.argsort(pts['fid'], kind='mergesort') :
+            self._add_event(pts, i, 'ActiveFire', fc_fid[i], collectionDate)
+        for fc in set(fc_fid) :
+            self.collections[fc-1][1] = collectionDate
+
+    def threshold(self, collectionDate, pts) :
+        """confirms the threshold points of one date, as
+        viirs_threshold_2_fireevents does. A point within distance of an
+        active fire event in an active collection is confirmed, and joins
+        the collection of the most recent such event."""
+        found = []
+        for i in range(len(pts['fid'])) :
+            near = [ e for e, d in self._near(pts['x'][i], pts['y'][i])
+                       if self.events[e]['source'] == 'ActiveFire' ]
+            if len(near) > 0 :
+                found.append((pts['fid'][i], i, self.events[max(near)]['collection_id']))
+        for t_fid, i, fc in sorted(found) :
+            self._add_event(pts, i, 'Threshold', fc, collectionDate)
+            self.confirmed.append(t_fid)
+
+    def confirm_date(self, config, collectionDate) :
+        """confirms one date, reading its points from the database. Dates
+        must be confirmed in order."""
+        if config.has_burnmask() and not config.has_burnmask_cache() :
+            for table in ['active_fire', 'threshold_burned'] :
+                vt.execute_query(config,
+                    "SELECT viirs_collection_mask_points('{0}','{1}','{2}','{3}','geom','{4}')".format(
+                        config.DBschema, table, config.BMschema, config.BMtable, collectionDate))
+        date = datetime.datetime.strptime(collectionDate, "%Y-%m-%d %H:%M:%S")
+        self.evict(date)
+        self.active_fire(date, fetch_points(config, 'active_fire', collectionDate))
+        self.threshold(date, fetch_points(config, 'threshold_burned', collectionDate))
+
+    def write(self, config) :
+        """bulk loads the fire events and collections into the (empty) tables
+        of the run, along with active_events, flags the confirmed threshold 
+        points and advances the fid sequences past the rows written."""
+        schema = config.DBschema
+        fmt = "%Y-%m-%d %H:%M:%S"
+        with vt.transaction(config) :
+            with vt.session_cursor(config) as cur :
+                # while the tables are still empty
+                cur.execute("SELECT viirs_ensure_active_events(%s)", (schema,))
+                buf = cStringIO.StringIO()
+                for fid, (initial_date, last_update, initial_fid) in enumerate(self.collections) :
+                    buf.write("{0},TRUE,{1},{2},{3}\n".format(fid+1, initial_fid,
+                              last_update.strftime(fmt), initial_date.strftime(fmt)))
+                buf.seek(0)
+                cur.copy_expert('COPY "{0}".fire_collections '.format(schema) +
+                    "(fid, active, initial_fid, last_update, initial_date) FROM STDIN WITH CSV", buf)
+
+                cur.execute("DROP TABLE IF EXISTS pg_temp.events_staging")
+                cur.execute("CREATE TEMPORARY TABLE events_staging (fid bigint, " +
+                    "x double precision, y double precision, " +
+                    "nlcd_x double precision, nlcd_y double precision, latitude real, " +
+                    "longitude real, source character(10), collection_id bigint, " +
+                    "collection_date timestamp without time zone, pixel_size integer, " +
+                    "band_i_m character(1)) ON COMMIT DROP")
+                nlcd_x, nlcd_y = nlcd.forward([ e['lon'] for e in self.events ],
+                                              [ e['lat'] for e in self.events ])
+                buf = cStringIO.StringIO()
+                for i, e in enumerate(self.events) :
+                    buf.write("{0},{1},{2},{3},{4},{5},{6},{7},{8},{9},{10},{11}\n".format(e['fid'],
+                        repr(float(e['x'])), repr(float(e['y'])),
+                        repr(float(nlcd_x[i])), repr(float(nlcd_y[i])),
+                        repr(float(e['latitude'])), repr(float(e['longitude'])),
+                        e['source'], e['collection_id'], e['collection_date'].strftime(fmt),
+                        e['pixel_size'], e['band_i_m']))
+                buf.seek(0)
+                cur.copy_expert("COPY events_staging FROM STDIN WITH CSV", buf)
+                cur.execute('INSERT INTO "{0}".fire_events '.format(schema) +
+                    "(fid, latitude, longitude, geom, source, collection_id, " +
+                    "collection_date, pixel_size, band_i_m, geom_nlcd) " +
+                    "SELECT fid, latitude, longitude, " +
+                    "ST_SetSRID(ST_MakePoint(x, y),{0}), ".format(vt.srids['Albers']) +
+                    "source, collection_id, collection_date, pixel_size, band_i_m, " +
+                    "ST_SetSRID(ST_MakePoint(nlcd_x, nlcd_y),{0}) ".format(vt.srids['NLCD']) +
+                    "FROM events_staging ORDER BY fid")
+
+                # the events of the collections still active at the end, so
+                # that later dates may be confirmed by the SQL functions
+                cur.execute('INSERT INTO "{0}".active_events '.format(schema) +
+                    "(event_fid, collection_id, last_update, source, geom) " +
+                    "SELECT fe.fid, fe.collection_id, fc.last_update, fe.source, fe.geom " +
+                    'FROM "{0}".fire_events fe, "{0}".fire_collections fc '.format(schema) +
+                    "WHERE fc.fid = fe.collection_id AND fe.collection_id = ANY(%s)",
+                    (sorted(self.active.keys()),))
+
+                cur.execute("DROP TABLE IF EXISTS pg_temp.confirmed_staging")
+                cur.execute("CREATE TEMPORARY TABLE confirmed_staging (fid bigint) ON COMMIT DROP")
+                buf = cStringIO.StringIO("".join([ "{0}\n".format(f) for f in self.confirmed ]))
+                cur.copy_expert("COPY confirmed_staging FROM STDIN", buf)
+                cur.execute('UPDATE "{0}".threshold_burned t SET confirmed_burn = TRUE '.format(schema) +
+                    "FROM confirmed_staging c WHERE t.fid = c.fid")
+
+                for table, rows in [ ('fire_collections', self.collections),
+                                     ('fire_events', self.events) ] :
+                    if len(rows) > 0 :
+                        cur.execute("SELECT setval(%s, %s)",
+                            ('"{0}".{1}_fid_seq'.format(schema, table), len(rows)))
+
+class RasterConfirmEngine (ConfirmEngine) :
+    """ConfirmEngine which confirms threshold points against a raster of
+    the latest active fire event in each cell. The raster is stored as
+    square tiles, made as events fall on them."""
+
+    tile = 256    # cells on a side
+    cells = 1 << 22   # (point, offset) pairs examined at a time
+
+    def __init__(self, distance, recent, af_only=False, cell=375) :
+        ConfirmEngine.__init__(self, distance, recent, af_only)
+        self.cell = float(cell)
+        # events are moved to the centers of their cells
+        self.reach = self.distance + self.cell * np.sqrt(2.) / 2.
+        self.tiles = {}           # (tx, ty) -> (event index, collection fid)
+        # cell offsets covering a disk of radius distance around any point
+        # of the center cell
+        r = int(np.ceil(self.distance / self.cell)) + 1
+        dx, dy = np.meshgrid(np.arange(-r, r+1), np.arange(-r, r+1))
+        keep = np.hypot(np.maximum(np.abs(dx) - 1, 0),
+                        np.maximum(np.abs(dy) - 1, 0)) * self.cell <= self.distance
+        self.offsets = (dx[keep], dy[keep])
+
+    @classmethod
+    def for_config(cls, config) :
+        return cls(int(config.SpatialProximity),
+                   datetime.timedelta(days=int(config.TemporalProximity)),
+                   config.has_af_only(), getattr(config, 'RasterCell', 375))
+
+    def _stamp(self, first) :
+        """writes the events from index first on into the raster"""
+        for e in range(first, len(self.events)) :
+            cx = int(np.floor(self.events[e]['x'] / self.cell))
+            cy = int(np.floor(self.events[e]['y'] / self.cell))
+            key = (cx // self.tile, cy // self.tile)
+            if key not in self.tiles :
+                self.tiles[key] = (np.full((self.tile, self.tile), -1, dtype=np.int64),
+                                   np.zeros((self.tile, self.tile), dtype=np.int64))
+            ev, fc = self.tiles[key]
+            # events arrive in fid order, so the last one written is the latest
+            ev[cx % self.tile, cy % self.tile] = e
+            fc[cx % self.tile, cy % self.tile] = self.events[e]['collection_id']
+
+    def active_fire(self, collectionDate, pts) :
+        first = len(self.events)
+        ConfirmEngine.active_fire(self, collectionDate, pts)
+        self._stamp(first)
+
+    def _latest(self, x, y, active) :
+        """the latest event in an active collection within distance of each
+        point (x, y), or -1. The events of each point's disk are gathered a
+        tile at a time."""
+        x = x[:,np.newaxis]
+        y = y[:,np.newaxis]
+        cx = np.floor(x / self.cell).astype(np.int64) + self.offsets[0][np.newaxis,:]
+        cy = np.floor(y / self.cell).astype(np.int64) + self.offsets[1][np.newaxis,:]
+        near = np.hypot((cx + 0.5) * self.cell - x,
+                        (cy + 0.5) * self.cell - y) <= self.distance
+
+        ev = np.full(cx.shape, -1, dtype=np.int64)
+        fc = np.zeros(cx.shape, dtype=np.int64)
+        rows, cols = np.nonzero(near)
+        cx = cx[rows, cols]
+        cy = cy[rows, cols]
+        tx = cx // self.tile
+        ty = cy // self.tile
+        # one key per tile, to visit only the tiles the disks touch
+        tkey = ((tx + 2**20) << 21) | (ty + 2**20)
+        for k in np.unique(tkey) :
+            on = (tkey == k)
+            key = (int(tx[on][0]), int(ty[on][0]))
+            if key not in self.tiles :
+                continue
+            t_ev, t_fc = self.tiles[key]
+            ev[rows[on], cols[on]] = t_ev[cx[on] % self.tile, cy[on] % self.tile]
+            fc[rows[on], cols[on]] = t_fc[cx[on] % self.tile, cy[on] % self.tile]
+
+        ev[(ev < 0) | ~active[fc]] = -1
+        return ev.max(axis=1)
+
+    def threshold(self, collectionDate, pts) :
+        """confirms the threshold points of one date against the raster.
+        The points are taken in chunks, so that the temporaries hold about
+        cells (point, offset) pairs at a time."""
+        n = len(pts['fid'])
+        if n == 0 or len(self.tiles) == 0 :
+            return
+        active = np.zeros(len(self.collections) + 1, dtype=np.bool)
+        active[list(self.active.keys())] = True
+        step = max(1, self.cells // len(self.offsets[0]))
+        found = []
+        for start in range(0, n, step) :
+            latest = self._latest(pts['x'][start:start+step], pts['y'][start:start+step], active)
+            for i in np.nonzero(latest >= 0)[0] :
+                e = latest[i]
+                found.append((pts['fid'][start+i], start+i, self.events[e]['collection_id']))
+        for t_fid, i, c in sorted(found) :
+            self._add_event(pts, i, 'Threshold', c, collectionDate)
+            self.confirmed.append(t_fid)
+
+def engine_class(config) :
+    """the engine class for config's ConfirmMethod. Runs confirmed by the
+    SQL functions are matched by ConfirmEngine."""
+    if getattr(config, 'ConfirmMethod', 'sql') == 'raster' :
+        return RasterConfirmEngine
+    return ConfirmEngine
+
+def check_empty(config) :
+    """raises ValueError unless the run has no fire collections yet. The
+    engine numbers its collections and events from 1."""
+    rows = vt.fetch_query(config,
+        'SELECT count(*) FROM "{0}".fire_collections'.format(config.DBschema))
+    if rows[0][0] > 0 :
+        raise ValueError("In-memory confirmation needs an empty fire_collections table in {0}".format(config.DBschema))
@@ -1,7 +1,6 @@
 import os.path
 import numpy as np
 import pandas as pd
-import psycopg2
 import subprocess as sub
 import multiprocessing as mp
 import functools as ft
@@ -66,12 +65,13 @@ def export_raster(config, raster_tbl, raster_col='rast') :
     
     
 def rasterize(config) :  
-    create_events_view(config,2013)
-    create_fire_events_raster(config, 'fire_events_2013', 'gt', 'burnmask13', '', result_tbl='rast_doy_2013')
-    export_raster(config, 'rast_doy_2013')
+    with vt.run_workspace(config) : 
+        create_events_view(config,2013)
+        create_fire_events_raster(config, 'fire_events_2013', 'gt', 'burnmask13', '', result_tbl='rast_doy_2013')
+        export_raster(config, 'rast_doy_2013')
 
-    create_events_view(config,2014)
-    create_fire_events_raster(config, 'fire_events_2014', 'gt', 'burnmask13', '', result_tbl='rast_doy_2014')
-    export_raster(config, 'rast_doy_2014')
+        create_events_view(config,2014)
+        create_fire_events_raster(config, 'fire_events_2014', 'gt', 'burnmask13', '', result_tbl='rast_doy_2014')
+        export_raster(config, 'rast_doy_2014')
 
     
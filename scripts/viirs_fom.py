@@ -24,7 +24,6 @@ A second figure of merit flow is as follows:
 import os.path
 import numpy as np
 import pandas as pd
-import psycopg2
 import multiprocessing as mp
 import functools as ft
 import VIIRS_threshold_reflCor_Bulk as vt
@@ -94,31 +93,54 @@ def calc_ioveru_fom(config) :
     query = "SELECT viirs_calc_fom('{0}')".format(config.DBschema)
     
     # now, need to execute a query that returns a single result.
-    ConnParam = vt.postgis_conn_params(config)
-    conn = psycopg2.connect(ConnParam)
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
-    cur.execute(query)
-    rows = cur.fetchall()
-
-    conn.commit()
-    # Close communication with the database
-    cur.close()
-    conn.close()
+    rows = vt.fetch_query(config, query)
     
     return rows[0][0]
     
     
-def do_ioveru_fom(gt_schema, gt_table, config) : 
-    """performs the complete process for calculating the intersection over union
-    figure of merit."""
-    
+def calc_ioveru_counts(config) : 
+    """returns the pixel counts (intersection, detected, truth) behind the 
+    intersection over union figure of merit. Like calc_ioveru_fom(), this 
+    assumes that the mask_sum raster already exists."""
+    query = "SELECT intersection, detected, truth FROM viirs_fom_counts('{0}')".format(config.DBschema)
+    rows = vt.fetch_query(config, query)
+    return tuple([ int(v) for v in rows[0] ])
+
+def scaled_ioveru(intersection, detected, truth, fraction) : 
+    """intersection over union of a run over only a fraction of the season's
+    dates, scored against the whole season's ground truth. Assuming the 
+    area burns evenly over the season, only about that fraction of the 
+    ground truth could have been detected, so the truth is scaled by 
+    fraction (though never below the intersection). Otherwise the ground 
+    truth which the run could not see would dominate the union, and hide 
+    the cost of false detections."""
+    truth = max(intersection, fraction * truth)
+    union = truth + detected - intersection
+    if union <= 0 : 
+        return 0.
+    return intersection / float(union)
+
+def prepare_mask_sum(gt_schema, gt_table, config) : 
+    """rasterizes the run's fire events and sums them with the ground truth"""
     project_fire_events_nlcd(config)
     create_fire_events_raster(config, 'fire_events',  
                               gt_schema, gt_table, gt_table,
                               filt_dist=config.SpatialProximity)
     mask_sum(config, gt_schema, gt_table)
-    return calc_ioveru_fom(config)
+
+def do_ioveru_fom(gt_schema, gt_table, config) : 
+    """performs the complete process for calculating the intersection over union
+    figure of merit."""
+    
+    with vt.run_workspace(config) : 
+        prepare_mask_sum(gt_schema, gt_table, config)
+        return calc_ioveru_fom(config)
+
+def do_ioveru_counts(gt_schema, gt_table, config) : 
+    """as do_ioveru_fom(), but returns the pixel counts of calc_ioveru_counts()"""
+    with vt.run_workspace(config) : 
+        prepare_mask_sum(gt_schema, gt_table, config)
+        return calc_ioveru_counts(config)
 
 def zonetbl_init(zone_schema, zone_tbl, zone_col, config) : 
     """drops and re-creates the table in which results are accumulated"""
@@ -163,24 +185,23 @@ def create_events_view(config,year) :
     return view_name
 
 def find_missing_zonetbl_runs(gt_schema, zone_tbl, config) : 
-    """locates missing run_ids in the zone_tbl by comparing with the list of schemas"""
+    """locates missing run_ids in the zone_tbl by comparing with the list of schemas,
+    or the list of stored runs if config keeps runs in a run store"""
+    if config.has_run_store() : 
+        stored = vt.fetch_query(config, 'SELECT run_id FROM "{0}".runs'.format(config.RunStore))
+        done = vt.fetch_query(config, 'SELECT DISTINCT run_id FROM "{0}"."{1}"'.format(
+                    gt_schema, zone_tbl))
+        done = set([ i[0] for i in done ])
+        return [ 'Run_{:04d}'.format(i[0]) for i in stored 
+                 if 'Run_{:04d}'.format(i[0]) not in done ]
+
     query = """select b.runs from
       (select nspname runs from pg_namespace where nspname LIKE 'Run_%') b
       where b.runs not in (select distinct run_id from "{0}"."{1}")""".format(
                 gt_schema, zone_tbl)
 
     # now, need to execute a query that returns multiple results.
-    ConnParam = vt.postgis_conn_params(config)
-    conn = psycopg2.connect(ConnParam)
-    # Open a cursor to perform database operations
-    cur = conn.cursor()
-    cur.execute(query)
-    rows = cur.fetchall()
-
-    conn.commit()
-    # Close communication with the database
-    cur.close()
-    conn.close()
+    rows = vt.fetch_query(config, query)
 
     runs = [ i[0] for i in rows ] 
 
@@ -204,17 +225,18 @@ def do_one_zonetbl_run(gt_schema, gt_table,
         filt_dist = -1.
         nearest = False
 
-    view_name = create_events_view(config, year)
-    create_fire_events_raster(config, view_name,
-                                gt_schema, gt_table, zonedef_tbl,
-                                filt_dist=filt_dist,filter_table=mask_tbl)
-    
-    # fire_events raster is always the product of the above, no matter
-    # which year is selected.
-    extract_fire_mask(config, config.DBschema, 'fire_events_raster',
-                    geom_col='geom_nlcd')
+    with vt.run_workspace(config) : 
+        view_name = create_events_view(config, year)
+        create_fire_events_raster(config, view_name,
+                                    gt_schema, gt_table, zonedef_tbl,
+                                    filt_dist=filt_dist,filter_table=mask_tbl)
+        
+        # fire_events raster is always the product of the above, no matter
+        # which year is selected.
+        extract_fire_mask(config, config.DBschema, 'fire_events_raster',
+                        geom_col='geom_nlcd')
 
-    zonetbl_run(gt_schema, zonedef_tbl, zone_tbl, zone_col, config, nearest)
+        zonetbl_run(gt_schema, zonedef_tbl, zone_tbl, zone_col, config, nearest)
     
     
 def calc_all_ioveru_fom(run_datafile, gt_schema, gt_table, workers=1,
@@ -0,0 +1,173 @@
+"""Calibrates by successive halving over growing subsets of the season.
+
+A sweep (viirs_brute, viirs_sweep) runs every candidate configuration over
+all of SortedImageDates, although most candidates are clearly bad after a
+few dates. Here the candidates are run in rungs. The first rung runs all of
+them on a small subset of the dates and scores them with the intersection
+over union figure of merit. Only the best 1/ratio of them are promoted to
+the next rung, which runs on a larger subset, and so on until the last rung
+runs the finalists over the whole season.
+
+The ground truth covers the whole season, while a subset run can only
+detect what burned on its dates. Scored as is, the ground truth the run
+could not see would dominate the union, and the more permissive
+thresholds would win. So the ground truth of a partial rung is scaled by
+the fraction of the dates it covers (see viirs_fom.scaled_ioveru).
+
+The subsets are stratified: the season is split into strata of consecutive
+dates, and each subset takes the same central fraction of every stratum.
+The dates taken stay consecutive within a stratum, so that fire events can
+still be confirmed within TemporalProximity, and each subset holds the
+smaller ones.
+
+For n candidates, rung fractions f0, f1, ... and ratio r, the work is about
+n * (f0 + f1/r + f2/r**2 + ...) full runs instead of n. The default
+schedule (1/27, 1/9, 1/3, 1 with a ratio of 3) costs 4 * n/27 full runs.
+
+The runs of the last rung keep the run_ids of their candidates. The runs of
+the earlier rungs are numbered from first_run upward, and are dropped
+(schema, stored run and directory) once they have been scored.
+"""
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_optimize as vo
+import pandas as pd
+import numpy as np
+import copy
+import sys
+
+default_fractions = [ 1/27., 1/9., 1/3., 1. ]
+
+def stratified_dates(dates, fraction, strata=4) :
+    """takes the central fraction (at least one date) of each of strata
+    runs of consecutive dates. Returns the dates in order."""
+    dates = sorted(dates)
+    if fraction >= 1. :
+        return dates
+    chosen = []
+    for stratum in np.array_split(np.arange(len(dates)), strata) :
+        if len(stratum) == 0 :
+            continue
+        n = max(1, int(round(len(stratum) * fraction)))
+        start = (len(stratum) - n) // 2
+        chosen.extend([ dates[i] for i in stratum[start:start+n] ])
+    return chosen
+
+def promote(fom, ratio) :
+    """returns the indices of the best 1/ratio of the figures of merit (at
+    least one), best first"""
+    keep = max(1, int(np.ceil(len(fom) / float(ratio))))
+    return list(np.argsort(-np.asarray(fom), kind='mergesort')[:keep])
+
+def schedule(count, fractions, ratio) :
+    """the number of candidates run in each rung, and the cost of all the
+    rungs in full runs"""
+    counts = []
+    for f in fractions :
+        counts.append(count)
+        count = max(1, int(np.ceil(count / float(ratio))))
+    cost = sum([ c * f for c, f in zip(counts, fractions) ])
+    return counts, cost
+
+def rung_template(template, dates) :
+    """a copy of template which processes only dates"""
+    cfg = copy.copy(template)
+    cfg.ImageDates = list(dates)
+    cfg.sort_dates()
+    return cfg
+
+def discard_runs(template, runs) :
+    """drops the (run_id, vector) runs of a partial rung"""
+    for run_id, vec in runs :
+        vt.drop_run(vc.VIIRSConfig.merge_into_template(vec, template, runid=run_id))
+
+def halving(template, vectors, run_ids, evaluator, fractions=default_fractions,
+            ratio=3, strata=4, first_run=None, discard=None) :
+    """runs the candidate vectors in rungs, promoting the best 1/ratio of
+    each rung to the next. evaluator(template, fraction) must return a
+    callable taking (run_id, vector) pairs and returning their figures of
+    merit by run_id (see viirs_optimize.FomEvaluator), where fraction is the
+    part of the season's dates in template. discard(template, runs) is
+    called with the runs of each partial rung once they are scored (see
+    discard_runs()). Returns one row per run, with the rung, its number of
+    dates, the candidate's run_id, the run's own run_id and the figure of
+    merit."""
+    if first_run is None :
+        first_run = max(run_ids) + 1
+    table = { 'rung' : [], 'dates' : [], 'candidate' : [], 'run_id' : [], 'fom' : [] }
+
+    alive = range(len(vectors))
+    for rung, fraction in enumerate(fractions) :
+        last = (rung == len(fractions) - 1)
+        dates = stratified_dates(template.ImageDates, fraction, strata)
+        print "Rung {0}: {1} candidates on {2} dates".format(rung, len(alive), len(dates))
+
+        runs = []
+        for c in alive :
+            if last :
+                runs.append( (run_ids[c], vectors[c]) )
+            else :
+                runs.append( (first_run, vectors[c]) )
+                first_run += 1
+        rung_cfg = rung_template(template, dates)
+        evaluate = evaluator(rung_cfg, len(dates) / float(len(template.ImageDates)))
+        fom = evaluate(runs)
+        if not last and discard is not None :
+            discard(rung_cfg, runs)
+
+        scores = []
+        for c, (run_id, vec) in zip(alive, runs) :
+            table['rung'].append(rung)
+            table['dates'].append(len(dates))
+            table['candidate'].append(run_ids[c])
+            table['run_id'].append(run_id)
+            table['fom'].append(fom[run_id])
+            scores.append(fom[run_id])
+
+        if not last :
+            alive = [ alive[i] for i in promote(scores, ratio) ]
+
+    return pd.DataFrame(table)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5:
+        print "\nMissing argrument"
+        print "\nEnter the template ini file, the parameter table (csv), and the ground"
+        print "truth schema and table. Optionally, the number of parallel workers"
+        print "(default 1), the promotion ratio (default 3) and a comma separated list"
+        print "of the fraction of the dates used by each rung (default 1/27,1/9,1/3,1)."
+        print "e.g., viirs_halving.py VIIRS_threshold.ini runs.csv gt mask 4 3 0.04,0.11,0.33,1\n"
+        sys.exit()
+
+    template = vc.VIIRSConfig.load(sys.argv[1])
+    table = pd.read_csv(sys.argv[2])
+    candidates = vc.VIIRSConfig.batch(template, table)
+    gt_schema = sys.argv[3]
+    gt_table = sys.argv[4]
+
+    workers = 1
+    if len(sys.argv) > 5 :
+        workers = int(sys.argv[5])
+    ratio = 3
+    if len(sys.argv) > 6 :
+        ratio = float(sys.argv[6])
+    fractions = default_fractions
+    if len(sys.argv) > 7 :
+        fractions = [ float(f) for f in sys.argv[7].split(',') ]
+
+    counts, cost = schedule(len(candidates), fractions, ratio)
+    print "Running {0} candidates in rungs of {1}: about {2:.1f} full runs.".format(
+                len(candidates), counts, cost)
+
+    evaluator = lambda t, f : vo.FomEvaluator(t, gt_schema, gt_table, workers, f)
+    result = halving(template, [ c.get_vector() for c in candidates ],
+                     [ c.run_id for c in candidates ], evaluator,
+                     fractions=fractions, ratio=ratio, discard=discard_runs)
+
+    result_file = "{0}_halving.csv".format(template.DBname)
+    print "Saving the rungs to {0}.".format(result_file)
+    result.to_csv(result_file)
+    final = result[result['rung'] == result['rung'].max()]
+    best = final.loc[final['fom'].idxmax()]
+    print "Best run: {0}, figure of merit {1}".format(int(best['run_id']), best['fom'])
@@ -0,0 +1,261 @@
+"""Predicts how many burned area pixels a threshold vector will produce.
+
+A ThresholdCube is a five dimensional histogram of the pixels in a set of
+granules over the quantities tested by ba_threshold(): M07, M08, M10 and M11
+reflectance and the Rth ratio. The granules are added into one running
+histogram, turned into prefix sums when first counted, so that the number of
+pixels inside any box (i.e., passing any combination of bounds) comes from
+32 lookups, regardless of the number of pixels or granules. Per granule
+counts are optional; each granule is then kept as a sparse list of its
+occupied bins, which is no larger than its number of pixels.
+
+Along each axis, the bin edges are the threshold values of interest. Every
+edge gets a bin of its own (holding the pixels exactly equal to it) between
+the open intervals on either side, so both strict and non-strict comparisons
+against an edge are counted exactly. A bound which is not an edge falls
+inside an open interval, and the count is then bracketed by a lower and an
+upper bound.
+
+RthSub and MaxSolZen are not axes. They are fixed when the cube is built,
+along with the active fire, QA and geographic window tests. Vectors with a
+different RthSub or MaxSolZen need a cube of their own.
+"""
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+import numpy as np
+import pandas as pd
+import itertools
+import os.path
+import sys
+
+axes = ['M07', 'M08', 'M10', 'M11', 'Ratio']
+
+# the vector parameters which are bounds on each axis
+axis_params = { 'M07'   : ['M07UB'],
+                'M08'   : ['M08LB', 'M08UB'],
+                'M10'   : ['M10LB', 'M10UB'],
+                'M11'   : ['M11LB'],
+                'Ratio' : ['RthLB', 'Rth'] }
+
+def cells(edges, values) :
+    """returns the bin of each value: 2i+1 if the value equals edges[i], 2i if
+    it lies between edges[i-1] and edges[i]."""
+    return (np.searchsorted(edges, values, 'left') +
+            np.searchsorted(edges, values, 'right'))
+
+def below(edges, bound) :
+    """(inner, outer) end of the range of bins holding values < bound"""
+    bound = edges.dtype.type(bound)
+    l = np.searchsorted(edges, bound, 'left')
+    r = np.searchsorted(edges, bound, 'right')
+    return l + r, l + r + (l == r)
+
+def above(edges, bound, inclusive=False) :
+    """(inner, outer) start of the range of bins holding values > bound, or
+    values >= bound if inclusive"""
+    bound = edges.dtype.type(bound)
+    l = np.searchsorted(edges, bound, 'left')
+    r = np.searchsorted(edges, bound, 'right')
+    if inclusive :
+        return l + r + (l == r), l + r
+    return l + r + 1, l + r + 1 - (l == r)
+
+class ThresholdCube (object) :
+    """A histogram of pixels over the thresholded quantities, summed over
+    granules, and optionally kept per granule (ImageDate) as well."""
+
+    def __init__(self, edges, RthSub, MaxSolZen, per_granule=False) :
+        """edges is a dictionary holding the bin edges for each axis. If
+        per_granule, the bins of each granule are kept (sparsely) too."""
+        self.edges = {}
+        for a in axes :
+            self.edges[a] = np.unique(np.array(edges[a], dtype=np.float32))
+        self.RthSub    = RthSub
+        self.MaxSolZen = MaxSolZen
+        self.shape = tuple([ 2*len(self.edges[a])+1 for a in axes ])
+        self.per_granule = per_granule
+        self.hist = np.zeros(self.shape, dtype=np.int64)
+        self.dates = []
+        # ImageDate : (flat bin indices, counts)
+        self.granules = {}
+        self._prefix = None
+
+    @classmethod
+    def from_vectors(cls, vectors, extra_edges=None, per_granule=False) :
+        """creates an empty cube which counts every vector in vectors exactly.
+        The vectors must share RthSub and MaxSolZen. extra_edges optionally
+        maps axis names to additional edges, so that other vectors may be
+        counted exactly as well."""
+        if ((len(set([v.RthSub for v in vectors])) != 1) or
+            (len(set([v.MaxSolZen for v in vectors])) != 1)) :
+            raise ValueError("All vectors in a cube must have the same RthSub and MaxSolZen")
+        edges = {}
+        for a in axes :
+            edges[a] = [ getattr(v, p) for v in vectors for p in axis_params[a] ]
+            if (extra_edges is not None) and (a in extra_edges) :
+                edges[a].extend(extra_edges[a])
+        return cls(edges, vectors[0].RthSub, vectors[0].MaxSolZen, per_granule)
+
+    def add_granule(self, ImageDate, config, m07, m08, m10, m11, af, geo) :
+        """histograms the pixels of one granule. Only pixels inside the
+        geographic window of config, with good data in every band, not
+        flagged as fire, in daylight and with nonzero M11 are counted."""
+        keep = (af.get_non_fire() & geo.day_pixels(self.MaxSolZen) &
+                m07.qa & m08.qa & m10.qa & m11.qa)
+        geo.apply_window(config, keep)
+
+        M07 = m07.get_cor_refl()[keep]
+        M08 = m08.get_cor_refl()[keep]
+        M10 = m10.get_cor_refl()[keep]
+        M11 = m11.get_cor_refl()[keep]
+        nonzero = (M11 != 0)
+        values = { 'M07' : M07[nonzero], 'M08' : M08[nonzero],
+                   'M10' : M10[nonzero], 'M11' : M11[nonzero] }
+        values['Ratio'] = (values['M08']-self.RthSub)/values['M11']
+
+        idx = [ cells(self.edges[a], values[a]) for a in axes ]
+        flat, counts = np.unique(np.ravel_multi_index(idx, self.shape),
+                                 return_counts=True)
+        self.hist.flat[flat] += counts
+        self.dates.append(ImageDate)
+        if self.per_granule :
+            self.granules[ImageDate] = (flat, counts)
+        self._prefix = None
+
+    def get_prefix(self) :
+        """prefix sums of the histogram, with a leading zero plane on every
+        axis"""
+        if self._prefix is None :
+            prefix = np.zeros([n+1 for n in self.shape], dtype=np.int64)
+            prefix[(slice(1,None),)*len(axes)] = self.hist
+            for i in range(len(axes)) :
+                np.cumsum(prefix, axis=i, out=prefix)
+            self._prefix = prefix
+        return self._prefix
+
+    def box(self, vec) :
+        """returns the (inner, outer) boxes of bins, as lists of (start, stop)
+        per axis, holding the pixels which pass the bounds of vec."""
+        if (vec.RthSub != self.RthSub) or (vec.MaxSolZen != self.MaxSolZen) :
+            raise ValueError("Cube was built for RthSub={0}, MaxSolZen={1}".format(
+                                self.RthSub, self.MaxSolZen))
+        e = self.edges
+        bounds = { 'M07'   : ((0, 0), below(e['M07'], vec.M07UB)),
+                   'M08'   : (above(e['M08'], vec.M08LB), below(e['M08'], vec.M08UB)),
+                   'M10'   : (above(e['M10'], vec.M10LB), below(e['M10'], vec.M10UB)),
+                   'M11'   : (above(e['M11'], vec.M11LB), (self.shape[3], self.shape[3])),
+                   'Ratio' : (above(e['Ratio'], vec.RthLB, True), below(e['Ratio'], vec.Rth)) }
+        inner = [ (bounds[a][0][0], bounds[a][1][0]) for a in axes ]
+        outer = [ (bounds[a][0][1], bounds[a][1][1]) for a in axes ]
+        return inner, outer
+
+    def _sum(self, prefix, box) :
+        """sums the bins inside box by inclusion-exclusion on the prefix sums"""
+        if any([ start >= stop for start, stop in box ]) :
+            return 0
+        total = 0
+        for corner in itertools.product([0,1], repeat=len(axes)) :
+            idx = tuple([ box[i][c] for i, c in enumerate(corner) ])
+            sign = (-1) ** (len(axes) - sum(corner))
+            total += sign * prefix[idx]
+        return int(total)
+
+    def _sparse_sum(self, granule, box) :
+        """sums the bins of a sparse granule inside box"""
+        flat, counts = granule
+        idx = np.unravel_index(flat, self.shape)
+        inside = np.ones(len(flat), dtype=np.bool)
+        for i, (start, stop) in enumerate(box) :
+            inside &= (idx[i] >= start) & (idx[i] < stop)
+        return int(counts[inside].sum())
+
+    def count(self, vec, ImageDate=None) :
+        """returns (lower, upper) bounds on the number of burned area pixels
+        which vec would produce in the granule for ImageDate, or in all the
+        granules if ImageDate is None. The bounds are equal when every
+        threshold in vec is an edge of the cube. Counts for one granule need
+        a cube kept per_granule."""
+        inner, outer = self.box(vec)
+        if ImageDate is None :
+            prefix = self.get_prefix()
+            return self._sum(prefix, inner), self._sum(prefix, outer)
+        if not self.per_granule :
+            raise ValueError("Cube does not keep per granule counts")
+        granule = self.granules[ImageDate]
+        return self._sparse_sum(granule, inner), self._sparse_sum(granule, outer)
+
+    def save(self, filename) :
+        arrays = { 'RthSub' : self.RthSub, 'MaxSolZen' : self.MaxSolZen,
+                   'per_granule' : self.per_granule, 'hist' : self.hist,
+                   'dates' : np.array(self.dates) }
+        for a in axes :
+            arrays['edges_' + a] = self.edges[a]
+        for d, (flat, counts) in self.granules.items() :
+            arrays['bins_' + d] = flat
+            arrays['counts_' + d] = counts
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename) :
+        f = np.load(filename)
+        edges = dict([ (a, f['edges_' + a]) for a in axes ])
+        cube = cls(edges, float(f['RthSub']), float(f['MaxSolZen']),
+                   bool(f['per_granule']))
+        cube.hist = f['hist']
+        cube.dates = [ str(d) for d in f['dates'] ]
+        if cube.per_granule :
+            for d in cube.dates :
+                cube.granules[d] = (f['bins_' + d], f['counts_' + d])
+        return cube
+
+def build(template, vectors, extra_edges=None, per_granule=False) :
+    """reads every granule of the template configuration into a new cube
+    which counts the vectors exactly"""
+    cube = ThresholdCube.from_vectors(vectors, extra_edges, per_granule)
+    for ImageDate in template.SortedImageDates :
+        print "Histogramming", ImageDate
+        fileset = vt.FileSet.from_imagedate(ImageDate)
+        files = fileset.get_file_names(template.BaseDir)
+        granule = vt.load_750(template, files)
+        if granule is None :
+            continue
+        m07, m08, m10, m11, af_750, geo_750 = granule
+        cube.add_granule(ImageDate, template, m07, m08, m10, m11, af_750, geo_750)
+    return cube
+
+def screen(cube, configs) :
+    """tabulates the predicted burned area pixel counts of each configuration,
+    in total and, if the cube keeps them, per granule"""
+    table = { 'run_id' : [ c.run_id for c in configs ] }
+    vectors = [ c.get_vector() for c in configs ]
+    counts = [ cube.count(v) for v in vectors ]
+    table['ba_lower'] = [ c[0] for c in counts ]
+    table['ba_upper'] = [ c[1] for c in counts ]
+    for d in sorted(cube.granules.keys()) :
+        table[d] = [ cube.count(v, d)[1] for v in vectors ]
+    return pd.DataFrame(table)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print "\nMissing argrument"
+        print "\nEnter the template ini file, the parameter table (csv) and the"
+        print "cube file as arguments. The cube is built if it does not exist. Add"
+        print "'granules' to keep (and report) counts for each granule as well."
+        print "e.g., viirs_hist.py VIIRS_threshold.ini runs.csv cube.npz granules\n"
+        sys.exit()
+
+    template_ini = vc.VIIRSConfig.load(sys.argv[1])
+    table = pd.read_csv(sys.argv[2])
+    p = vc.VIIRSConfig.batch(template_ini, table)
+
+    if os.path.exists(sys.argv[3]) :
+        cube = ThresholdCube.load(sys.argv[3])
+    else :
+        per_granule = (len(sys.argv) > 4 and sys.argv[4] == 'granules')
+        cube = build(template_ini, [c.get_vector() for c in p], per_granule=per_granule)
+        cube.save(sys.argv[3])
+
+    screen_file = "{0}_screen.csv".format(template_ini.DBname)
+    print "Saving predicted pixel counts to {0}.".format(screen_file)
+    screen(cube, p).to_csv(screen_file)
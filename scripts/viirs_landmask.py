@@ -0,0 +1,186 @@
+"""Looks up the burn mask (e.g., landmask.noburn) in memory.
+
+The SQL functions viirs_mask_points and viirs_collection_mask_points flag a
+point as masked when it lies within half a pixel of the center of a mask
+pixel having the mask value (the multipoint geometry made by
+viirs_get_mask_pts). Those discs do not overlap, so only the pixels whose
+centers surround the point need to be checked.
+
+Landmask.export() copies the mask raster out of the database once, into a
+directory holding a memory mapped array (mask.npy) and its geotransform
+(geotransform.csv). Landmask.load() opens the directory again; the pages
+of the mask are only read as points fall on them. geotransform.csv also
+records the mask table and the geographic window the copy was made from,
+and covers() checks them against a configuration, so that a copy of
+another table, or of too small a window, is not used by mistake.
+"""
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_proj
+import numpy as np
+import pandas as pd
+import cStringIO
+import os.path
+
+def source(config) :
+    """the mask table and geographic window (north, south, east, west, or
+    empty for the whole table) a configuration's copy is made from.
+    Values are strings, as saved in geotransform.csv."""
+    settings = { 'table' : '{0}.{1}'.format(config.BMschema, config.BMtable),
+                 'window' : '' }
+    if config.has_window() :
+        settings['window'] = ','.join([ str(float(v)) for v in
+                    [config.north, config.south, config.east, config.west] ])
+    return settings
+
+def same_source(stored, wanted) :
+    """true if a copy made from the stored source can serve the wanted
+    one: the same table, and a window holding the wanted one (a copy of the
+    whole table holds any window)"""
+    if stored['table'] != wanted['table'] :
+        return False
+    if stored['window'] == '' :
+        return True
+    if wanted['window'] == '' :
+        return False
+    north, south, east, west = [ float(v) for v in stored['window'].split(',') ]
+    n, s, e, w = [ float(v) for v in wanted['window'].split(',') ]
+    return north >= n and south <= s and east >= e and west <= w
+
+def covers(path, config) :
+    """true if path holds a copy of the mask which serves config"""
+    gt_file = os.path.join(path, 'geotransform.csv')
+    if not (os.path.exists(gt_file) and os.path.exists(os.path.join(path, 'mask.npy'))) :
+        return False
+    gt = pd.read_csv(gt_file, dtype=str, keep_default_na=False).iloc[0]
+    if 'table' not in gt or 'window' not in gt :
+        return False
+    return same_source({ 'table' : gt['table'], 'window' : gt['window'] }, source(config))
+
+class Landmask (object) :
+    """a mask raster, as a boolean array (True where the pixel is masked)
+    and the geotransform of its upper left corner"""
+
+    def __init__(self, mask, ulx, uly, scale_x, scale_y, srid) :
+        self.mask = mask
+        self.ulx = ulx
+        self.uly = uly
+        self.scale_x = scale_x
+        self.scale_y = scale_y
+        self.srid = srid
+        # the SQL compares distances with scale_x/2 as a real
+        self.radius = float(np.float32(scale_x / 2.))
+
+    @classmethod
+    def load(cls, path, config=None) :
+        """opens the copy in path. If config is given, raises ValueError
+        unless the copy serves it (see covers())."""
+        if (config is not None) and not covers(path, config) :
+            raise ValueError("{0} does not hold {1} over the run's window".format(
+                        path, source(config)['table']))
+        gt = pd.read_csv(os.path.join(path, 'geotransform.csv')).iloc[0]
+        mask = np.load(os.path.join(path, 'mask.npy'), mmap_mode='r')
+        return cls(mask, float(gt['ulx']), float(gt['uly']), float(gt['scale_x']),
+                   float(gt['scale_y']), int(gt['srid']))
+
+    @classmethod
+    def export(cls, config, path, mask_val=1) :
+        """copies the raster named by config.BMschema and config.BMtable into
+        path, and returns it. If config has a geographic window, only the
+        tiles touching it are copied. All tiles must share one grid."""
+        table = '"{0}"."{1}"'.format(config.BMschema, config.BMtable)
+        where = ''
+        if config.has_window() :
+            where = ("WHERE ST_Intersects(rast, ST_Transform(ST_Segmentize(" +
+                     "ST_MakeEnvelope({0},{1},{2},{3},{4}), 0.1), ST_SRID(rast)))").format(
+                        config.west, config.south, config.east, config.north,
+                        vt.srids['WGS84'])
+
+        tiles = vt.fetch_query(config,
+            "SELECT ST_UpperLeftX(rast), ST_UpperLeftY(rast), ST_Width(rast), " +
+            "ST_Height(rast), ST_ScaleX(rast), ST_ScaleY(rast), ST_SRID(rast) " +
+            "FROM {0} {1}".format(table, where))
+        if len(tiles) == 0 :
+            raise ValueError("No tiles of {0} cover the run".format(table))
+        scale_x, scale_y, srid = tiles[0][4], tiles[0][5], tiles[0][6]
+        if srid not in viirs_proj.projections :
+            raise ValueError("No projection for srid {0} in viirs_proj".format(srid))
+        ulx = min([ t[0] for t in tiles ])
+        uly = max([ t[1] for t in tiles ])
+        cols = int(round((max([ t[0] + t[2]*scale_x for t in tiles ]) - ulx) / scale_x))
+        rows = int(round((min([ t[1] + t[3]*scale_y for t in tiles ]) - uly) / scale_y))
+
+        if not os.path.exists(path) :
+            os.makedirs(path)
+        # the copy is not usable until it is complete
+        if os.path.exists(os.path.join(path, 'geotransform.csv')) :
+            os.remove(os.path.join(path, 'geotransform.csv'))
+        # written aside and moved into place, so that copies already open
+        # keep their own file
+        mask_file = os.path.join(path, 'mask.npy')
+        mask = np.lib.format.open_memmap(mask_file + '.tmp', mode='w+',
+                                         dtype=np.bool, shape=(rows, cols))
+        with vt.session_cursor(config) as cur :
+            cur.execute("SELECT ST_UpperLeftX(rast), ST_UpperLeftY(rast), " +
+                        "ST_DumpValues(rast, 1) FROM {0} {1}".format(table, where))
+            for x, y, values in cur :
+                c = int(round((x - ulx) / scale_x))
+                r = int(round((y - uly) / scale_y))
+                tile = np.array(values, dtype=np.float64)
+                mask[r:r+tile.shape[0], c:c+tile.shape[1]] |= (tile == mask_val)
+        mask.flush()
+        del mask
+        os.rename(mask_file + '.tmp', mask_file)
+
+        gt = { 'ulx' : ulx, 'uly' : uly, 'scale_x' : scale_x,
+               'scale_y' : scale_y, 'srid' : srid }
+        gt.update(source(config))
+        pd.DataFrame([gt]).to_csv(
+                os.path.join(path, 'geotransform.csv'), index=False, float_format='%.17g')
+        return cls.load(path, config)
+
+    def lookup(self, x, y) :
+        """returns True where the points (x, y), in the projection of the
+        mask, are masked"""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        rows, cols = self.mask.shape
+        # pixel coordinates, relative to the centers
+        col = np.floor((x - self.ulx) / self.scale_x - 0.5).astype(np.int64)
+        row = np.floor((y - self.uly) / self.scale_y - 0.5).astype(np.int64)
+
+        masked = np.zeros(x.shape, dtype=np.bool)
+        for dr in [0, 1] :
+            for dc in [0, 1] :
+                r = row + dr
+                c = col + dc
+                inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+                cx = self.ulx + (c + 0.5) * self.scale_x
+                cy = self.uly + (r + 0.5) * self.scale_y
+                near = inside & (np.hypot(x - cx, y - cy) <= self.radius)
+                masked[near] |= self.mask[r[near], c[near]]
+        return masked
+
+    def lookup_lonlat(self, lon, lat) :
+        """returns True where the points (lon, lat) are masked"""
+        x, y = viirs_proj.projections[self.srid].forward(lon, lat)
+        return self.lookup(x, y)
+
+def mask_table(config, landmask, table) :
+    """sets the masked column of every point in table (active_fire or
+    threshold_burned), as viirs_mask_points does"""
+    rows = vt.fetch_query(config,
+        'SELECT fid, ST_X(geom), ST_Y(geom) FROM "{0}".{1}'.format(config.DBschema, table))
+    if len(rows) == 0 :
+        return
+    pts = np.array(rows, dtype=np.float64)
+    masked = landmask.lookup_lonlat(pts[:,1], pts[:,2])
+    buf = cStringIO.StringIO("".join([ "{0}\n".format(r[0])
+                              for r, m in zip(rows, masked) if m ]))
+    with vt.transaction(config) :
+        with vt.session_cursor(config) as cur :
+            cur.execute('UPDATE "{0}".{1} SET masked = FALSE WHERE masked'.format(config.DBschema, table))
+            cur.execute("DROP TABLE IF EXISTS pg_temp.masked_staging")
+            cur.execute("CREATE TEMPORARY TABLE masked_staging (fid bigint) ON COMMIT DROP")
+            cur.copy_expert("COPY masked_staging FROM STDIN", buf)
+            cur.execute(('UPDATE "{0}".{1} t SET masked = TRUE FROM masked_staging m ' +
+                         'WHERE t.fid = m.fid').format(config.DBschema, table))
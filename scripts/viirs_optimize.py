@@ -0,0 +1,331 @@
+"""Calibrates the parameter vector by minimizing 1 - IoU.
+
+viirs_brute and viirs_sweep evaluate a fixed grid of parameter vectors. Here
+a Nelder-Mead simplex walks over some of the parameters of ConfigVector
+instead, running each vector it visits (vt.run) and scoring it against a
+ground truth fire mask (viirs_fom.do_ioveru_fom). The cost of a vector is
+1 - IoU.
+
+The ini file keeps the float parameters to two decimals ('{:4.2f}'), so
+vectors are rounded to that precision (and the int parameters to whole
+numbers) before they are run. Every vector run is kept, with its figure of
+merit, in a memo: a csv file which survives between invocations. A vector
+already in the memo is never run again, whether the simplex revisits it,
+lands close enough to round onto it, or a later optimization passes by.
+A figure of merit only holds for the template's dates, window, inputs and
+ground truth, so the memo records a fingerprint of those, and refuses to
+serve a template or ground truth with a different one.
+
+Runs are numbered from a starting run_id given by the caller, and a run
+whose schema or output directory already exists is refused rather than
+overwritten.
+
+With more than one worker, each step of the simplex runs its candidate
+points (reflection, expansion and both contractions) at once, and then
+takes the step a sequential Nelder-Mead would have taken. The points it
+turns out not to need stay in the memo.
+"""
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_fom as vf
+import multiprocessing as mp
+import pandas as pd
+import numpy as np
+import hashlib
+import os.path
+import sys
+
+# initial simplex step for each parameter, in the parameter's units
+default_steps = { 'M07UB' : 0.02, 'M08LB' : 0.02, 'M08UB' : 0.02,
+                  'M10LB' : 0.02, 'M10UB' : 0.02, 'M11LB' : 0.02,
+                  'RthSub' : 0.02, 'Rth' : 0.02, 'RthLB' : 0.02,
+                  'MaxSolZen' : 2.0,
+                  'TemporalProximity' : 2, 'SpatialProximity' : 500 }
+
+def rounded(vec) :
+    """rounds vec to the precision with which it is saved in an ini file"""
+    newvals = {}
+    for p in vc.float_vector_params :
+        newvals[p] = float('{:4.2f}'.format(getattr(vec, p)))
+    for p in vc.int_vector_params :
+        newvals[p] = int(round(getattr(vec, p)))
+    return vec._replace(**newvals)
+
+def memo_key(vec) :
+    return tuple(rounded(vec))
+
+def fingerprint(template, gt_schema, gt_table) :
+    """summarizes everything apart from the vector which a figure of merit
+    depends on: the dates, inputs and window of template, and the ground
+    truth it is scored against"""
+    fixed = [ ('BaseDir', template.BaseDir),
+              ('ImageDates', sorted(template.ImageDates)),
+              ('use375af', template.use375af),
+              ('use750af', template.use750af),
+              ('gt', (gt_schema, gt_table)) ]
+    for name in ['limit375', 'north', 'south', 'east', 'west',
+                 'BMschema', 'BMtable', 'AFOnly'] :
+        if hasattr(template, name) :
+            fixed.append( (name, getattr(template, name)) )
+    return hashlib.md5(repr(fixed)).hexdigest()
+
+
+class Memo (object) :
+    """the figure of merit of every vector run, kept in a csv file with
+    a run_id column, one column per vector parameter, a fom column and the
+    fingerprint (see fingerprint()) of the runs. New runs are numbered from
+    first_run, or after the last run in the file."""
+    columns = ['run_id'] + vc.vector_param_names + ['fom', 'fingerprint']
+
+    def __init__(self, filename, fingerprint, first_run) :
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.fom = {}
+        self.next_run = first_run
+        if os.path.exists(filename) :
+            table = pd.read_csv(filename, dtype={'fingerprint' : str})
+            for i_row in range(table.shape[0]) :
+                row = table.iloc[i_row, :]
+                if row.get('fingerprint') != fingerprint :
+                    raise ValueError("{0} holds runs of a different template or ground truth".format(filename))
+                vec = vc.ConfigVector(**dict([ (p, row[p]) for p in vc.vector_param_names ]))
+                self.fom[memo_key(vec)] = float(row['fom'])
+                self.next_run = max(self.next_run, int(row['run_id']) + 1)
+
+    def __contains__(self, vec) :
+        return memo_key(vec) in self.fom
+
+    def get(self, vec) :
+        return self.fom[memo_key(vec)]
+
+    def new_run_id(self) :
+        run_id = self.next_run
+        self.next_run += 1
+        return run_id
+
+    def put(self, vec, run_id, fom) :
+        """records the figure of merit of vec, appending it to the file"""
+        vec = rounded(vec)
+        self.fom[memo_key(vec)] = fom
+        row = dict(vec._asdict())
+        row['run_id'] = run_id
+        row['fom'] = fom
+        row['fingerprint'] = self.fingerprint
+        new_file = not os.path.exists(self.filename)
+        pd.DataFrame([row]).to_csv(self.filename, mode='a', header=new_file,
+                                   index=False, columns=self.columns)
+
+
+def run_and_score(args) :
+    """pool worker: runs one configuration and returns its run_id and
+    intersection over union figure of merit. If the configuration covers
+    only a fraction (< 1) of the season, the figure of merit is scaled to
+    match (see viirs_fom.scaled_ioveru)."""
+    gt_schema, gt_table, config, fraction = args
+    vt.run(config)
+    if fraction >= 1. :
+        return config.run_id, vf.do_ioveru_fom(gt_schema, gt_table, config)
+    counts = vf.do_ioveru_counts(gt_schema, gt_table, config)
+    return config.run_id, vf.scaled_ioveru(*(counts + (fraction,)))
+
+def check_new_run(config) :
+    """raises ValueError if config's output directory, schema or stored run
+    already exists, as vt.run would overwrite it"""
+    if os.path.exists(config.ShapePath) :
+        raise ValueError("Directory {0} already exists".format(config.ShapePath))
+    rows = vt.fetch_query(config,
+        "SELECT 1 FROM pg_namespace WHERE nspname = '{0}'".format(config.DBschema))
+    if len(rows) > 0 :
+        raise ValueError("Schema {0} already exists".format(config.DBschema))
+    if config.has_run_store() :
+        rows = vt.fetch_query(config,
+            'SELECT 1 FROM "{0}".runs WHERE run_id = {1}'.format(config.RunStore, config.run_id))
+        if len(rows) > 0 :
+            raise ValueError("Run {0} is already in {1}".format(config.run_id, config.RunStore))
+
+class FomEvaluator (object) :
+    """runs and scores lists of (run_id, vector) pairs, merging each vector
+    into the template. fraction is the part of the season which the
+    template's dates cover (see run_and_score)."""
+    def __init__(self, template, gt_schema, gt_table, workers=1, fraction=1.) :
+        self.template = template
+        self.gt_schema = gt_schema
+        self.gt_table = gt_table
+        self.workers = workers
+        self.fraction = fraction
+        # the ground truth centroids and run store are shared by all the runs
+        vf.extract_fire_mask(template, gt_schema, gt_table)
+        vt.init_run_store(template)
+
+    def __call__(self, runs) :
+        work = []
+        for run_id, vec in runs :
+            cfg = vc.VIIRSConfig.merge_into_template(vec, self.template, runid=run_id)
+            check_new_run(cfg)
+            os.makedirs(cfg.ShapePath)
+            cfg.save(os.path.join(cfg.ShapePath, '{0}.ini'.format(cfg.DBschema)))
+            work.append( (self.gt_schema, self.gt_table, cfg, self.fraction) )
+
+        if self.workers > 1 and len(work) > 1 :
+            pool = mp.Pool(processes=min(self.workers, len(work)))
+            try :
+                results = pool.map(run_and_score, work)
+                pool.close()
+            except :
+                pool.terminate()
+                raise
+            finally :
+                pool.join()
+        else :
+            results = map(run_and_score, work)
+        return dict(results)
+
+
+class NelderMead (object) :
+    """minimizes 1 - fom over the parameters names of a reference vector.
+
+    evaluate is called with a list of (run_id, vector) pairs, none of them in
+    the memo, and returns a dictionary of figures of merit by run_id (see
+    FomEvaluator). At most max_evals vectors are evaluated (memo hits are
+    free)."""
+    def __init__(self, reference, names, memo, evaluate,
+                 steps=None, workers=1, max_evals=40) :
+        self.reference = reference
+        self.names = list(names)
+        self.memo = memo
+        self.evaluate = evaluate
+        if steps is None :
+            steps = default_steps
+        self.steps = np.array([ steps[n] for n in self.names ], dtype=np.float)
+        self.workers = workers
+        self.max_evals = max_evals
+        self.evaluations = 0
+
+    def vector(self, x) :
+        return rounded(self.reference._replace(**dict(zip(self.names, x))))
+
+    def exhausted(self) :
+        return self.evaluations >= self.max_evals
+
+    def prefetch(self, points) :
+        """evaluates the points which are not already in the memo, as one
+        batch, within what is left of the budget"""
+        pending = {}
+        for x in points :
+            vec = self.vector(x)
+            if vec not in self.memo :
+                pending[memo_key(vec)] = vec
+        pending = pending.values()[:self.max_evals - self.evaluations]
+        if len(pending) == 0 :
+            return
+        runs = [ (self.memo.new_run_id(), vec) for vec in pending ]
+        fom = self.evaluate(runs)
+        for run_id, vec in runs :
+            self.memo.put(vec, run_id, fom[run_id])
+        self.evaluations += len(runs)
+
+    def cost(self, x) :
+        """1 - fom of the point x, or None if the budget is spent"""
+        self.prefetch([x])
+        vec = self.vector(x)
+        if vec not in self.memo :
+            return None
+        return 1. - self.memo.get(vec)
+
+    def minimize(self, tolerance=1e-4) :
+        """walks the simplex until it collapses onto one rounded vector, its
+        costs agree to within tolerance, or the budget is spent. Returns the
+        best vector and its figure of merit."""
+        x0 = np.array([ getattr(self.reference, n) for n in self.names ], dtype=np.float)
+        simplex = [ x0 ] + [ x0 + self.steps * e for e in np.eye(len(self.names)) ]
+        self.prefetch(simplex)
+        f = [ self.cost(x) for x in simplex ]
+        if None in f :
+            raise ValueError("Budget too small for the initial simplex")
+
+        while not self.exhausted() :
+            order = np.argsort(f)
+            simplex = [ simplex[i] for i in order ]
+            f = [ f[i] for i in order ]
+            if (f[-1] - f[0] <= tolerance or
+                len(set([ memo_key(self.vector(x)) for x in simplex ])) == 1) :
+                break
+
+            centroid = np.mean(simplex[:-1], axis=0)
+            direction = centroid - simplex[-1]
+            xr = centroid + direction
+            xe = centroid + 2 * direction
+            xoc = centroid + 0.5 * direction
+            xic = centroid - 0.5 * direction
+            if self.workers > 1 :
+                self.prefetch([xr, xe, xoc, xic][:self.workers])
+
+            fr = self.cost(xr)
+            if fr is None :
+                break
+            new = None
+            if fr < f[0] :
+                fe = self.cost(xe)
+                if fe is not None and fe < fr :
+                    new = (xe, fe)
+                else :
+                    new = (xr, fr)
+            elif fr < f[-2] :
+                new = (xr, fr)
+            elif fr < f[-1] :
+                foc = self.cost(xoc)
+                if foc is not None and foc <= fr :
+                    new = (xoc, foc)
+            else :
+                fic = self.cost(xic)
+                if fic is not None and fic < f[-1] :
+                    new = (xic, fic)
+
+            if new is not None :
+                simplex[-1], f[-1] = new
+                continue
+
+            # shrink towards the best point
+            shrunk = [ simplex[0] + 0.5 * (x - simplex[0]) for x in simplex[1:] ]
+            self.prefetch(shrunk)
+            costs = [ self.cost(x) for x in shrunk ]
+            if None in costs :
+                break
+            simplex[1:] = shrunk
+            f[1:] = costs
+
+        best = int(np.argmin(f))
+        return self.vector(simplex[best]), 1. - f[best]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 7:
+        print "\nMissing argrument"
+        print "\nEnter the template ini file, the memo file (csv), the ground truth schema"
+        print "and table, a comma separated list of the parameters to optimize, and the"
+        print "run_id of the first run (runs which already exist are not overwritten)."
+        print "Optionally, the number of parallel workers (default 1) and the largest"
+        print "number of runs (default 40) may follow."
+        print "e.g., viirs_optimize.py VIIRS_threshold.ini memo.csv gt mask Rth,RthSub,M11LB 500 4 40\n"
+        sys.exit()
+
+    template = vc.VIIRSConfig.load(sys.argv[1])
+    gt_schema = sys.argv[3]
+    gt_table = sys.argv[4]
+    memo = Memo(sys.argv[2], fingerprint(template, gt_schema, gt_table), int(sys.argv[6]))
+    names = sys.argv[5].split(',')
+    workers = 1
+    if len(sys.argv) > 7 :
+        workers = int(sys.argv[7])
+    max_evals = 40
+    if len(sys.argv) > 8 :
+        max_evals = int(sys.argv[8])
+
+    evaluate = FomEvaluator(template, gt_schema, gt_table, workers)
+    opt = NelderMead(template.get_vector(), names, memo, evaluate,
+                     workers=workers, max_evals=max_evals)
+    best, fom = opt.minimize()
+    print "Ran {0} configurations.".format(opt.evaluations)
+    print "Best figure of merit: {0}".format(fom)
+    for n in names :
+        print "    {0} = {1}".format(n, getattr(best, n))
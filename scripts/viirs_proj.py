@@ -0,0 +1,67 @@
+"""Map projections used by the VIIRS BA code, in numpy.
+
+PostGIS projects points with ST_Transform() using the definitions in
+SqlFunctions/insert_102008.sql. The same projections are implemented here
+so that points can be projected in Python without a trip to the database.
+Both are Albers equal area conics on the GRS80 ellipsoid, so one 
+implementation serves for both.
+
+Latitude and longitude are taken to be NAD83, as they are by PostGIS built
+against PROJ 4, where NAD83 is identical to WGS84 (towgs84=0,0,0). The 
+results then agree with PROJ to well under a millimeter. Newer PROJ 
+versions may apply a WGS84 to NAD83 datum shift of up to about a meter.
+"""
+import numpy as np
+
+class AlbersEqualArea (object) :
+    """Ellipsoidal Albers equal area conic projection, following Snyder (1987),
+    "Map Projections: A Working Manual", USGS Professional Paper 1395,
+    pp. 98-103."""
+
+    def __init__(self, lat_1, lat_2, lat_0, lon_0,
+                 a=6378137.0, rf=298.257222101, x_0=0., y_0=0.) :
+        self.a = a
+        f = 1./rf
+        self.es = 2*f - f*f
+        self.e  = np.sqrt(self.es)
+        self.lon_0 = np.radians(lon_0)
+        self.x_0 = x_0
+        self.y_0 = y_0
+
+        m1 = self._m(np.radians(lat_1))
+        m2 = self._m(np.radians(lat_2))
+        q0 = self._q(np.radians(lat_0))
+        q1 = self._q(np.radians(lat_1))
+        q2 = self._q(np.radians(lat_2))
+        if lat_1 == lat_2 :
+            self.n = np.sin(np.radians(lat_1))
+        else :
+            self.n = (m1*m1 - m2*m2) / (q2 - q1)
+        self.C = m1*m1 + self.n*q1
+        self.rho_0 = self.a * np.sqrt(self.C - self.n*q0) / self.n
+
+    def _m(self, phi) :
+        sinphi = np.sin(phi)
+        return np.cos(phi) / np.sqrt(1. - self.es*sinphi*sinphi)
+
+    def _q(self, phi) :
+        sinphi = np.sin(phi)
+        esin = self.e*sinphi
+        return (1. - self.es) * (sinphi / (1. - esin*esin) -
+                    (1. / (2*self.e)) * np.log((1. - esin) / (1. + esin)))
+
+    def forward(self, lon, lat) :
+        """projects longitude and latitude (degrees, scalars or arrays) and
+        returns (x, y) in meters"""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        rho = self.a * np.sqrt(self.C - self.n*self._q(np.radians(lat))) / self.n
+        theta = self.n * (np.radians(lon) - self.lon_0)
+        return (self.x_0 + rho*np.sin(theta),
+                self.y_0 + self.rho_0 - rho*np.cos(theta))
+
+# the projections, by srid (see VIIRS_threshold_reflCor_Bulk.srids)
+projections = {
+    102008 : AlbersEqualArea(20., 60., 40., -96.),
+    96630  : AlbersEqualArea(29.5, 45.5, 23., -96.)
+}
@@ -0,0 +1,113 @@
+"""Confirmed burned area for any proximity setting, from one confirmed run.
+
+viirs_threshold_proximity tabulates, for each threshold point of a run, how
+close the eligible active fire events came in space (meters) and in time
+(the gap between the point's date and the last update of the event's
+collection). Whether the point is confirmed under some SpatialProximity D
+and TemporalProximity T is then a filter on that table.
+
+The active fire history (fire events and collections) is taken as fixed: it
+is that of the run the table was built from. For the run's own proximity
+settings the filter gives the same points as viirs_threshold_2_fireevents,
+which validate() checks. For other settings it answers "what if threshold
+points were confirmed with D and T against these collections", which is
+what a calibration sweep over the confirmation step varies.
+"""
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+import pandas as pd
+import sys
+
+def build(config, max_distance, max_days) :
+    """creates threshold_proximity in the run's schema, covering distances
+    up to max_distance meters and gaps up to max_days days"""
+    vt.execute_query(config,
+        "SELECT viirs_threshold_proximity('{0}', {1}, '{2} days')".format(
+            config.DBschema, int(max_distance), int(max_days)))
+
+def _where(distance, days, dates=None) :
+    where = "distance <= {0} AND gap <= interval '{1} days'".format(
+                float(distance), int(days))
+    if dates is not None :
+        where += " AND collection_date IN ({0})".format(
+                    ','.join([ "'{0}'".format(d) for d in dates ]))
+    return where
+
+def confirmed(config, distance, days, dates=None) :
+    """returns the set of threshold_burned fids confirmed with the given
+    proximity, optionally only those with collection dates in dates"""
+    rows = vt.fetch_query(config,
+        'SELECT DISTINCT fid FROM "{0}".threshold_proximity WHERE {1}'.format(
+            config.DBschema, _where(distance, days, dates)))
+    return set([ r[0] for r in rows ])
+
+def counts(config, settings) :
+    """tabulates the number of confirmed points for each (distance, days)
+    pair in settings"""
+    table = { 'SpatialProximity' : [], 'TemporalProximity' : [], 'confirmed' : [] }
+    for distance, days in settings :
+        rows = vt.fetch_query(config,
+            'SELECT count(DISTINCT fid) FROM "{0}".threshold_proximity WHERE {1}'.format(
+                config.DBschema, _where(distance, days)))
+        table['SpatialProximity'].append(distance)
+        table['TemporalProximity'].append(days)
+        table['confirmed'].append(rows[0][0])
+    return pd.DataFrame(table)
+
+def validate(config, dates) :
+    """compares the points confirmed by the table at the run's own proximity
+    settings with those viirs_threshold_2_fireevents confirmed, on the given
+    collection dates (SQL format). Returns (missing, extra): fids confirmed
+    only by the SQL function, and fids confirmed only by the table."""
+    rows = vt.fetch_query(config,
+        'SELECT fid FROM "{0}".threshold_burned WHERE confirmed_burn AND collection_date IN ({1})'.format(
+            config.DBschema, ','.join([ "'{0}'".format(d) for d in dates ])))
+    expected = set([ r[0] for r in rows ])
+    found = confirmed(config, config.SpatialProximity, config.TemporalProximity, dates)
+    return expected - found, found - expected
+
+def frontier(pairs) :
+    """the rows of pairs (fid, distance, gap) which no other row of the
+    same fid beats on both counts, as viirs_threshold_proximity keeps them.
+    Walking each fid's rows from the smallest gap up, a row is kept when it
+    is nearer than every row before it."""
+    pairs = pairs.sort_values(['fid', 'gap', 'distance'], kind='mergesort')
+    best = pairs.groupby('fid')['distance'].cummin()
+    before = best.groupby(pairs['fid']).shift(1)
+    return pairs[before.isnull() | (pairs['distance'] < before)]
+
+def check_frontier(config) :
+    """the number of rows of threshold_proximity which are not on their
+    point's frontier (should be 0)"""
+    rows = vt.fetch_query(config,
+        'SELECT fid, distance, extract(epoch from gap) FROM "{0}".threshold_proximity'.format(
+            config.DBschema))
+    table = pd.DataFrame(rows, columns=['fid', 'distance', 'gap'])
+    return len(table) - len(frontier(table))
+
+def sample_dates(config, count) :
+    """count collection dates spread evenly over the run, in SQL format"""
+    dates = config.SortedImageDates
+    step = max(1, len(dates) // count)
+    return [ vt.FileSet.from_imagedate(d).get_sql_date() for d in dates[::step][:count] ]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print "\nMissing argrument"
+        print "\nEnter the ini file of a confirmed run, the largest distance (m) and"
+        print "the largest time gap (days) to tabulate, and optionally the number of"
+        print "dates to validate against the confirmed run (default 5)."
+        print "e.g., viirs_proximity.py VIIRS_threshold.ini 10000 20 5\n"
+        sys.exit()
+
+    config = vc.VIIRSConfig.load(sys.argv[1])
+    build(config, int(sys.argv[2]), int(sys.argv[3]))
+
+    count = 5
+    if len(sys.argv) > 4 :
+        count = int(sys.argv[4])
+    missing, extra = validate(config, sample_dates(config, count))
+    print "Validated against the confirmed run: {0} missing, {1} extra".format(
+                len(missing), len(extra))
+    print "Rows off the frontier: {0}".format(check_frontier(config))
@@ -0,0 +1,205 @@
+"""Confirms a whole run in parallel, one region at a time.
+
+Every step of confirmation relates two points no further apart than
+SpatialProximity: an active fire point joins the collection of an event
+within that distance, points within it form clusters, and a threshold point
+is confirmed by an active fire event within it. So if the season's active
+fire and threshold points are split into regions, where points of different
+regions are never that close, the regions never affect each other. Each
+region can be confirmed on its own, over the whole season.
+
+The regions are the connected components of the points, linked when they
+are within reach (SpatialProximity, plus half a cell diagonal for the raster
+engine) of each other and at least one of them is an active fire point.
+Threshold points are only ever confirmed by active fire events, so two
+threshold points never affect each other: a threshold point belongs to the
+region of the active fire points within its reach, and a threshold point
+with none is a region of its own. Unlike square tiles with a halo, they need no
+reconciling across tile borders afterwards. The components are dealt out to
+a pool of workers, balanced by point count. Each worker runs an in-memory
+engine (see viirs_confirm) over the dates of its regions.
+
+The results are then numbered as one engine would have numbered them.
+Collections are made in order of their first date, then the fid of the
+point which started them. Events are added in date order, active fire
+points before threshold points, each in fid order. Renumbering in those
+orders gives the same fire events and collections as confirming the run in
+one piece.
+"""
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_confirm as vcf
+import multiprocessing as mp
+import numpy as np
+import datetime
+
+def fetch_season(config, table) :
+    """reads the unmasked points of the whole run from table, as
+    viirs_confirm.points() plus their collection dates ('date')"""
+    rows = vt.fetch_query(config,
+        "SELECT fid, ST_X(geom), ST_Y(geom), " +
+        "ST_X(COALESCE(geom_albers, ST_Transform(geom, {0}))), ".format(vt.srids['Albers']) +
+        "ST_Y(COALESCE(geom_albers, ST_Transform(geom, {0}))), ".format(vt.srids['Albers']) +
+        "latitude, longitude, pixel_size, band_i_m, collection_date " +
+        "FROM \"{0}\".{1} WHERE NOT masked ORDER BY fid".format(config.DBschema, table))
+    pts = vcf.points([ r[:9] for r in rows ])
+    pts['date'] = np.array([ r[9] for r in rows ], dtype=object)
+    return pts
+
+def components(x, y, reach, is_af=None) :
+    """labels the connected components of the points (x, y), where points
+    within reach of each other are connected if at least one of them is an
+    active fire point (is_af, default all). Labels are 0..n-1."""
+    if is_af is None :
+        is_af = np.ones(len(x), dtype=np.bool)
+    # all points of a cell are within reach of each other, so the active
+    # fire points of a cell are joined whole, and points within reach are at
+    # most two cells apart
+    size = reach / np.sqrt(2.)
+    cx = np.floor(x / size).astype(np.int64)
+    cy = np.floor(y / size).astype(np.int64)
+    cells = {}
+    for i in np.nonzero(is_af)[0] :
+        cells.setdefault((cx[i], cy[i]), []).append(i)
+    keys = cells.keys()
+    index = dict([ (k, c) for c, k in enumerate(keys) ])
+    members = [ np.array(cells[k]) for k in keys ]
+    near = lambda a, b : (np.hypot(x[a][:,np.newaxis] - x[b][np.newaxis,:],
+                                   y[a][:,np.newaxis] - y[b][np.newaxis,:]) <= reach)
+
+    # nodes are the active fire cells, then the threshold points
+    others = np.nonzero(~is_af)[0]
+    parent = range(len(keys) + len(others))
+    for c, (i, j) in enumerate(keys) :
+        a = members[c]
+        for di in range(0, 3) :
+            for dj in range(-2, 3) :
+                if di == 0 and dj <= 0 :
+                    continue
+                other = index.get((i+di, j+dj))
+                if other is None or vcf._find(parent, c) == vcf._find(parent, other) :
+                    continue
+                if np.any(near(a, members[other])) :
+                    parent[vcf._find(parent, c)] = vcf._find(parent, other)
+
+    # threshold points join the active fire cells within their reach
+    tcells = {}
+    for k, i in enumerate(others) :
+        tcells.setdefault((cx[i], cy[i]), []).append(k)
+    for (i, j), ks in tcells.items() :
+        ks = np.array(ks)
+        for di in range(-2, 3) :
+            for dj in range(-2, 3) :
+                other = index.get((i+di, j+dj))
+                if other is None :
+                    continue
+                for k in ks[np.any(near(others[ks], members[other]), axis=1)] :
+                    node = len(keys) + k
+                    if vcf._find(parent, node) != vcf._find(parent, other) :
+                        parent[vcf._find(parent, node)] = vcf._find(parent, other)
+
+    roots = [ vcf._find(parent, c) for c in range(len(parent)) ]
+    labels = dict([ (r, l) for l, r in enumerate(sorted(set(roots))) ])
+    point_label = np.zeros(len(x), dtype=np.int64)
+    for c in range(len(keys)) :
+        point_label[members[c]] = labels[roots[c]]
+    for k, i in enumerate(others) :
+        point_label[i] = labels[roots[len(keys) + k]]
+    return point_label
+
+def assign(sizes, workers) :
+    """deals components (with the given point counts) out to at most
+    workers units, largest first, each to the unit with fewest points.
+    Returns a unit number for each component."""
+    units = min(workers, len(sizes))
+    load = [0] * units
+    unit = np.zeros(len(sizes), dtype=np.int64)
+    for c in np.argsort(sizes)[::-1] :
+        u = int(np.argmin(load))
+        unit[c] = u
+        load[u] += sizes[c]
+    return unit
+
+def _subset(pts, idx) :
+    return dict([ (k, v[idx]) for k, v in pts.items() ])
+
+def confirm_unit(args) :
+    """pool worker: confirms the active fire and threshold points of one
+    unit of regions over the season, ending with the run's last date.
+    Returns the unit's engine."""
+    config, af, tb, last = args
+    engine = vcf.engine_class(config).for_config(config)
+    for date in sorted(set(af['date']) | set(tb['date'])) :
+        engine.evict(date)
+        engine.active_fire(date, _subset(af, af['date'] == date))
+        engine.threshold(date, _subset(tb, tb['date'] == date))
+    engine.evict(last)
+    return engine
+
+def merge(config, engines) :
+    """numbers the collections and events of the units' engines as a single
+    engine would have, and returns that engine"""
+    merged = vcf.engine_class(config).for_config(config)
+    collections = []
+    for u, eng in enumerate(engines) :
+        for fc, c in enumerate(eng.collections) :
+            collections.append((c[0], c[2], u, fc+1, c[1]))
+    collections.sort()
+    fc_map = {}
+    for fid, (initial_date, initial_fid, u, fc, last_update) in enumerate(collections) :
+        fc_map[(u, fc)] = fid + 1
+        merged.collections.append([initial_date, last_update, initial_fid])
+
+    events = []
+    for u, eng in enumerate(engines) :
+        for e in eng.events :
+            rank = 0 if e['source'] == 'ActiveFire' else 1
+            events.append((e['collection_date'], rank, e['point_fid'], u, e))
+    events.sort(key=lambda k : k[:3])
+    for fid, (date, rank, point_fid, u, e) in enumerate(events) :
+        e = dict(e)
+        e['fid'] = fid + 1
+        e['collection_id'] = fc_map[(u, e['collection_id'])]
+        merged.events.append(e)
+
+    for u, eng in enumerate(engines) :
+        for fc in eng.active :
+            merged.active[fc_map[(u, fc)]] = []
+        merged.confirmed.extend(eng.confirmed)
+    merged.confirmed.sort()
+    return merged
+
+def confirm_run(config, workers) :
+    """confirms every date of the run in memory, splitting the points into
+    regions handled by a pool of workers. The points must already be masked.
+    Returns an engine holding the results, to be written with write()."""
+    af = fetch_season(config, 'active_fire')
+    tb = fetch_season(config, 'threshold_burned')
+    if len(config.SortedImageDates) == 0 :
+        return vcf.engine_class(config).for_config(config)
+    last = datetime.datetime.strptime(vt.FileSet.from_imagedate(
+                config.SortedImageDates[-1]).get_sql_date(), "%Y-%m-%d %H:%M:%S")
+
+    reach = vcf.engine_class(config).for_config(config).reach
+    n_af = len(af['fid'])
+    labels = components(np.concatenate([af['x'], tb['x']]),
+                        np.concatenate([af['y'], tb['y']]), reach,
+                        np.arange(n_af + len(tb['fid'])) < n_af)
+    sizes = np.bincount(labels, minlength=1)
+    unit = assign(sizes, workers)[labels]
+    print "{0} regions in {1} units".format(len(sizes), len(set(unit)))
+
+    work = [ (config, _subset(af, unit[:n_af] == u), _subset(tb, unit[n_af:] == u), last)
+             for u in sorted(set(unit)) ]
+    if workers > 1 and len(work) > 1 :
+        pool = mp.Pool(processes=min(workers, len(work)))
+        try :
+            engines = pool.map(confirm_unit, work)
+            pool.close()
+        except :
+            pool.terminate()
+            raise
+        finally :
+            pool.join()
+    else :
+        engines = [ confirm_unit(w) for w in work ]
+    return merge(config, engines)
@@ -17,11 +17,22 @@ data from tables having the same name in a specified master schema.
 
 Upon completion, the database and directories are ready for the confirmation code
 to run.
+
+In bulk mode, the run tables are made UNLOGGED and without their keys and 
+indexes, the runs are copied concurrently by a pool of workers, each over its
+own connection, and each run's keys and indexes are built (and its tables 
+analyzed) once its data are in. The time taken by each run is reported.
+
+In link mode, nothing is copied. Each run reads the master tables through 
+views, and keeps only the points whose masked, event_fid or confirmed_burn 
+values it changes, in small side tables (see SqlFunctions/viirs_link_master.sql).
 """
 import viirs_config as vc
 import VIIRS_threshold_reflCor_Bulk as vt
+import multiprocessing as mp
 import pandas as pd
 import shutil
+import time
 import os
 import os.path
 import sys
@@ -42,33 +53,94 @@ def init_directories(configs) :
         cfg_fname = os.path.join(cfg.ShapePath, 'config.ini')
         cfg.save(cfg_fname)
 
-def init_schemas(configs) : 
+def init_schemas(configs, bulk=False) : 
     """Drops (if necessary) and re-creates a schema for each of the
-    runs in the configuration list."""
+    runs in the configuration list. In bulk mode the keys and indexes are 
+    left for copy_data() to build."""
+    if len(configs) > 0 : 
+        vt.init_run_store(configs[0])
     for cfg in configs : 
-        vt.initialize_schema_for_postgis(cfg)
+        vt.initialize_schema_for_postgis(cfg, deferred=bulk)
         
-def copy_data(configs, master_schema='master') : 
-    """Copies the active_fire and threshold_burned tables from the master schema to this one."""
+def has_column(cfg, schema, table, column) : 
+    """True if schema.table has the named column"""
+    rows = vt.fetch_query(cfg, 
+        "SELECT count(*) FROM information_schema.columns " +
+        "WHERE table_schema = '{0}' AND table_name = '{1}' AND column_name = '{2}'".format(
+            schema, table, column))
+    return rows[0][0] > 0
+
+def copy_run(args) : 
+    """Copies the active_fire and threshold_burned tables from the master 
+    schema to one run, given (cfg, master_schema, bulk). In bulk mode, the
+    run's keys and indexes are built afterward. Returns the schema and the 
+    seconds spent copying and indexing. A master schema made before the 
+    points carried their Albers coordinates has no geom_albers; the run's
+    column is then left NULL, and the points are projected when needed."""
+    cfg, master_schema, bulk = args
     af_columns = 'fid, latitude, longitude, collection_date, geom, event_fid, pixel_size, band_i_m, masked, geom_nlcd'
     tb_columns = 'fid, latitude, longitude, collection_date, geom, confirmed_burn, pixel_size, band_i_m, masked, geom_nlcd'
+    if has_column(cfg, master_schema, 'active_fire', 'geom_albers') : 
+        af_columns += ', geom_albers'
+    if has_column(cfg, master_schema, 'threshold_burned', 'geom_albers') : 
+        tb_columns += ', geom_albers'
 
     copy_query = 'INSERT INTO "{tgt_schema}".{table}({columns}) SELECT {columns} FROM "{master_schema}".{table}'
 
+    start = time.time()
+    # copy active fire
+    vt.execute_query(cfg, copy_query.format(tgt_schema=cfg.DBschema,
+          table='active_fire', columns=af_columns, master_schema=master_schema))
+    # copy threshold_burned
+    vt.execute_query(cfg, copy_query.format(tgt_schema=cfg.DBschema,
+          table='threshold_burned', columns=tb_columns, master_schema=master_schema))
+    copied = time.time()
+    if bulk : 
+        vt.build_indexes(cfg)
+    return cfg.DBschema, copied - start, time.time() - copied
+
+def link_data(configs, master_schema='master') : 
+    """Replaces the active_fire and threshold_burned tables of each run with
+    views of the tables in the master schema."""
     for cfg in configs : 
-        # copy active fire
-        vt.execute_query(cfg, copy_query.format(tgt_schema=cfg.DBschema,
-              table='active_fire', columns=af_columns, master_schema=master_schema))
-        # copy threshold_burned
-        vt.execute_query(cfg, copy_query.format(tgt_schema=cfg.DBschema,
-              table='threshold_burned', columns=tb_columns, master_schema=master_schema))
+        vt.execute_query(cfg, "SELECT viirs_link_master('{0}', '{1}')".format(
+              cfg.DBschema, master_schema))
+
+def copy_data(configs, master_schema='master', workers=1, bulk=False) : 
+    """Copies the active_fire and threshold_burned tables from the master schema 
+    to each run, using a pool of workers if there is more than one. Returns 
+    the timings of each run as a DataFrame."""
+    work = [ (cfg, master_schema, bulk) for cfg in configs ]
+    if workers > 1 : 
+        mypool = mp.Pool(processes=workers)
+        try : 
+            timings = mypool.map(copy_run, work)
+            mypool.close()
+        except : 
+            mypool.terminate()
+            raise
+        finally : 
+            mypool.join()
+    else : 
+        timings = map(copy_run, work)
+    return pd.DataFrame(timings, columns=['schema', 'copy_seconds', 'index_seconds'])
               
         
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print "Usage: %s <template.ini> <runs.csv>" % sys.argv[0]
+        print "Usage: %s <template.ini> <runs.csv> [workers [bulk|link]]" % sys.argv[0]
         sys.exit()
 
+    workers = 1
+    if len(sys.argv) > 3 : 
+        workers = int(sys.argv[3])
+    mode = None
+    if len(sys.argv) > 4 : 
+        mode = sys.argv[4]
+        if mode not in ['bulk', 'link'] : 
+            raise ValueError("Unknown seeding mode: {0}".format(mode))
+    bulk = (mode == 'bulk')
+
     # load in the template and create the plan of work
     template_ini = vc.VIIRSConfig.load(sys.argv[1])
     table = pd.read_csv(sys.argv[2])
@@ -77,6 +149,13 @@ if __name__ == "__main__":
     p = vc.VIIRSConfig.batch(template_ini, table)
     
     init_directories(p)
-    init_schemas(p)
-    copy_data(p)
+    init_schemas(p, bulk)
+    if mode == 'link' : 
+        link_data(p)
+        sys.exit()
+
+    start = time.time()
+    timings = copy_data(p, workers=workers, bulk=bulk)
+    print timings.to_string(index=False)
+    print "Copied {0} runs in {1:.1f} seconds".format(len(p), time.time() - start)
 
@@ -0,0 +1,390 @@
+"""Runs many threshold configurations against a single read of the data.
+
+viirs_brute hands each configuration to vt.run(), so every configuration
+re-reads and re-decodes the same SVM07/08/10/11, GMTCO and AVAFO files.
+Here, each granule is read once. The pixels which could pass the thresholds
+of *any* of the configurations (the "candidates") are pulled out into a set
+of 1-D feature arrays, and all the threshold vectors are then evaluated
+against the candidates in one vectorized pass. Each configuration's
+detections are written to its own schema/output directory and confirmed as
+usual.
+
+All the configurations must share everything except their vector
+parameters (as produced by VIIRSConfig.batch or
+viirs_brute.reflectance_deltas), because the granule is read using the
+first configuration's BaseDir, dates and geographic window.
+"""
+import viirs_config as vc
+import VIIRS_threshold_reflCor_Bulk as vt
+import viirs_brute as vb
+import numpy as np
+import pandas as pd
+import datetime
+import os.path
+import shutil
+import sys
+import gc
+
+# value of the QA feature when all four bands have good data
+qa_all = 0x0f
+
+# pixels across an M-band granule
+granule_cols = 3200
+
+# (vector, candidate) pairs thresholded at once, unless BlockRows says
+# otherwise
+default_cells = 1 << 22
+
+def envelope(vectors) :
+    """returns a ConfigVector holding the loosest of each reflectance and solar
+    zenith bound in vectors. A pixel which passes the bounds of any one of the
+    vectors also passes the bounds of the envelope. The ratio test and
+    confirmation parameters are copied from the first vector and are not
+    meaningful."""
+    return vectors[0]._replace(
+                M07UB = max([v.M07UB for v in vectors]),
+                M08LB = min([v.M08LB for v in vectors]),
+                M08UB = max([v.M08UB for v in vectors]),
+                M10LB = min([v.M10LB for v in vectors]),
+                M10UB = max([v.M10UB for v in vectors]),
+                M11LB = min([v.M11LB for v in vectors]),
+                MaxSolZen = max([v.MaxSolZen for v in vectors]))
+
+def extract_candidates(env, m07, m08, m10, m11, af, geo) :
+    """selects the pixels which pass the reflectance and solar zenith bounds
+    of env (see envelope()) and returns them as a dictionary of 1-D feature
+    arrays:
+        * M07, M08, M10, M11 : corrected reflectance
+        * SolZen : solar zenith angle
+        * AfClass : 750m active fire class
+        * QA : one bit per band (M07 = 1 ... M11 = 8) where the data are good
+        * Lat, Lon : coordinates
+        * Row, Col : position of the pixel in the granule
+    The reflectance objects must still hold raw counts. Active fire class and
+    QA are not tested here, so that the candidates carry everything needed
+    by threshold_candidates()."""
+    cand = (m07.get_raw() <  m07.count_below(env.M07UB))
+    cand &= (m08.get_raw() >= m08.count_above(env.M08LB))
+    cand &= (m08.get_raw() <  m08.count_below(env.M08UB))
+    cand &= (m10.get_raw() >= m10.count_above(env.M10LB))
+    cand &= (m10.get_raw() <  m10.count_below(env.M10UB))
+    cand &= (m11.get_raw() >= m11.count_above(env.M11LB))
+    cand &= geo.day_pixels(env.MaxSolZen)
+    idx = np.where(cand)
+
+    features = {}
+    for name, refl in [('M07', m07), ('M08', m08), ('M10', m10), ('M11', m11)] :
+        features[name] = refl.get_refl_lut()[refl.get_raw()[idx]]
+
+    qa = np.zeros( (len(idx[0]),), dtype=np.uint8)
+    for bit, refl in enumerate([m07, m08, m10, m11]) :
+        qa |= (refl.qa[idx].astype(np.uint8) << bit)
+    features['QA'] = qa
+
+    features['SolZen']  = geo.SolZen[idx]
+    features['AfClass'] = af.AfArray[idx]
+    features['Lat']     = geo.LatArray[idx]
+    features['Lon']     = geo.LonArray[idx]
+
+    rows, cols = getattr(geo, 'region', (slice(0,None), slice(0,None)))
+    features['Row'] = idx[0] + rows.start
+    features['Col'] = idx[1] + cols.start
+    return features
+
+def _bounds(vectors, name, dtype) :
+    """column of the named parameter from all the vectors, in the same
+    precision as the features so that comparisons behave as in ba_threshold()"""
+    return np.array([getattr(v, name) for v in vectors], dtype=dtype)[:,np.newaxis]
+
+def threshold_candidates(vectors, cand, cells=default_cells) :
+    """evaluates every threshold vector against the candidate features.
+    Returns a boolean array of shape (len(vectors), number of candidates),
+    where row i is the burned area mask for vectors[i]. For the candidates,
+    the result is identical to ba_threshold().
+
+    The candidates are taken in chunks, so that the temporaries hold about
+    cells (vector, candidate) pairs at a time."""
+    refl_t = cand['M07'].dtype
+    bounds = {}
+    for name in ['M07UB', 'M08LB', 'M08UB', 'M10LB', 'M10UB', 'M11LB',
+                 'RthSub', 'Rth', 'RthLB'] :
+        bounds[name] = _bounds(vectors, name, refl_t)
+    bounds['MaxSolZen'] = _bounds(vectors, 'MaxSolZen', cand['SolZen'].dtype)
+
+    ncand = len(cand['M07'])
+    mask = np.empty((len(vectors), ncand), dtype=np.bool)
+    step = max(1, cells // max(1, len(vectors)))
+    for start in range(0, ncand, step) :
+        chunk = slice(start, min(start+step, ncand))
+        M07 = cand['M07'][chunk][np.newaxis,:]
+        M08 = cand['M08'][chunk][np.newaxis,:]
+        M10 = cand['M10'][chunk][np.newaxis,:]
+        M11 = cand['M11'][chunk][np.newaxis,:]
+
+        m = ((M07 < bounds['M07UB']) &
+             (M08 > bounds['M08LB']) &
+             (M08 < bounds['M08UB']) &
+             (M10 > bounds['M10LB']) &
+             (M10 < bounds['M10UB']) &
+             (M11 > bounds['M11LB']) &
+             (cand['SolZen'][chunk] < bounds['MaxSolZen']))
+
+        with np.errstate(divide='ignore', invalid='ignore') :
+            Ratio = (M08 - bounds['RthSub']) / M11
+        m &= ((M11 != 0) &
+              (Ratio >= bounds['RthLB']) &
+              (Ratio < bounds['Rth']))
+
+        # all vectors require non-fire pixels with good data in every band.
+        m &= ((cand['AfClass'][chunk] == 5) & (cand['QA'][chunk] == qa_all))
+        mask[:, chunk] = m
+    return mask
+
+def granule_candidates(template, env, files) :
+    """reads a granule and returns the candidate features (see
+    extract_candidates()), restricted to the geographic window, along with
+    the 750m active fire list. Returns None for the features if the granule
+    lies outside the window."""
+    granule = vt.load_750(template, files)
+    if granule is None :
+        return None, vt.empty_750(template)[1]
+    m07, m08, m10, m11, af_750, geo_750 = granule
+    cand = extract_candidates(env, m07, m08, m10, m11, af_750, geo_750)
+
+    if template.has_window() :
+        inside = ((cand['Lat'] <= template.north) &
+                  (cand['Lat'] >= template.south) &
+                  (cand['Lon'] >= template.west) &
+                  (cand['Lon'] <= template.east))
+        for k in cand.keys() :
+            cand[k] = cand[k][inside]
+
+    AfOut_list = None
+    if template.use750af == "y":
+        AfOut_list = vt.af750_list(template, af_750, geo_750)
+    return cand, AfOut_list
+
+def covers(env, vec) :
+    """true if every pixel passing the bounds of vec also passes the bounds
+    of env, so that candidates selected with env can be thresholded with vec"""
+    return ((vec.M07UB <= env.M07UB) and (vec.M08LB >= env.M08LB) and
+            (vec.M08UB <= env.M08UB) and (vec.M10LB >= env.M10LB) and
+            (vec.M10UB <= env.M10UB) and (vec.M11LB >= env.M11LB) and
+            (vec.MaxSolZen <= env.MaxSolZen))
+
+def store_settings(config) :
+    """the settings of config, other than the vector, which decide what a
+    feature store holds: input directory, active fire options, geographic
+    window and dates. Values are strings, as saved in the store."""
+    settings = { 'BaseDir' : config.BaseDir,
+                 'use375af' : config.use375af.lower(),
+                 'use750af' : config.use750af.lower(),
+                 'limit375' : str(getattr(config, 'limit375', '')),
+                 'window' : '',
+                 'ImageDates' : ','.join(sorted(config.ImageDates)) }
+    if config.has_window() :
+        settings['window'] = ','.join([ str(float(v)) for v in
+                    [config.north, config.south, config.east, config.west] ])
+    return settings
+
+def same_settings(stored, wanted) :
+    """true if a store with the stored settings can serve a configuration
+    with the wanted settings: everything matches, and the wanted dates are
+    among the stored ones"""
+    for name in stored :
+        if name != 'ImageDates' and stored[name] != wanted[name] :
+            return False
+    return set(wanted['ImageDates'].split(',')) <= set(stored['ImageDates'].split(','))
+
+def _save_points(filename, points) :
+    np.save(filename, np.array(points).reshape((-1,2)))
+
+def _load_points(filename) :
+    if not os.path.exists(filename) :
+        return None
+    points = np.load(filename)
+    return zip(points[:,0], points[:,1])
+
+class FeatureStore (object) :
+    """A directory of candidate pixel features, so that sweeps can be
+    re-run without reading any granules.
+
+    The store holds one subdirectory per ImageDate, containing one .npy
+    file per feature (see extract_candidates()) plus the 750m and 375m
+    active fire points. Feature files are memory mapped when loaded. The
+    envelope used to select the candidates is saved in envelope.csv; any
+    vector which the envelope covers can be thresholded from the store.
+    The input directory, geographic window, active fire settings and dates
+    of the template configuration used to build the store are saved in
+    settings.csv (see store_settings()), and only configurations with the
+    same settings can use the store."""
+
+    def __init__(self, path) :
+        self.path = path
+        self.envelope = None
+        self.settings = None
+        env_file = os.path.join(path, "envelope.csv")
+        settings_file = os.path.join(path, "settings.csv")
+        if os.path.exists(env_file) and os.path.exists(settings_file) :
+            row = pd.read_csv(env_file).iloc[0,:]
+            self.envelope = vc.ConfigVector(**dict([(p, row[p]) for p in vc.vector_param_names]))
+            row = pd.read_csv(settings_file, dtype=str, keep_default_na=False).iloc[0,:]
+            self.settings = dict(row)
+
+    @classmethod
+    def create(cls, path, template, vectors) :
+        """scans every granule of template once, saving the candidates for
+        the envelope of vectors into a new store at path."""
+        env = envelope(vectors)
+        if not os.path.exists(path) :
+            os.makedirs(path)
+        # the store is not valid until it is complete
+        for f in ["envelope.csv", "settings.csv"] :
+            if os.path.exists(os.path.join(path, f)) :
+                os.remove(os.path.join(path, f))
+        for ImageDate in template.SortedImageDates :
+            print "Extracting candidates from", ImageDate
+            fileset = vt.FileSet.from_imagedate(ImageDate)
+            files = fileset.get_file_names(template.BaseDir)
+            cand, AfOut_list = granule_candidates(template, env, files)
+
+            # nothing may be left from an earlier build
+            date_dir = os.path.join(path, ImageDate)
+            if os.path.exists(date_dir) :
+                shutil.rmtree(date_dir)
+            os.makedirs(date_dir)
+            if cand is not None :
+                for name, values in cand.items() :
+                    np.save(os.path.join(date_dir, name + ".npy"), values)
+            if AfOut_list is not None :
+                _save_points(os.path.join(date_dir, "af750.npy"), AfOut_list)
+            if template.use375af == "y" :
+                _save_points(os.path.join(date_dir, "af375.npy"),
+                             vt.threshold_375(template, files))
+
+        pd.DataFrame([store_settings(template)]).to_csv(
+                    os.path.join(path, "settings.csv"), index=False)
+        pd.DataFrame([env._asdict()]).to_csv(os.path.join(path, "envelope.csv"),
+                                             index=False)
+        return cls(path)
+
+    def covers(self, template, vectors) :
+        """true if all the vectors can be thresholded from this store, with
+        the settings of template"""
+        return ((self.envelope is not None) and
+                same_settings(self.settings, store_settings(template)) and
+                all([covers(self.envelope, v) for v in vectors]))
+
+    def load(self, ImageDate) :
+        """returns (cand, AfOut_list, Af375Out_list) for the ImageDate. cand is
+        None if the granule had no pixels inside the window."""
+        date_dir = os.path.join(self.path, ImageDate)
+        if not os.path.isdir(date_dir) :
+            raise ValueError("{0} is not in the feature store {1}".format(ImageDate, self.path))
+        cand = None
+        if os.path.exists(os.path.join(date_dir, "M07.npy")) :
+            cand = {}
+            for f in os.listdir(date_dir) :
+                name = os.path.splitext(f)[0]
+                if not name.startswith('af') :
+                    cand[name] = np.load(os.path.join(date_dir, f), mmap_mode='r')
+        return (cand, _load_points(os.path.join(date_dir, "af750.npy")),
+                      _load_points(os.path.join(date_dir, "af375.npy")))
+
+def sweep(configs, store=None) :
+    """processes all the configurations in configs, reading each granule once.
+    Each configuration's detections are written and confirmed exactly as
+    vt.run() would, except that text output goes in a TextOut directory
+    under each configuration's ShapePath.
+
+    If a FeatureStore is given, the candidates are taken from it and no
+    granules are read. The store must cover all the configurations."""
+    template = configs[0]
+    vectors  = [ c.get_vector() for c in configs ]
+    env = envelope(vectors)
+    cells = default_cells
+    if template.has_blocks() :
+        # no more work space than one vector thresholding a block of rows
+        cells = template.BlockRows * granule_cols
+    for config in configs[1:] :
+        if store_settings(config) != store_settings(template) :
+            raise ValueError("Configurations differ in more than their thresholds")
+    if (store is not None) and not store.covers(template, vectors) :
+        raise ValueError("Configurations are not covered by the feature store")
+
+    vt.init_run_store(template)
+    engines = [ None ] * len(configs)
+    for i, config in enumerate(configs) :
+        if config.DatabaseOut == "y":
+            vt.initialize_schema_for_postgis(config)
+            engines[i] = vt.get_confirmer(config)
+            vt.get_landmask(config)
+
+    count = 0
+    start_group = datetime.datetime.now()
+    for ImageDate in template.SortedImageDates :
+        count = count + 1
+        print "Processing number:", count, "of:", len(template.SortedImageDates)
+        print ImageDate + '\n'
+
+        fileset = vt.FileSet.from_imagedate(ImageDate)
+        if store is not None :
+            cand, AfOut_list, Af375Out_list = store.load(ImageDate)
+        else :
+            files = fileset.get_file_names(template.BaseDir)
+            cand, AfOut_list = granule_candidates(template, env, files)
+            Af375Out_list = None
+            if template.use375af == "y" :
+                Af375Out_list = vt.threshold_375(template, files)
+
+        if cand is not None :
+            masks = threshold_candidates(vectors, cand, cells)
+            print "{0} candidate pixels for {1} configurations".format(
+                        masks.shape[1], masks.shape[0])
+
+        for i, config in enumerate(configs) :
+            BaOut_list = []
+            if cand is not None :
+                BaOut_list = zip(cand['Lat'][masks[i]], cand['Lon'][masks[i]])
+            vt.write_granule(config, fileset, BaOut_list, AfOut_list, Af375Out_list,
+                             os.path.join(config.ShapePath, "TextOut"))
+            if config.DatabaseOut == "y" :
+                vt.confirm_granule(config, fileset, engines[i])
+
+        cand = None
+        masks = None
+        gc.collect()
+
+    for config, engine in zip(configs, engines) :
+        vt.finish_run(config, engine)
+
+    end_group = datetime.datetime.now()
+    print "Elapsed time for sweep:", (end_group - start_group).total_seconds(), "seconds"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "\nMissing argrument"
+        print "\nEnter the template ini file and the parameter table (csv) as arguments."
+        print "e.g., viirs_sweep.py VIIRS_threshold.ini runs.csv"
+        print "A feature store directory may be given as a third argument. It is"
+        print "created on the first run and reused while it covers the thresholds.\n"
+        sys.exit()
+
+    template_ini = vc.VIIRSConfig.load(sys.argv[1])
+    table = pd.read_csv(sys.argv[2])
+    p = vc.VIIRSConfig.batch(template_ini, table)
+
+    run_info_file = "{0}_schema_info.csv".format(template_ini.DBname)
+    print "Saving planned run information to {0}.".format(run_info_file)
+    vb.make_run_info_table(p).to_csv(run_info_file)
+
+    store = None
+    if len(sys.argv) > 3 :
+        store = FeatureStore(sys.argv[3])
+        if not store.covers(p[0], [c.get_vector() for c in p]) :
+            print "Building feature store {0}.".format(sys.argv[3])
+            store = FeatureStore.create(sys.argv[3], p[0], [c.get_vector() for c in p])
+
+    print "Sweeping {0} configurations.".format(len(p))
+    sweep(p, store)